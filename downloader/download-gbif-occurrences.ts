@@ -20,12 +20,19 @@
  * Options:
  *   --taxon <name>     Taxon to download (plantae, fungi, mammalia, etc.) [default: plantae]
  *   --country <code>   ISO country code (GB, US, FR, etc.) [default: GB]
+ *   --bbox <w,s,e,n>   Download a bounding box instead of a country. Leaves out the
+ *                      country and basis-of-record filters, so the download holds
+ *                      every record the occurrence search returns in the box
  *   --format <type>    Download format: DWCA, SIMPLE_CSV, SPECIES_LIST [default: DWCA]
  *   --dry-run          Show the query without submitting
  *
  * ## Output
  *
  * Downloads are saved to: $DATADIR/gbif-occurrences-<taxon>-<country>-<timestamp>.zip
+ * (or ...-<taxon>-bbox-<timestamp>.zip), with the request and its GBIF
+ * download key and creation time next to it in <same name>.request.json.
+ * experiments/ingest_occurrences.py reads that file to tell which bbox the
+ * download covers in full; only --bbox downloads cover one.
  *
  * DWCA format includes:
  * - occurrence.txt: Main occurrence records with all Darwin Core fields
@@ -80,9 +87,12 @@ async function sleep(ms: number): Promise<void> {
   return new Promise((resolve) => setTimeout(resolve, ms));
 }
 
+type BBox = [number, number, number, number];
+
 function parseArgs(): {
   taxon: string;
   country: string;
+  bbox: BBox | null;
   format: "DWCA" | "SIMPLE_CSV" | "SPECIES_LIST";
   dryRun: boolean;
 } {
@@ -90,6 +100,7 @@ function parseArgs(): {
   const result = {
     taxon: "plantae",
     country: "GB",
+    bbox: null as BBox | null,
     format: "DWCA" as const,
     dryRun: false,
   };
@@ -102,6 +113,14 @@ function parseArgs(): {
       case "--country":
         result.country = args[++i]?.toUpperCase() || result.country;
         break;
+      case "--bbox": {
+        const values = (args[++i] || "").split(",").map(Number);
+        if (values.length !== 4 || values.some(Number.isNaN)) {
+          throw new Error("--bbox expects min_lon,min_lat,max_lon,max_lat");
+        }
+        result.bbox = values as BBox;
+        break;
+      }
       case "--format":
         const fmt = args[++i]?.toUpperCase();
         if (fmt === "DWCA" || fmt === "SIMPLE_CSV" || fmt === "SPECIES_LIST") {
@@ -117,7 +136,11 @@ function parseArgs(): {
   return result;
 }
 
-function buildPredicate(taxon: string, country: string): DownloadRequest["predicate"] {
+function buildPredicate(
+  taxon: string,
+  country: string,
+  bbox: BBox | null
+): DownloadRequest["predicate"] {
   const taxonConfig = TAXON_KEYS[taxon];
   if (!taxonConfig) {
     throw new Error(
@@ -126,28 +149,42 @@ function buildPredicate(taxon: string, country: string): DownloadRequest["predic
   }
 
   const predicates: object[] = [
-    // Country filter
-    { type: "equals", key: "COUNTRY", value: country },
     // Has coordinates
     { type: "equals", key: "HAS_COORDINATE", value: true },
     // No geospatial issues
     { type: "equals", key: "HAS_GEOSPATIAL_ISSUE", value: false },
-    // Exclude fossils and citations
-    {
-      type: "in",
-      key: "BASIS_OF_RECORD",
-      values: [
-        "HUMAN_OBSERVATION",
-        "MACHINE_OBSERVATION",
-        "PRESERVED_SPECIMEN",
-        "OCCURRENCE",
-        "MATERIAL_SAMPLE",
-        "OBSERVATION",
-        "LIVING_SPECIMEN",
-      ],
-    },
   ];
 
+  if (bbox) {
+    // Same filters as the occurrence search queries, within the box
+    const [minLon, minLat, maxLon, maxLat] = bbox;
+    predicates.push(
+      { type: "greaterThanOrEquals", key: "DECIMAL_LONGITUDE", value: minLon },
+      { type: "lessThanOrEquals", key: "DECIMAL_LONGITUDE", value: maxLon },
+      { type: "greaterThanOrEquals", key: "DECIMAL_LATITUDE", value: minLat },
+      { type: "lessThanOrEquals", key: "DECIMAL_LATITUDE", value: maxLat }
+    );
+  } else {
+    predicates.push(
+      // Country filter
+      { type: "equals", key: "COUNTRY", value: country },
+      // Exclude fossils and citations
+      {
+        type: "in",
+        key: "BASIS_OF_RECORD",
+        values: [
+          "HUMAN_OBSERVATION",
+          "MACHINE_OBSERVATION",
+          "PRESERVED_SPECIMEN",
+          "OCCURRENCE",
+          "MATERIAL_SAMPLE",
+          "OBSERVATION",
+          "LIVING_SPECIMEN",
+        ],
+      }
+    );
+  }
+
   // Add taxon filter based on type
   const keyField =
     taxonConfig.type === "kingdom"
@@ -239,7 +276,7 @@ function formatDuration(ms: number): string {
 }
 
 async function main() {
-  const { taxon, country, format, dryRun } = parseArgs();
+  const { taxon, country, bbox, format, dryRun } = parseArgs();
 
   const username = process.env.GBIF_USERNAME;
   const password = process.env.GBIF_PASSWORD;
@@ -256,7 +293,7 @@ async function main() {
     process.exit(1);
   }
 
-  const predicate = buildPredicate(taxon, country);
+  const predicate = buildPredicate(taxon, country, bbox);
 
   const request: DownloadRequest = {
     creator: username || "dry-run",
@@ -270,7 +307,7 @@ async function main() {
   console.log("GBIF Occurrence Download Request");
   console.log("=".repeat(60));
   console.log(`Taxon:    ${taxon}`);
-  console.log(`Country:  ${country}`);
+  console.log(bbox ? `BBox:     ${bbox.join(",")}` : `Country:  ${country}`);
   console.log(`Format:   ${format}`);
   console.log("");
   console.log("Query predicate:");
@@ -320,13 +357,25 @@ async function main() {
 
       // Download the file
       const timestamp = new Date().toISOString().slice(0, 10);
-      const outputPath = `${dataDir}/gbif-occurrences-${taxon}-${country.toLowerCase()}-${timestamp}.zip`;
+      const region = bbox ? "bbox" : country.toLowerCase();
+      const outputBase = `${dataDir}/gbif-occurrences-${taxon}-${region}-${timestamp}`;
+      const outputPath = `${outputBase}.zip`;
 
       console.log(`Downloading to: ${outputPath}`);
       const downloadStart = Date.now();
 
       await downloadFile(status.downloadLink!, outputPath);
 
+      // Record what the download holds, for ingest_occurrences.py
+      const fs = await import("fs");
+      const requestInfo = {
+        key: downloadKey,
+        created: status.created,
+        format: request.format,
+        predicate: request.predicate,
+      };
+      fs.writeFileSync(`${outputBase}.request.json`, JSON.stringify(requestInfo, null, 2));
+
       const downloadTime = formatDuration(Date.now() - downloadStart);
       console.log(`Download complete in ${downloadTime}`);
       console.log("");
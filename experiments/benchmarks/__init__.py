@@ -0,0 +1,3 @@
+"""
+Benchmarks for the finder pipeline, run against synthetic Tessera tiles.
+"""
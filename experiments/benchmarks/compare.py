@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files.
+
+Usage:
+    uv run python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+
+def load_results(path: Path) -> tuple[dict, dict[tuple[str, str], dict]]:
+    """Read a results file. Returns (meta, {(region, benchmark): row})."""
+    with open(path) as f:
+        report = json.load(f)
+    rows = {(r["region"], r["benchmark"]): r for r in report["results"]}
+    return report["meta"], rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline", help="Baseline results JSON")
+    parser.add_argument("candidate", help="Candidate results JSON")
+    parser.add_argument("--threshold", type=float, default=1.1,
+                        help="Flag time or memory ratios above this (default: 1.1)")
+    args = parser.parse_args()
+
+    base_meta, base = load_results(Path(args.baseline))
+    cand_meta, cand = load_results(Path(args.candidate))
+
+    print(f"Baseline:  {base_meta['commit']} ({base_meta['timestamp']})")
+    print(f"Candidate: {cand_meta['commit']} ({cand_meta['timestamp']})")
+    print()
+    print(f"{'Region':>6} {'Benchmark':<46} {'Base ms':>10} {'New ms':>10} {'Time':>7} {'Mem':>7}")
+    print("-" * 92)
+
+    for key in sorted(set(base) & set(cand)):
+        region, name = key
+        old, new = base[key], cand[key]
+        time_ratio = new["seconds"] / old["seconds"] if old["seconds"] else float("nan")
+        mem_ratio = new["peak_mb"] / old["peak_mb"] if old["peak_mb"] else float("nan")
+        flag = " !" if max(time_ratio, mem_ratio) > args.threshold else ""
+        print(
+            f"{region:>6} {name:<46} {old['seconds']*1000:>10.1f} {new['seconds']*1000:>10.1f} "
+            f"{time_ratio:>6.2f}x {mem_ratio:>6.2f}x{flag}"
+        )
+
+    missing = sorted(set(base) ^ set(cand))
+    if missing:
+        print(f"\nOnly in one file: {', '.join(f'{r}/{n}' for r, n in missing)}")
+
+
+if __name__ == "__main__":
+    main()
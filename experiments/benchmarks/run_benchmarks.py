@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Benchmark finder pipeline stages on synthetic Tessera tiles.
+
+Generates synthetic tiles and occurrences for several region sizes, then
+records wall time (best of --repeat runs) and peak traced memory for each
+stage. Results are written as JSON to benchmarks/results/ (named by time
+and git commit) for comparison across commits with benchmarks.compare.
+
+Usage:
+    uv run python -m benchmarks.run_benchmarks
+    uv run python -m benchmarks.run_benchmarks --regions 1x1,2x2,4x4 --tile-pixels 200 --repeat 5
+"""
+
+import os
+
+# Progress bars would swamp the timings output
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import sklearn
+import torch
+
+from finder import EmbeddingMosaic
+from finder.methods import ClassifierMethod, MLPClassifierMethod
+from finder.pipeline import PredictionResult, sample_background
+from predict_local import predict_local
+
+from .synthetic import region_bbox, synthetic_occurrences, write_synthetic_tiles
+
+RESULTS_DIR = Path(__file__).parent / "results"
+SPECIES_KEY = 1
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """
+    Time a callable and measure its peak traced allocation.
+
+    Timing runs are done without tracemalloc (which slows allocation-heavy
+    code); one further run under tracemalloc gives the peak memory.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "seconds_all": times,
+        "peak_mb": peak / 1e6,
+    }
+
+
+def git_commit() -> dict:
+    """Current git commit and whether the tree has local changes."""
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+    return {"commit": sha, "dirty": dirty}
+
+
+def benchmark_region(
+    workdir: Path,
+    n_tiles: tuple[int, int],
+    tile_pixels: int,
+    n_channels: int,
+    n_occurrences: int,
+    n_background: int,
+    mc_samples: int,
+    grid_size_m: int,
+    repeat: int,
+) -> list[dict]:
+    """Run every stage benchmark for one synthetic region size."""
+    region = f"{n_tiles[0]}x{n_tiles[1]}"
+    cache_dir = workdir / region / "cache"
+    models_dir = workdir / region / "models"
+    output_dir = workdir / region / "output"
+
+    bbox = region_bbox(*n_tiles)
+    tiles = write_synthetic_tiles(cache_dir, bbox, tile_pixels=tile_pixels, n_channels=n_channels)
+    occurrences = synthetic_occurrences(bbox, n_occurrences)
+
+    mosaic = EmbeddingMosaic(cache_dir, bbox)
+    mosaic.load()
+    h, w, c = mosaic.shape
+    all_embeddings = mosaic.get_all_embeddings()
+
+    positive, valid_coords = mosaic.sample_at_coords(occurrences)
+    negative, _ = sample_background(mosaic, n_background, valid_coords)
+
+    logistic = ClassifierMethod()
+    logistic.fit(positive, negative)
+    mlp = MLPClassifierMethod(n_epochs=5, device="cpu")
+    mlp.fit(positive, negative, verbose=False)
+
+    (models_dir / "logistic").mkdir(parents=True, exist_ok=True)
+    (models_dir / "mlp").mkdir(parents=True, exist_ok=True)
+    logistic.save(models_dir / "logistic" / f"{SPECIES_KEY}.pkl")
+    mlp.save(models_dir / "mlp" / f"{SPECIES_KEY}.pt")
+
+    scores = logistic.predict(all_embeddings).reshape(h, w)
+    result = PredictionResult(
+        species_name="Synthetic species",
+        taxon_key=SPECIES_KEY,
+        n_occurrences=len(valid_coords),
+        n_background=len(negative),
+        scores=scores,
+        transform=mosaic.transform,
+        bbox=bbox,
+    )
+    center_lon = (bbox[0] + bbox[2]) / 2
+    center_lat = (bbox[1] + bbox[3]) / 2
+
+    def load_mosaic():
+        EmbeddingMosaic(cache_dir, bbox).load()
+
+    stages: dict[str, Callable[[], object]] = {
+        "EmbeddingMosaic.load": load_mosaic,
+        "EmbeddingMosaic.sample_at_coords": lambda: mosaic.sample_at_coords(occurrences),
+        "sample_background": lambda: sample_background(mosaic, n_background, valid_coords),
+        "ClassifierMethod.predict": lambda: logistic.predict(all_embeddings),
+        "MLPClassifierMethod.predict_with_uncertainty": lambda: mlp.predict_with_uncertainty(
+            all_embeddings, n_samples=mc_samples
+        ),
+        "PredictionResult.to_geojson": lambda: result.to_geojson(),
+        "PredictionResult.save": lambda: result.save(output_dir),
+        "predict_local[logistic]": lambda: predict_local(
+            center_lat, center_lon, SPECIES_KEY, grid_size_m=grid_size_m,
+            model_type="logistic", cache_dir=cache_dir, models_dir=models_dir,
+        ),
+        "predict_local[mlp]": lambda: predict_local(
+            center_lat, center_lon, SPECIES_KEY, grid_size_m=grid_size_m,
+            model_type="mlp", n_mc_samples=mc_samples, cache_dir=cache_dir, models_dir=models_dir,
+        ),
+    }
+
+    rows = []
+    for name, fn in stages.items():
+        stats = measure(fn, repeat)
+        rows.append({
+            "benchmark": name,
+            "region": region,
+            "n_tiles": len(tiles),
+            "n_pixels": h * w,
+            "n_channels": c,
+            **stats,
+        })
+        print(f"  {region:>6} {name:<46} {stats['seconds']*1000:>10.1f} ms {stats['peak_mb']:>9.1f} MB")
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark finder pipeline stages")
+    parser.add_argument("--regions", default="1x1,2x2,4x4",
+                        help="Comma-separated region sizes in tiles (default: 1x1,2x2,4x4)")
+    parser.add_argument("--tile-pixels", type=int, default=100, help="Tile height/width in pixels")
+    parser.add_argument("--channels", type=int, default=128, help="Embedding channels")
+    parser.add_argument("--occurrences", type=int, default=1000, help="Synthetic occurrences per region")
+    parser.add_argument("--background", type=int, default=5000, help="Background samples")
+    parser.add_argument("--mc-samples", type=int, default=30, help="MC Dropout passes")
+    parser.add_argument("--grid-size", type=int, default=500, help="predict_local grid size in meters")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per stage (best is kept)")
+    parser.add_argument("-o", "--output", help="Output JSON path (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    regions = [tuple(int(n) for n in r.split("x")) for r in args.regions.split(",")]
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    git = git_commit()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="finder-bench-") as tmp:
+        for n_tiles in regions:
+            rows.extend(benchmark_region(
+                Path(tmp),
+                n_tiles,
+                tile_pixels=args.tile_pixels,
+                n_channels=args.channels,
+                n_occurrences=args.occurrences,
+                n_background=args.background,
+                mc_samples=args.mc_samples,
+                grid_size_m=args.grid_size,
+                repeat=args.repeat,
+            ))
+
+    now = datetime.now(timezone.utc)
+    report = {
+        "meta": {
+            **git,
+            "timestamp": now.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "params": params,
+        },
+        "results": rows,
+    }
+
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        output_path = RESULTS_DIR / f"{now:%Y%m%d-%H%M%S}_{git['commit']}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Synthetic Tessera tiles and occurrence sets for benchmarking.
+
+Tiles are written in the same layout as the real embedding cache:
+{cache_dir}/{year}/grid_{lon:.2f}_{lat:.2f}/grid_{lon:.2f}_{lat:.2f}.npy
+(int8, H x W x C) plus grid_{lon:.2f}_{lat:.2f}_scales.npy (float32, H x W).
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from finder.tiles import TileCatalog, tile_name
+
+TILE_SIZE = 0.1  # degrees
+
+
+def tile_grid(
+    bbox: tuple[float, float, float, float],
+    tile_size: float = TILE_SIZE,
+) -> list[tuple[float, float]]:
+    """Tile names (lon, lat) that EmbeddingMosaic.load looks for over a bbox."""
+    catalog = TileCatalog(Path("."), tile_size=tile_size)
+    xs, ys = catalog.grid_range(bbox)
+    return [catalog.tile_coords((ix, iy)) for ix in xs for iy in ys]
+
+
+def region_bbox(
+    n_tiles_x: int,
+    n_tiles_y: int,
+    origin: tuple[float, float] = (0.05, 52.05),
+    tile_size: float = TILE_SIZE,
+) -> tuple[float, float, float, float]:
+    """Bbox spanning roughly n_tiles_x by n_tiles_y tiles from a tile corner."""
+    lon0, lat0 = origin
+    margin = tile_size * 0.05
+    return (
+        round(lon0 + margin, 4),
+        round(lat0 + margin, 4),
+        round(lon0 + n_tiles_x * tile_size - margin, 4),
+        round(lat0 + n_tiles_y * tile_size - margin, 4),
+    )
+
+
+def write_synthetic_tiles(
+    cache_dir: Path,
+    bbox: tuple[float, float, float, float],
+    year: int = 2024,
+    tile_pixels: int = 100,
+    n_channels: int = 128,
+    empty_fraction: float = 0.05,
+    seed: int = 0,
+) -> list[Path]:
+    """
+    Write quantized tiles and scale files covering a bbox.
+
+    Embeddings are a smooth low-rank field plus noise, so nearby pixels are
+    similar as in real data. A band of rows in each tile is left empty
+    (all-zero) to exercise the empty-pixel handling.
+
+    Args:
+        cache_dir: Root of the embedding cache
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        year: Year subdirectory to write into
+        tile_pixels: Tile height and width in pixels
+        n_channels: Embedding dimension
+        empty_fraction: Fraction of rows per tile left empty
+        seed: Random seed
+
+    Returns:
+        Paths of the tile directories written
+    """
+    rng = np.random.default_rng(seed)
+    year_dir = Path(cache_dir) / str(year)
+    basis = rng.normal(size=(8, n_channels)).astype(np.float32)
+    n_empty = int(round(tile_pixels * empty_fraction))
+
+    written = []
+    for tile_lon, tile_lat in tile_grid(bbox):
+        name = tile_name(tile_lon, tile_lat)
+        tile_dir = year_dir / name
+        tile_dir.mkdir(parents=True, exist_ok=True)
+
+        # Smooth latent field (8 factors) mixed into n_channels, plus noise
+        y, x = np.mgrid[0:tile_pixels, 0:tile_pixels] / tile_pixels
+        phases = rng.uniform(0, 2 * np.pi, size=8)
+        freqs = rng.uniform(1, 6, size=8)
+        latent = np.sin(freqs * (x[..., None] + y[..., None]) * np.pi + phases)
+        values = latent.astype(np.float32) @ basis
+        values += rng.normal(scale=0.3, size=values.shape).astype(np.float32)
+
+        scales = (np.abs(values).max(axis=-1) / 127.0).astype(np.float32)
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.round(values / scales[..., None]), -127, 127).astype(np.int8)
+        if n_empty:
+            quantized[:n_empty] = 0
+
+        np.save(tile_dir / f"{name}.npy", quantized)
+        np.save(tile_dir / f"{name}_scales.npy", scales)
+        written.append(tile_dir)
+
+    return written
+
+
+def synthetic_occurrences(
+    bbox: tuple[float, float, float, float],
+    n: int,
+    n_clusters: int = 5,
+    cluster_fraction: float = 0.7,
+    seed: int = 0,
+) -> list[tuple[float, float]]:
+    """
+    Random occurrence coordinates inside a bbox.
+
+    Most points are clustered around a few centres (as real records are
+    around towns and reserves); the rest are uniform. Clustered points
+    often share a pixel, as heavily recorded species do.
+
+    Returns:
+        List of (longitude, latitude) tuples
+    """
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = bbox
+    n_clustered = int(n * cluster_fraction)
+
+    centres = np.column_stack([
+        rng.uniform(min_lon, max_lon, n_clusters),
+        rng.uniform(min_lat, max_lat, n_clusters),
+    ])
+    spread = 0.02 * min(max_lon - min_lon, max_lat - min_lat)
+    clustered = centres[rng.integers(0, n_clusters, n_clustered)]
+    clustered = clustered + rng.normal(scale=spread, size=clustered.shape)
+
+    uniform = np.column_stack([
+        rng.uniform(min_lon, max_lon, n - n_clustered),
+        rng.uniform(min_lat, max_lat, n - n_clustered),
+    ])
+
+    points = np.vstack([clustered, uniform])
+    points[:, 0] = np.clip(points[:, 0], min_lon, max_lon)
+    points[:, 1] = np.clip(points[:, 1], min_lat, max_lat)
+    # Round like GBIF coordinates (5 decimal places)
+    points = np.round(points, 5)
+    return [(float(lon), float(lat)) for lon, lat in points]
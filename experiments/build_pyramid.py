@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Precompute the embedding pyramid used for quick-look maps of large areas.
+
+Writes mean-pooled embeddings and valid-pixel fractions at several levels
+next to each cached tile (see finder/pyramid.py). Levels missing at run
+time are built on demand, so this only moves the cost up front.
+
+Usage:
+    uv run python build_pyramid.py --levels 2,4,6
+    uv run python build_pyramid.py --region cambridge
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from finder.pipeline import REGIONS
+from finder.pyramid import PYRAMID_LEVELS, build_pyramid
+from finder.tiles import TILE_SIZE, get_catalog
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent
+CACHE_DIR = PROJECT_ROOT / "cache"
+YEAR = 2024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the embedding pyramid")
+    parser.add_argument("--region", choices=list(REGIONS.keys()), help="Only tiles of this region")
+    parser.add_argument("--bbox", help="Only tiles in min_lon,min_lat,max_lon,max_lat")
+    parser.add_argument("--levels", default=",".join(map(str, PYRAMID_LEVELS)),
+                        help="Comma-separated levels; level L pools 2**L x 2**L pixels "
+                             f"(default: {','.join(map(str, PYRAMID_LEVELS))})")
+    parser.add_argument("--year", type=int, default=YEAR, help=f"Embedding year (default: {YEAR})")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild levels that already exist")
+    args = parser.parse_args()
+
+    bbox = None
+    if args.region:
+        bbox = REGIONS[args.region]["bbox"]
+    elif args.bbox:
+        bbox = tuple(map(float, args.bbox.split(",")))
+
+    levels = tuple(int(level) for level in args.levels.split(","))
+    if any(level < 1 for level in levels):
+        parser.error("Levels must be >= 1")
+
+    catalog = get_catalog(CACHE_DIR, args.year, TILE_SIZE)
+    start = time.perf_counter()
+    n_written = build_pyramid(catalog, levels, bbox=bbox, overwrite=args.overwrite)
+    logger.info(
+        f"Wrote levels {levels} for {n_written:,}/{len(catalog):,} tiles "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
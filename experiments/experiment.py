@@ -13,8 +13,9 @@ Supports two model types:
 import argparse
 import json
 import logging
+import time
 from pathlib import Path
-from typing import Literal, Tuple
+from typing import Literal, Optional, Tuple
 
 import numpy as np
 from sklearn.linear_model import LogisticRegression
@@ -24,8 +25,14 @@ import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, TensorDataset
 
-from finder import get_species_info, fetch_occurrences, EmbeddingMosaic
+from finder import get_species_info, EmbeddingMosaic, FeatureStore, load_occurrence_features
+from finder.background import BackgroundBank, load_background_bank
+from finder.cache import DEFAULT_TTL_DAYS, MatchCache, OccurrenceCache
+from finder.ingest import OccurrenceArchive
+from finder.instrument import traced
 from finder.pipeline import REGIONS
+from finder.profiling import DEFAULT_TOP_N, PROFILE_MODES, profile_dir, profiling
+from finder.projection import load_projection, parse_projection_spec
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
@@ -33,6 +40,12 @@ logger = logging.getLogger(__name__)
 PROJECT_ROOT = Path(__file__).parent
 CACHE_DIR = PROJECT_ROOT / "cache"
 OUTPUT_DIR = PROJECT_ROOT / "output" / "experiments"
+PROFILES_DIR = PROJECT_ROOT / "output" / "profiles"
+FEATURES_DIR = CACHE_DIR / "features"
+BACKGROUND_DIR = CACHE_DIR / "background"
+OCCURRENCE_CACHE_PATH = CACHE_DIR / "gbif" / "occurrences.sqlite"
+OCCURRENCE_ARCHIVE_DIR = CACHE_DIR / "gbif" / "archive"
+MATCH_CACHE_PATH = CACHE_DIR / "gbif" / "names.sqlite"
 
 # Experiment parameters
 SPECIES_LIST = [
@@ -159,40 +172,6 @@ def compute_classifier_mlp(
     return predict_mlp(model, scaler, test_emb)
 
 
-def sample_background_points(
-    mosaic: EmbeddingMosaic,
-    n_points: int,
-    exclude_coords: list[tuple[float, float]],
-    rng: np.random.Generator,
-) -> tuple[np.ndarray, list[tuple[float, float]]]:
-    """Sample random background points."""
-    h, w, _ = mosaic.shape
-
-    exclude_pixels = set()
-    for lon, lat in exclude_coords:
-        row, col = mosaic.coords_to_pixel(lon, lat)
-        exclude_pixels.add((row, col))
-
-    coords = []
-    embeddings = []
-    attempts = 0
-    max_attempts = n_points * 10
-
-    while len(coords) < n_points and attempts < max_attempts:
-        row = rng.integers(0, h)
-        col = rng.integers(0, w)
-        if (row, col) not in exclude_pixels:
-            lon, lat = mosaic.pixel_to_coords(row, col)
-            emb = mosaic.mosaic[row, col, :]
-            if not np.allclose(emb, 0):
-                coords.append((lon, lat))
-                embeddings.append(emb)
-                exclude_pixels.add((row, col))
-        attempts += 1
-
-    return np.array(embeddings), coords
-
-
 def compute_auc(pos_scores: np.ndarray, neg_scores: np.ndarray) -> float:
     """AUC: P(random positive > random negative)."""
     n_comparisons = len(pos_scores) * len(neg_scores)
@@ -238,11 +217,18 @@ def run_single_trial(
     n_pos: int,
     all_occ_emb: np.ndarray,
     valid_coords: list[tuple[float, float]],
-    mosaic: EmbeddingMosaic,
+    occ_pixels: np.ndarray,
+    background_bank: BackgroundBank,
     rng: np.random.Generator,
     model_type: ModelType = "logistic",
+    mosaic: Optional[EmbeddingMosaic] = None,
 ) -> dict:
-    """Run a single trial for a given n_positive value."""
+    """
+    Run a single trial for a given n_positive value.
+
+    Background comes from the bank; if it runs out, the rest is sampled
+    from `mosaic` (when given).
+    """
     n_total = len(valid_coords)
 
     # Shuffle occurrences for this trial
@@ -257,20 +243,25 @@ def run_single_trial(
     test_pos_coords = shuffled_coords[n_pos:]
     n_test = len(test_pos_coords)
 
-    # Sample background for training classifier (match positive training size)
-    train_neg_emb, train_neg_coords = sample_background_points(
-        mosaic, n_pos, shuffled_coords, rng
+    # Take background from the bank, starting at a random position per trial
+    start = int(rng.integers(len(background_bank)))
+
+    # Background for training classifier (match positive training size)
+    train_neg_emb, train_neg_coords = background_bank.take(
+        n_pos, occ_pixels, start, mosaic=mosaic, seed=start
     )
 
-    # Sample background for testing (match test size)
-    test_neg_emb, test_neg_coords = sample_background_points(
-        mosaic, n_test, shuffled_coords + train_neg_coords, rng
+    # Background for testing (match test size), disjoint from training background
+    train_neg_pixels = background_bank.coords_to_pixels(train_neg_coords)
+    test_neg_emb, test_neg_coords = background_bank.take(
+        n_test, np.vstack([occ_pixels, train_neg_pixels]), start, mosaic=mosaic, seed=start + 1
     )
 
     # Combine test embeddings for single prediction call
     test_all_emb = np.vstack([test_pos_emb, test_neg_emb])
 
     # Train classifier and score based on model type
+    classifier_start = time.perf_counter()
     if model_type == "mlp":
         all_scores, all_uncertainties = compute_classifier_mlp(
             train_emb, train_neg_emb, test_all_emb
@@ -279,6 +270,7 @@ def run_single_trial(
         all_scores, all_uncertainties = compute_classifier_logistic(
             train_emb, train_neg_emb, test_all_emb
         )
+    classifier_seconds = time.perf_counter() - classifier_start
 
     pos_scores = all_scores[:len(test_pos_emb)]
     neg_scores = all_scores[len(test_pos_emb):]
@@ -303,6 +295,7 @@ def run_single_trial(
         "mean_negative": float(neg_scores.mean()),
         "n_test_positive": n_test,
         "n_test_negative": len(test_neg_coords),
+        "classifier_seconds": classifier_seconds,
         "train_positive": [{"lon": lon, "lat": lat} for lon, lat in train_coords],
         "train_negative": [{"lon": lon, "lat": lat} for lon, lat in train_neg_coords],
         "test_positive": [
@@ -328,22 +321,36 @@ def run_single_trial(
     return result
 
 
+@traced("species_experiment")
 def run_species_experiment(
     species_name: str,
     mosaic: EmbeddingMosaic,
+    background_bank: BackgroundBank,
     model_type: ModelType = "logistic",
+    feature_store: Optional[FeatureStore] = None,
+    refresh_occurrences: bool = False,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    match_cache: Optional[MatchCache] = None,
 ):
     """Run experiment for a single species with multiple trials per n."""
     logger.info(f"\n{'='*60}")
     logger.info(f"Species: {species_name} (model: {model_type})")
     logger.info("=" * 60)
 
-    bbox = REGIONS[REGION]["bbox"]
-    species_info = get_species_info(species_name)
-    occurrences = fetch_occurrences(species_info["taxon_key"], bbox)
-    logger.info(f"Total occurrences: {len(occurrences)}")
+    species_info = get_species_info(species_name, match_cache)
+    features = load_occurrence_features(
+        species_info["taxon_key"],
+        mosaic,
+        store=feature_store,
+        refresh=refresh_occurrences,
+        occurrence_cache=occurrence_cache,
+        occurrence_archive=occurrence_archive,
+    )
+    logger.info(f"Total occurrences: {features.n_occurrences}")
 
-    all_occ_emb, valid_coords = mosaic.sample_at_coords(occurrences)
+    all_occ_emb = np.asarray(features.embeddings)
+    valid_coords = features.valid_coords
     n_total = len(valid_coords)
     logger.info(f"Valid with embeddings: {n_total}")
 
@@ -371,7 +378,14 @@ def run_species_experiment(
             rng = np.random.default_rng(trial_seed)
 
             trial_result = run_single_trial(
-                n_pos, all_occ_emb, valid_coords, mosaic, rng, model_type=model_type
+                n_pos,
+                all_occ_emb,
+                valid_coords,
+                features.valid_pixels,
+                background_bank,
+                rng,
+                model_type=model_type,
+                mosaic=mosaic,
             )
             trial_result["seed"] = trial_seed
             trials.append(trial_result)
@@ -420,8 +434,21 @@ def run_species_experiment(
     }
 
 
-def run_all_experiments(model_type: ModelType = "logistic"):
-    """Run experiments for all species."""
+def run_all_experiments(
+    model_type: ModelType = "logistic",
+    refresh_occurrences: bool = False,
+    projection_spec: Optional[str] = None,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    match_cache: Optional[MatchCache] = None,
+):
+    """
+    Run experiments for all species.
+
+    With `projection_spec` (e.g. "pca:64"), the mosaic is projected to fewer
+    dimensions as it loads and results go to a separate output directory,
+    so accuracy, memory and timing can be compared with the full embeddings.
+    """
     logger.info("=" * 60)
     logger.info(f"Classifier Validation Experiment (model: {model_type})")
     logger.info(f"({N_TRIALS} trials per n value)")
@@ -429,14 +456,23 @@ def run_all_experiments(model_type: ModelType = "logistic"):
 
     bbox = REGIONS[REGION]["bbox"]
 
+    projection = None
+    if projection_spec:
+        method, k = parse_projection_spec(projection_spec)
+        projection = load_projection(CACHE_DIR, bbox, k, method=method, seed=BASE_SEED)
+        logger.info(f"Projection: {projection.name} ({projection.input_dim} -> {k} dims)")
+
     # Load mosaic once
     logger.info("\nLoading embedding mosaic...")
-    mosaic = EmbeddingMosaic(CACHE_DIR, bbox)
+    load_start = time.perf_counter()
+    mosaic = EmbeddingMosaic(CACHE_DIR, bbox, projection=projection)
     mosaic.load()
-    logger.info(f"Mosaic shape: {mosaic.shape}")
+    load_seconds = time.perf_counter() - load_start
+    logger.info(f"Mosaic shape: {mosaic.shape} ({mosaic.mosaic.nbytes / 1e6:.1f} MB, {load_seconds:.1f}s)")
 
-    # Create output directory for this model type
-    output_dir = OUTPUT_DIR / model_type
+    # Create output directory for this model type (and projection)
+    run_name = model_type if projection is None else f"{model_type}_{projection.name}"
+    output_dir = OUTPUT_DIR / run_name
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Summary for all species
@@ -446,11 +482,38 @@ def run_all_experiments(model_type: ModelType = "logistic"):
         "base_seed": BASE_SEED,
         "n_trials": N_TRIALS,
         "n_positive_values": N_POSITIVE_VALUES,
+        "projection": None if projection is None else {
+            "name": projection.name,
+            "method": projection.method,
+            "input_dim": projection.input_dim,
+            "n_components": projection.n_components,
+            "explained_variance": (
+                float(projection.explained_variance_ratio.sum())
+                if projection.explained_variance_ratio is not None else None
+            ),
+        },
+        "mosaic_bytes": int(mosaic.mosaic.nbytes),
+        "mosaic_load_seconds": load_seconds,
+        "classifier_seconds": 0.0,
         "species": [],
     }
 
+    feature_store = FeatureStore(FEATURES_DIR)
+    background_bank = load_background_bank(mosaic, BACKGROUND_DIR, seed=BASE_SEED)
+    logger.info(f"Background bank: {len(background_bank):,} pixels")
+
     for species in SPECIES_LIST:
-        result = run_species_experiment(species, mosaic, model_type=model_type)
+        result = run_species_experiment(
+            species,
+            mosaic,
+            background_bank,
+            model_type=model_type,
+            feature_store=feature_store,
+            refresh_occurrences=refresh_occurrences,
+            occurrence_cache=occurrence_cache,
+            occurrence_archive=occurrence_archive,
+            match_cache=match_cache,
+        )
 
         if result:
             # Save per-species (full data with coordinates)
@@ -480,6 +543,11 @@ def run_all_experiments(model_type: ModelType = "logistic"):
                 ],
             }
             summary["species"].append(species_summary)
+            summary["classifier_seconds"] += sum(
+                trial["classifier_seconds"]
+                for exp in result["experiments"]
+                for trial in exp["trials"]
+            )
 
     # Save summary
     summary_path = output_dir / "summary.json"
@@ -518,13 +586,85 @@ def main():
         default="both",
         help="Model type to evaluate: logistic, mlp, or both (default: both)",
     )
+    parser.add_argument(
+        "--refresh-occurrences",
+        action="store_true",
+        help="Re-fetch GBIF occurrences and append new ones to the feature store",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only locally cached GBIF data; never contact the API",
+    )
+    parser.add_argument(
+        "--occurrence-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Re-fetch cached GBIF queries older than this (default: {DEFAULT_TTL_DAYS:g})",
+    )
+    parser.add_argument(
+        "--projection",
+        help="Project embeddings to fewer dimensions first, e.g. pca:64 or random:64",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the run with cProfile or a stack sampler; artifacts go to output/profiles/",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Take tracemalloc snapshots around the heavy stages (slower)",
+    )
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP_N,
+                        help=f"Functions listed in the hotspot summary (default: {DEFAULT_TOP_N})")
     args = parser.parse_args()
 
-    if args.model_type == "both":
-        run_all_experiments(model_type="logistic")
-        run_all_experiments(model_type="mlp")
-    else:
-        run_all_experiments(model_type=args.model_type)
+    occurrence_cache = OccurrenceCache(
+        OCCURRENCE_CACHE_PATH,
+        ttl_days=args.occurrence_ttl_days,
+        refresh="always" if args.refresh_occurrences else "auto",
+        offline=args.offline,
+    )
+    match_cache = MatchCache(MATCH_CACHE_PATH, offline=args.offline)
+    occurrence_archive = (
+        OccurrenceArchive(OCCURRENCE_ARCHIVE_DIR) if OCCURRENCE_ARCHIVE_DIR.exists() else None
+    )
+
+    with profiling(
+        profile_dir(PROFILES_DIR, "experiment"),
+        mode=args.profile,
+        memory=args.profile_memory,
+        top_n=args.profile_top,
+        name="experiment.py",
+        model_type=args.model_type,
+        projection=args.projection,
+    ):
+        if args.model_type == "both":
+            run_all_experiments(
+                model_type="logistic",
+                refresh_occurrences=args.refresh_occurrences,
+                projection_spec=args.projection,
+                occurrence_cache=occurrence_cache,
+                occurrence_archive=occurrence_archive,
+                match_cache=match_cache,
+            )
+            run_all_experiments(
+                model_type="mlp",
+                projection_spec=args.projection,
+                occurrence_cache=occurrence_cache,
+                occurrence_archive=occurrence_archive,
+                match_cache=match_cache,
+            )
+        else:
+            run_all_experiments(
+                model_type=args.model_type,
+                refresh_occurrences=args.refresh_occurrences,
+                projection_spec=args.projection,
+                occurrence_cache=occurrence_cache,
+                occurrence_archive=occurrence_archive,
+                match_cache=match_cache,
+            )
 
 
 if __name__ == "__main__":
@@ -4,16 +4,22 @@ Species Candidate Location Finder
 Find candidate locations for plant species using geospatial embeddings.
 """
 
-from .gbif import get_species_key, get_species_info, fetch_occurrences
+from .gbif import get_species_key, get_species_info, fetch_occurrences, iter_occurrence_pages
 from .embeddings import EmbeddingMosaic
 from .methods import ClassifierMethod
 from .pipeline import find_candidates
+from .features import FeatureStore, load_occurrence_features
+from .names import resolve_names
 
 __all__ = [
     "get_species_key",
     "get_species_info",
     "fetch_occurrences",
+    "iter_occurrence_pages",
     "EmbeddingMosaic",
     "ClassifierMethod",
     "find_candidates",
+    "FeatureStore",
+    "load_occurrence_features",
+    "resolve_names",
 ]
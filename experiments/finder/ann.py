@@ -0,0 +1,431 @@
+"""
+Approximate nearest-neighbour search over mosaic pixels.
+
+An inverted-file (IVF) index: the valid pixels of a region are clustered
+with k-means, and each pixel is filed under its nearest centroid. A query
+only scans the pixels filed under its `n_probe` nearest centroids, so
+finding the pixels most similar to a few occurrence embeddings takes
+milliseconds instead of a scan of the whole mosaic. Indexes are built once
+per region and stored with the tiles, and rebuilt when the region's tile
+set changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+from .embeddings import EmbeddingMosaic
+from .features import mosaic_key
+from .tiles import get_catalog
+
+logger = logging.getLogger(__name__)
+
+# Pixels sampled to train the k-means centroids (per list, and at most)
+TRAIN_SAMPLES_PER_LIST = 64
+TRAIN_SAMPLES = 100_000
+KMEANS_ITERATIONS = 10
+MAX_LISTS = 4096
+
+# Lists scanned per query by default
+DEFAULT_N_PROBE = 8
+
+# Rows per block when assigning pixels to centroids
+ASSIGN_BATCH = 16384
+
+
+def default_n_lists(n_vectors: int) -> int:
+    """Number of inverted lists for an index of n_vectors (about sqrt(n))."""
+    return int(np.clip(round(np.sqrt(n_vectors)), 1, MAX_LISTS))
+
+
+def _nearest_centroids(
+    X: np.ndarray,
+    centroids: np.ndarray,
+    n_nearest: int = 1,
+) -> np.ndarray:
+    """Indices of the n_nearest centroids to each row of X, nearest first."""
+    centroid_norms = (centroids.astype(np.float64) ** 2).sum(axis=1)
+    out = np.empty((len(X), n_nearest), dtype=np.int64)
+    for i in range(0, len(X), ASSIGN_BATCH):
+        batch = np.asarray(X[i:i + ASSIGN_BATCH], dtype=np.float32)
+        # ||x - c||^2 up to the per-row constant ||x||^2
+        d = centroid_norms - 2.0 * (batch @ centroids.T)
+        if n_nearest == 1:
+            out[i:i + len(batch), 0] = d.argmin(axis=1)
+        else:
+            nearest = np.argpartition(d, n_nearest - 1, axis=1)[:, :n_nearest]
+            order = np.take_along_axis(d, nearest, axis=1).argsort(axis=1)
+            out[i:i + len(batch)] = np.take_along_axis(nearest, order, axis=1)
+    return out
+
+
+def kmeans(
+    X: np.ndarray,
+    n_clusters: int,
+    n_iter: int = KMEANS_ITERATIONS,
+    seed: int = 42,
+) -> np.ndarray:
+    """
+    Lloyd's k-means on the rows of X.
+
+    Centroids start at randomly chosen rows; clusters that empty out are
+    re-seeded from random rows.
+
+    Returns:
+        (n_clusters, C) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    n_clusters = min(n_clusters, len(X))
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = _nearest_centroids(X, centroids)[:, 0]
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack(
+            [np.bincount(labels, weights=X[:, j], minlength=n_clusters) for j in range(X.shape[1])],
+            axis=1,
+        )
+        nonempty = counts > 0
+        centroids[nonempty] = (sums[nonempty] / counts[nonempty, None]).astype(np.float32)
+        n_empty = int((~nonempty).sum())
+        if n_empty:
+            centroids[~nonempty] = X[rng.choice(len(X), n_empty, replace=False)]
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index of a mosaic's non-empty pixels.
+
+    Pixels are identified by their flat index (row * width + col) in the
+    mosaic the index was built from. Vectors are stored grouped by list,
+    so each list is a contiguous slice. The index keeps the mosaic's
+    geotransform, so once saved it answers coordinate queries without
+    loading any tiles.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        pixel_ids: np.ndarray,
+        vectors: np.ndarray,
+        shape: tuple[int, int],
+        transform: Affine,
+        tile_set: Optional[str] = None,
+    ):
+        self.centroids = centroids  # (L, C)
+        self.offsets = offsets  # (L + 1,) start of each list in pixel_ids/vectors
+        self.pixel_ids = pixel_ids  # (N,) flat pixel indices, grouped by list
+        self.vectors = vectors  # (N, C) embeddings, same order
+        self.shape = shape  # (height, width) of the indexed mosaic
+        self.transform = transform
+        self.tile_set = tile_set  # tile_set_key of the indexed mosaic
+        self._by_pixel: Optional[np.ndarray] = None  # positions sorted by pixel id
+
+    def __len__(self) -> int:
+        return len(self.pixel_ids)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        mosaic: EmbeddingMosaic,
+        n_lists: Optional[int] = None,
+        n_train: Optional[int] = None,
+        seed: int = 42,
+    ) -> "IVFIndex":
+        """
+        Index every non-empty pixel of a mosaic.
+
+        Args:
+            mosaic: Embedding mosaic for the region
+            n_lists: Number of k-means lists (None = about sqrt(n_pixels))
+            n_train: Pixels sampled to train the centroids (None = 64 per
+                list, at most TRAIN_SAMPLES)
+            seed: Random seed for sampling and k-means
+
+        Returns:
+            IVFIndex over the mosaic's non-empty pixels
+        """
+        h, w, _ = mosaic.shape
+        flat = mosaic.get_all_embeddings()
+        valid = np.flatnonzero(np.any(flat != 0, axis=1))
+        if len(valid) == 0:
+            raise ValueError("Mosaic has no non-empty pixels to index")
+
+        rng = np.random.default_rng(seed)
+        n_lists = n_lists or default_n_lists(len(valid))
+        n_train = n_train or min(TRAIN_SAMPLES, TRAIN_SAMPLES_PER_LIST * n_lists)
+        train = valid if len(valid) <= n_train else rng.choice(valid, n_train, replace=False)
+        centroids = kmeans(flat[np.sort(train)], n_lists, seed=seed)
+
+        labels = _nearest_centroids(flat[valid], centroids)[:, 0]
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        pixel_ids = valid[order].astype(np.int64)
+
+        return cls(
+            centroids=centroids,
+            offsets=offsets,
+            pixel_ids=pixel_ids,
+            vectors=np.ascontiguousarray(flat[pixel_ids], dtype=np.float32),
+            shape=(h, w),
+            transform=mosaic.transform,
+            tile_set=tile_set_key(mosaic),
+        )
+
+    def _candidates(self, lists: np.ndarray) -> np.ndarray:
+        """Positions (into pixel_ids/vectors) of the pixels filed under some lists."""
+        return np.concatenate(
+            [np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists]
+        )
+
+    def _probe(self, queries: np.ndarray, n_probe: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_probe = max(1, min(n_probe, self.n_lists))
+        return queries, _nearest_centroids(queries, self.centroids, n_probe)
+
+    def _distances(self, positions: np.ndarray, query: np.ndarray) -> np.ndarray:
+        diff = np.asarray(self.vectors[positions], dtype=np.float32) - query
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        n_probe: int = DEFAULT_N_PROBE,
+        exclude: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest pixels to each query (Euclidean distance).
+
+        Args:
+            queries: (Q, C) query embeddings (or a single (C,) vector)
+            k: Neighbours per query
+            n_probe: Lists scanned per query; higher is slower but closer
+                to exact
+            exclude: Pixel ids never returned (e.g. the query pixels)
+
+        Returns:
+            Tuple of (distances, pixel_ids), each (Q, k) and sorted by
+            distance. Slots beyond the candidates found hold inf / -1.
+        """
+        queries, probes = self._probe(queries, n_probe)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        pixel_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for i, query in enumerate(queries):
+            positions = self._candidates(probes[i])
+            if exclude is not None:
+                positions = positions[~np.isin(self.pixel_ids[positions], exclude)]
+            d = self._distances(positions, query)
+            if len(d) > k:
+                nearest = np.argpartition(d, k - 1)[:k]
+            else:
+                nearest = np.arange(len(d))
+            nearest = nearest[np.argsort(d[nearest])]
+            distances[i, :len(nearest)] = d[nearest]
+            pixel_ids[i, :len(nearest)] = self.pixel_ids[positions[nearest]]
+
+        return distances, pixel_ids
+
+    def radius_search(
+        self,
+        queries: np.ndarray,
+        radius: float,
+        n_probe: int = DEFAULT_N_PROBE,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Pixels within `radius` of each query, among the probed lists.
+
+        Returns:
+            One (distances, pixel_ids) pair per query, sorted by distance
+        """
+        queries, probes = self._probe(queries, n_probe)
+        results = []
+        for i, query in enumerate(queries):
+            positions = self._candidates(probes[i])
+            d = self._distances(positions, query)
+            inside = np.flatnonzero(d <= radius)
+            inside = inside[np.argsort(d[inside])]
+            results.append((d[inside], self.pixel_ids[positions[inside]]))
+        return results
+
+    def nearest_to_any(
+        self,
+        queries: np.ndarray,
+        k: int = 100,
+        n_probe: int = DEFAULT_N_PROBE,
+        exclude: Optional[np.ndarray] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The k pixels closest to any of the queries.
+
+        Args:
+            queries: (Q, C) query embeddings
+            k: Number of pixels to return
+            n_probe: Lists scanned per query
+            exclude: Pixel ids to leave out (e.g. the query pixels themselves)
+
+        Returns:
+            Tuple of (distances, pixel_ids) sorted by distance to the
+            nearest query
+        """
+        distances, pixel_ids = self.search(queries, k=k, n_probe=n_probe, exclude=exclude)
+        distances, pixel_ids = distances.ravel(), pixel_ids.ravel()
+        keep = pixel_ids >= 0
+        distances, pixel_ids = distances[keep], pixel_ids[keep]
+
+        # Keep each pixel's smallest distance
+        order = np.argsort(distances, kind="stable")
+        _, first = np.unique(pixel_ids[order], return_index=True)
+        best = order[np.sort(first)][:k]
+        return distances[best], pixel_ids[best]
+
+    def rowcol(self, pixel_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(rows, cols) in the indexed mosaic of flat pixel ids."""
+        return np.divmod(np.asarray(pixel_ids), self.shape[1])
+
+    def coords(self, pixel_ids: np.ndarray) -> list[tuple[float, float]]:
+        """(longitude, latitude) of pixel centres."""
+        if len(pixel_ids) == 0:
+            return []
+        rows, cols = self.rowcol(pixel_ids)
+        lons, lats = rasterio.transform.xy(self.transform, rows, cols)
+        return list(zip(np.atleast_1d(lons).tolist(), np.atleast_1d(lats).tolist()))
+
+    def lookup(self, coords: list[tuple[float, float]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Indexed pixels under some coordinates.
+
+        Returns:
+            Tuple of (pixel_ids, embeddings) for the coordinates that fall on
+            a non-empty pixel of the indexed mosaic (duplicates kept)
+        """
+        if len(coords) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.vectors.shape[1]), np.float32)
+        h, w = self.shape
+        lons, lats = np.asarray(coords, dtype=np.float64).T
+        rows, cols = rasterio.transform.rowcol(self.transform, lons, lats)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+        ids = rows[inside] * w + cols[inside]
+
+        if self._by_pixel is None:
+            self._by_pixel = np.argsort(self.pixel_ids)
+        sorted_ids = self.pixel_ids[self._by_pixel]
+        pos = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids) - 1)
+        found = sorted_ids[pos] == ids
+        positions = self._by_pixel[pos[found]]
+        return ids[found], np.asarray(self.vectors[positions], dtype=np.float32)
+
+    def save(self, path: Path) -> None:
+        """Save as a directory of .npy arrays plus meta.json."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "centroids.npy", self.centroids)
+        np.save(path / "offsets.npy", self.offsets)
+        np.save(path / "pixel_ids.npy", self.pixel_ids)
+        np.save(path / "vectors.npy", np.ascontiguousarray(self.vectors))
+        with open(path / "meta.json", "w") as f:
+            json.dump(
+                {
+                    "shape": list(self.shape),
+                    "transform": list(self.transform)[:6],
+                    "n_lists": self.n_lists,
+                    "n_vectors": len(self),
+                    "tile_set": self.tile_set,
+                },
+                f,
+                indent=2,
+            )
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "IVFIndex":
+        """Load an index written by `save` (vectors memory-mapped by default)."""
+        path = Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        return cls(
+            centroids=np.load(path / "centroids.npy"),
+            offsets=np.load(path / "offsets.npy"),
+            pixel_ids=np.load(path / "pixel_ids.npy"),
+            vectors=np.load(path / "vectors.npy", mmap_mode="r" if mmap else None),
+            shape=tuple(meta["shape"]),
+            transform=Affine(*meta["transform"]),
+            tile_set=meta.get("tile_set"),
+        )
+
+
+def tile_set_key(mosaic: EmbeddingMosaic) -> str:
+    """Hash of the catalog tiles in a mosaic's bbox (changes when tiles are added or removed)."""
+    catalog = get_catalog(mosaic.cache_dir, mosaic.year, mosaic.tile_size)
+    tiles = [[ix, iy, catalog.tiles[(ix, iy)]] for ix, iy in catalog.tiles_in_bbox(mosaic.bbox)]
+    return hashlib.sha256(json.dumps(tiles).encode()).hexdigest()[:16]
+
+
+def load_index(
+    mosaic: EmbeddingMosaic,
+    n_lists: Optional[int] = None,
+    seed: int = 42,
+) -> IVFIndex:
+    """
+    Load the index for a mosaic's region, building and saving it on first use.
+
+    Indexes are stored with the tiles in
+    {cache_dir}/{year}/ann/{region_key}_ivf{n_lists}_s{seed}/, together with
+    a hash of the region's tile set; a stored index built from other tiles
+    (e.g. before tiles were added to the region) is rebuilt.
+
+    Args:
+        mosaic: Embedding mosaic for the region
+        n_lists: Number of k-means lists (None = about sqrt(n_pixels))
+        seed: Random seed
+
+    Returns:
+        IVFIndex for the region
+    """
+    lists = n_lists if n_lists else "auto"
+    path = mosaic.cache_dir / str(mosaic.year) / "ann" / f"{mosaic_key(mosaic)}_ivf{lists}_s{seed}"
+    stale = False
+    if (path / "meta.json").exists():
+        index = IVFIndex.load(path)
+        if index.tile_set == tile_set_key(mosaic):
+            return index
+        logger.info(f"Tiles in {mosaic.bbox} changed since {path.name} was built; rebuilding")
+        stale = True
+
+    index = IVFIndex.build(mosaic, n_lists=n_lists, seed=seed)
+
+    # Save under a private name and rename into place, so concurrent
+    # builders never see a half-written index
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    index.save(tmp_path)
+    if stale:
+        # Move the old index aside first (open memory maps of it stay valid)
+        old_path = path.with_name(f"{path.name}.old{os.getpid()}")
+        try:
+            os.rename(path, old_path)
+        except OSError:
+            pass  # already replaced by another builder
+        shutil.rmtree(old_path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return index
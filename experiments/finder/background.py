@@ -0,0 +1,348 @@
+"""
+Shared per-region background bank.
+
+A large, seeded sample of valid background pixels and their embeddings,
+drawn once per region and stored on disk. Species and trials take
+deterministic, exclusion-aware subsets of it by index instead of each
+drawing their own background pixel by pixel (`sample_background`, still
+used without a bank and for requests the bank is too small for).
+"""
+
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from sklearn.preprocessing import StandardScaler
+
+from .embeddings import EmbeddingMosaic
+from .instrument import traced
+from .features import mosaic_key
+
+if TYPE_CHECKING:
+    from .projection import EmbeddingProjection
+
+logger = logging.getLogger(__name__)
+
+# Default number of pixels drawn into a bank
+BANK_SIZE = 50_000
+
+
+def sample_background(
+    mosaic: EmbeddingMosaic,
+    n_samples: int,
+    exclude_coords: list[tuple[float, float]],
+    seed: int = 42,
+) -> tuple[np.ndarray, list[tuple[float, float]]]:
+    """
+    Sample random background points from the mosaic.
+
+    Args:
+        mosaic: Loaded embedding mosaic
+        n_samples: Number of background samples to generate
+        exclude_coords: Coordinates to exclude (occurrence locations)
+        seed: Random seed for reproducibility
+
+    Returns:
+        Tuple of (embeddings array, coordinates list)
+    """
+    rng = np.random.default_rng(seed)
+    h, w, _ = mosaic.shape
+
+    # Get pixel indices of exclusions
+    exclude_pixels = set()
+    for lon, lat in exclude_coords:
+        row, col = mosaic.coords_to_pixel(lon, lat)
+        exclude_pixels.add((row, col))
+
+    coords = []
+    embeddings = []
+    attempts = 0
+    max_attempts = n_samples * 20
+
+    while len(coords) < n_samples and attempts < max_attempts:
+        row = rng.integers(0, h)
+        col = rng.integers(0, w)
+        if (row, col) not in exclude_pixels:
+            emb = mosaic.mosaic[row, col, :]
+            if not np.allclose(emb, 0):  # Skip empty pixels
+                lon, lat = mosaic.pixel_to_coords(row, col)
+                coords.append((lon, lat))
+                embeddings.append(emb)
+                exclude_pixels.add((row, col))
+        attempts += 1
+
+    return np.array(embeddings), coords
+
+
+class BackgroundBank:
+    """
+    Precomputed random sample of valid (non-empty) mosaic pixels.
+
+    Entries are stored in random order, so the first n entries that are not
+    excluded form a uniform random background sample.
+    """
+
+    def __init__(
+        self,
+        pixels: np.ndarray,
+        embeddings: np.ndarray,
+        transform: Affine,
+        mosaic_shape: tuple[int, int],
+        seed: int,
+        mean: Optional[np.ndarray] = None,
+        std: Optional[np.ndarray] = None,
+    ):
+        self.pixels = pixels  # (N, 2) row, col
+        self.embeddings = embeddings  # (N, C)
+        self.transform = transform
+        self.mosaic_shape = mosaic_shape
+        self.seed = seed
+        self.mean = embeddings.mean(axis=0) if mean is None else mean
+        self.std = embeddings.std(axis=0) if std is None else std
+        self._flat = self._flatten(pixels)
+
+    def __len__(self) -> int:
+        return len(self.pixels)
+
+    def _flatten(self, pixels: np.ndarray) -> np.ndarray:
+        """Flat mosaic index (row * width + col) for (N, 2) pixel arrays."""
+        pixels = np.asarray(pixels, dtype=np.int64).reshape(-1, 2)
+        return pixels[:, 0] * self.mosaic_shape[1] + pixels[:, 1]
+
+    @classmethod
+    def build(
+        cls,
+        mosaic: EmbeddingMosaic,
+        n_samples: int = BANK_SIZE,
+        seed: int = 42,
+        chunk_rows: int = 256,
+    ) -> "BackgroundBank":
+        """
+        Draw a bank of valid pixels from a mosaic.
+
+        Args:
+            mosaic: Embedding mosaic for the region
+            n_samples: Number of pixels to draw (capped at the valid pixel count)
+            seed: Random seed for reproducibility
+            chunk_rows: Mosaic rows scanned at once when finding valid pixels
+
+        Returns:
+            BackgroundBank over the mosaic
+        """
+        h, w, _ = mosaic.shape
+        data = mosaic.mosaic
+
+        # Flat indices of non-empty pixels, scanned in row chunks to bound memory
+        valid = []
+        for start in range(0, h, chunk_rows):
+            chunk = data[start:start + chunk_rows]
+            nonzero = np.any(np.abs(chunk) > 1e-8, axis=-1)
+            valid.append(np.flatnonzero(nonzero) + start * w)
+        valid_idx = np.concatenate(valid)
+
+        rng = np.random.default_rng(seed)
+        chosen = rng.choice(valid_idx, size=min(n_samples, len(valid_idx)), replace=False)
+        rows, cols = np.divmod(chosen, w)
+
+        return cls(
+            pixels=np.stack([rows, cols], axis=1).astype(np.int32),
+            embeddings=data[rows, cols, :].astype(np.float32),
+            transform=mosaic.transform,
+            mosaic_shape=(h, w),
+            seed=seed,
+        )
+
+    def take_indices(
+        self,
+        n: int,
+        exclude_pixels: Optional[np.ndarray] = None,
+        start: int = 0,
+    ) -> np.ndarray:
+        """
+        Pick bank entries for a background sample.
+
+        Walks the bank from `start` (wrapping around) and returns the first
+        n entries whose pixel is not excluded. Fewer than n are returned if
+        the bank runs out.
+
+        Args:
+            n: Number of entries wanted
+            exclude_pixels: (M, 2) row, col pixels that must not be used
+            start: Bank position to start from (vary per trial for independence)
+
+        Returns:
+            Array of bank indices
+        """
+        order = np.roll(np.arange(len(self)), -(start % max(len(self), 1)))
+        if exclude_pixels is not None and len(exclude_pixels) > 0:
+            keep = ~np.isin(self._flat, self._flatten(exclude_pixels))
+            order = order[keep[order]]
+        return order[:n]
+
+    def take(
+        self,
+        n: int,
+        exclude_pixels: Optional[np.ndarray] = None,
+        start: int = 0,
+        mosaic: Optional[EmbeddingMosaic] = None,
+        seed: Optional[int] = None,
+    ) -> tuple[np.ndarray, list[tuple[float, float]]]:
+        """
+        Take a background sample; see `take_indices`.
+
+        If the bank runs out (a request near the bank size), a warning is
+        logged and, given the bank's `mosaic`, the shortfall is drawn with
+        `sample_background` away from the excluded and already taken pixels.
+
+        Args:
+            n: Number of samples wanted
+            exclude_pixels: (M, 2) row, col pixels that must not be used
+            start: Bank position to start from (vary per trial for independence)
+            mosaic: Mosaic the bank was drawn from, to top up a shortfall
+            seed: Random seed for the top-up (defaults to the bank's seed + start)
+
+        Returns:
+            Tuple of (embeddings array, coordinates list)
+        """
+        idx = self.take_indices(n, exclude_pixels, start)
+        embeddings, coords = np.asarray(self.embeddings[idx]), self.coords(idx)
+        shortfall = n - len(idx)
+        if shortfall <= 0:
+            return embeddings, coords
+
+        if mosaic is None:
+            logger.warning(f"Background bank has only {len(idx):,} of {n:,} requested pixels")
+            return embeddings, coords
+
+        logger.warning(
+            f"Background bank has only {len(idx):,} of {n:,} requested pixels; "
+            f"sampling {shortfall:,} more from the mosaic"
+        )
+        exclude_coords = list(coords)
+        if exclude_pixels is not None and len(exclude_pixels) > 0:
+            rows, cols = np.asarray(exclude_pixels).reshape(-1, 2).T
+            lons, lats = rasterio.transform.xy(self.transform, rows, cols)
+            exclude_coords += zip(np.atleast_1d(lons).tolist(), np.atleast_1d(lats).tolist())
+        extra_embeddings, extra_coords = sample_background(
+            mosaic, shortfall, exclude_coords, seed=self.seed + start if seed is None else seed
+        )
+        if len(extra_coords) == 0:
+            return embeddings, coords
+        return np.vstack([embeddings, extra_embeddings]), coords + extra_coords
+
+    def coords(self, idx: np.ndarray) -> list[tuple[float, float]]:
+        """(longitude, latitude) of pixel centres for bank entries."""
+        if len(idx) == 0:
+            return []
+        rows, cols = self.pixels[idx, 0], self.pixels[idx, 1]
+        lons, lats = rasterio.transform.xy(self.transform, rows, cols)
+        return list(zip(np.asarray(lons).tolist(), np.asarray(lats).tolist()))
+
+    def coords_to_pixels(self, coords: list[tuple[float, float]]) -> np.ndarray:
+        """(N, 2) row, col mosaic pixels of (longitude, latitude) coordinates."""
+        if len(coords) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        lons, lats = np.asarray(coords, dtype=np.float64).T
+        rows, cols = rasterio.transform.rowcol(self.transform, lons, lats)
+        return np.stack([rows, cols], axis=1).astype(np.int64)
+
+    def scaler(self, projection: Optional["EmbeddingProjection"] = None) -> StandardScaler:
+        """
+        StandardScaler using the bank's precomputed background statistics.
+
+        Args:
+            projection: If the classifier projects embeddings before scaling,
+                the same projection, so statistics are in the projected space
+        """
+        mean, std = self.mean, self.std
+        if projection is not None:
+            projected = projection.transform(np.asarray(self.embeddings))
+            mean, std = projected.mean(axis=0), projected.std(axis=0)
+
+        scaler = StandardScaler()
+        std = np.where(std > 0, std, 1.0)
+        scaler.mean_ = np.asarray(mean, dtype=np.float64)
+        scaler.var_ = np.asarray(std, dtype=np.float64) ** 2
+        scaler.scale_ = np.asarray(std, dtype=np.float64)
+        scaler.n_features_in_ = len(scaler.mean_)
+        scaler.n_samples_seen_ = len(self)
+        return scaler
+
+    def save(self, path: Path) -> None:
+        """Save the bank as memory-mappable arrays plus metadata."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "pixels.npy", self.pixels)
+        np.save(path / "embeddings.npy", np.ascontiguousarray(self.embeddings))
+        np.save(path / "mean.npy", self.mean)
+        np.save(path / "std.npy", self.std)
+
+        tmp_path = path / "meta.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "n_samples": len(self),
+                "seed": self.seed,
+                "mosaic_shape": list(self.mosaic_shape),
+                "transform": list(self.transform)[:6],
+            }, f, indent=2)
+        os.replace(tmp_path, path / "meta.json")
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "BackgroundBank":
+        """Load a bank saved with `save`."""
+        path = Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+
+        mode = "r" if mmap else None
+        return cls(
+            pixels=np.load(path / "pixels.npy"),
+            embeddings=np.load(path / "embeddings.npy", mmap_mode=mode),
+            transform=Affine(*meta["transform"]),
+            mosaic_shape=tuple(meta["mosaic_shape"]),
+            seed=meta["seed"],
+            mean=np.load(path / "mean.npy"),
+            std=np.load(path / "std.npy"),
+        )
+
+
+@traced("background_bank")
+def load_background_bank(
+    mosaic: EmbeddingMosaic,
+    root: Path,
+    n_samples: int = BANK_SIZE,
+    seed: int = 42,
+) -> BackgroundBank:
+    """
+    Load the bank for a mosaic's region, building and saving it on first use.
+
+    Args:
+        mosaic: Embedding mosaic for the region
+        root: Directory holding banks (one subdirectory per region/size/seed)
+        n_samples: Bank size
+        seed: Random seed
+
+    Returns:
+        BackgroundBank for the region
+    """
+    path = Path(root) / f"{mosaic_key(mosaic)}_n{n_samples}_s{seed}"
+    if (path / "meta.json").exists():
+        return BackgroundBank.load(path)
+
+    bank = BackgroundBank.build(mosaic, n_samples=n_samples, seed=seed)
+
+    # Save under a private name and rename into place, so concurrent
+    # builders (e.g. training workers) never see a half-written bank
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    bank.save(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return bank
@@ -0,0 +1,386 @@
+"""
+Local caches of GBIF API results.
+
+OccurrenceCache stores downloaded occurrence records per taxon with a
+spatial index and a record of which areas are covered, and MatchCache the
+backbone match for each species name, both in SQLite, so reruns of
+experiments and training skip the GBIF requests and can run without
+network access once the caches are warm.
+"""
+
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Literal, Optional
+
+# "auto": use areas downloaded within the TTL, re-fetch older ones
+# "always": always re-fetch the whole query bbox
+# "never": use any downloaded area regardless of age, fetch only what is missing
+RefreshPolicy = Literal["auto", "always", "never"]
+
+DEFAULT_TTL_DAYS = 30.0
+
+# Grid cell size (degrees) of the spatial index over stored points
+INDEX_CELL_SIZE = 0.1
+
+# Rectangles thinner than this (degrees) are ignored when computing coverage
+COVERAGE_EPSILON = 1e-9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS occurrence_points (
+    taxon_key INTEGER NOT NULL,
+    filter_key TEXT NOT NULL,
+    gbif_key INTEGER NOT NULL,
+    lon REAL NOT NULL,
+    lat REAL NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    PRIMARY KEY (taxon_key, filter_key, gbif_key)
+);
+CREATE INDEX IF NOT EXISTS occurrence_points_cell
+    ON occurrence_points (taxon_key, filter_key, cell_x, cell_y);
+CREATE TABLE IF NOT EXISTS occurrence_coverage (
+    taxon_key INTEGER NOT NULL,
+    filter_key TEXT NOT NULL,
+    min_lon REAL NOT NULL,
+    min_lat REAL NOT NULL,
+    max_lon REAL NOT NULL,
+    max_lat REAL NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS occurrence_coverage_taxon
+    ON occurrence_coverage (taxon_key, filter_key);
+"""
+
+MATCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS name_matches (
+    name TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class OfflineCacheMiss(LookupError):
+    """Raised in offline mode when a query or name is not in the cache."""
+
+
+Rect = tuple[float, float, float, float]
+
+
+def subtract_rect(area: Rect, covered: Rect) -> list[Rect]:
+    """Parts of `area` outside `covered`, as up to four rectangles."""
+    a_min_lon, a_min_lat, a_max_lon, a_max_lat = area
+    c_min_lon, c_min_lat, c_max_lon, c_max_lat = covered
+
+    if (
+        c_min_lon >= a_max_lon or c_max_lon <= a_min_lon
+        or c_min_lat >= a_max_lat or c_max_lat <= a_min_lat
+    ):
+        return [area]
+
+    pieces = [
+        (a_min_lon, a_min_lat, c_min_lon, a_max_lat),  # west strip
+        (c_max_lon, a_min_lat, a_max_lon, a_max_lat),  # east strip
+        (max(a_min_lon, c_min_lon), a_min_lat, min(a_max_lon, c_max_lon), c_min_lat),  # south
+        (max(a_min_lon, c_min_lon), c_max_lat, min(a_max_lon, c_max_lon), a_max_lat),  # north
+    ]
+    return [
+        piece for piece in pieces
+        if piece[2] - piece[0] > COVERAGE_EPSILON and piece[3] - piece[1] > COVERAGE_EPSILON
+    ]
+
+
+class OccurrenceCache:
+    """
+    Spatially indexed, SQLite-backed store of downloaded occurrences.
+
+    For each taxon (and set of query filters) the store keeps the individual
+    records, indexed on a lon/lat grid, plus the rectangles that have been
+    downloaded completely. A query inside already-covered rectangles is
+    answered locally; otherwise only the uncovered parts of its bbox need
+    fetching. Records are deduplicated by GBIF occurrence key, so
+    overlapping downloads do not double count.
+
+    Each process should open its own instance; the database is in WAL mode
+    so several processes can read and write it concurrently. An instance
+    may be handed to another thread (e.g. a prefetching producer), but must
+    not be used by two threads at once.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl_days: Optional[float] = DEFAULT_TTL_DAYS,
+        refresh: RefreshPolicy = "auto",
+        offline: bool = False,
+    ):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path: SQLite database file
+            ttl_days: Age after which "auto" refresh treats a downloaded
+                area as uncovered (None = areas never expire)
+            refresh: Refresh policy, see RefreshPolicy
+            offline: Never fetch; answer every query from the cache and raise
+                OfflineCacheMiss for bboxes that are not fully covered
+        """
+        self.path = Path(path)
+        self.ttl_days = ttl_days
+        self.refresh = refresh
+        self.offline = offline
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    @staticmethod
+    def filter_key(params: dict) -> str:
+        """Stable key for a set of query filters."""
+        payload = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def coverage(self, taxon_key: int, params: dict) -> list[tuple[Rect, float]]:
+        """Downloaded rectangles for a taxon as (rect, fetched_at)."""
+        rows = self._conn.execute(
+            "SELECT min_lon, min_lat, max_lon, max_lat, fetched_at FROM occurrence_coverage "
+            "WHERE taxon_key = ? AND filter_key = ?",
+            (int(taxon_key), self.filter_key(params)),
+        ).fetchall()
+        return [(tuple(row[:4]), row[4]) for row in rows]
+
+    def missing_areas(
+        self,
+        taxon_key: int,
+        bbox: Rect,
+        params: dict,
+    ) -> list[Rect]:
+        """
+        Parts of a bbox that must be fetched, under the refresh policy.
+
+        Returns:
+            Rectangles covering the part of `bbox` not yet downloaded (or
+            whose download is older than the TTL); empty if the query can
+            be answered locally
+
+        Raises:
+            OfflineCacheMiss: In offline mode, if any part is missing
+        """
+        bbox = tuple(float(v) for v in bbox)
+        if self.refresh == "always" and not self.offline:
+            return [bbox]
+
+        now = time.time()
+        use_any_age = self.offline or self.refresh == "never" or self.ttl_days is None
+        missing = [bbox]
+        for rect, fetched_at in self.coverage(taxon_key, params):
+            if not use_any_age and (now - fetched_at) / 86400 > self.ttl_days:
+                continue
+            missing = [piece for area in missing for piece in subtract_rect(area, rect)]
+            if not missing:
+                break
+
+        if missing and self.offline:
+            raise OfflineCacheMiss(
+                f"Occurrences for taxon {taxon_key} in {bbox} are not fully cached "
+                f"({self.path}); rerun without --offline to fetch them"
+            )
+        return missing
+
+    def add_area(
+        self,
+        taxon_key: int,
+        area: Rect,
+        params: dict,
+        records: list[tuple[int, float, float]],
+    ) -> None:
+        """
+        Store every record downloaded for a rectangle.
+
+        Records previously stored inside the rectangle are replaced (so
+        records since deleted from GBIF drop out on refresh), and coverage
+        rectangles it contains are merged into it.
+
+        Args:
+            taxon_key: GBIF taxon key
+            area: Downloaded rectangle (min_lon, min_lat, max_lon, max_lat)
+            params: Query filters the records were fetched with
+            records: (gbif_key, longitude, latitude) of every record in `area`
+        """
+        min_lon, min_lat, max_lon, max_lat = area
+        key = (int(taxon_key), self.filter_key(params))
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM occurrence_points WHERE taxon_key = ? AND filter_key = ? "
+                "AND lon BETWEEN ? AND ? AND lat BETWEEN ? AND ?",
+                (*key, min_lon, max_lon, min_lat, max_lat),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO occurrence_points "
+                "(taxon_key, filter_key, gbif_key, lon, lat, cell_x, cell_y) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        *key, int(gbif_key), float(lon), float(lat),
+                        math.floor(lon / INDEX_CELL_SIZE), math.floor(lat / INDEX_CELL_SIZE),
+                    )
+                    for gbif_key, lon, lat in records
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM occurrence_coverage WHERE taxon_key = ? AND filter_key = ? "
+                "AND min_lon >= ? AND min_lat >= ? AND max_lon <= ? AND max_lat <= ?",
+                (*key, min_lon, min_lat, max_lon, max_lat),
+            )
+            self._conn.execute(
+                "INSERT INTO occurrence_coverage "
+                "(taxon_key, filter_key, min_lon, min_lat, max_lon, max_lat, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, min_lon, min_lat, max_lon, max_lat, time.time()),
+            )
+
+    def query(
+        self,
+        taxon_key: int,
+        bbox: Rect,
+        params: dict,
+    ) -> list[tuple[float, float]]:
+        """
+        Stored (longitude, latitude) of records inside a bbox.
+
+        Only meaningful once `missing_areas` is empty for the bbox. Results
+        are ordered by GBIF occurrence key.
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        rows = self._conn.execute(
+            "SELECT lon, lat FROM occurrence_points "
+            "WHERE taxon_key = ? AND filter_key = ? "
+            "AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ? "
+            "AND lon BETWEEN ? AND ? AND lat BETWEEN ? AND ? "
+            "ORDER BY gbif_key",
+            (
+                int(taxon_key), self.filter_key(params),
+                math.floor(min_lon / INDEX_CELL_SIZE), math.floor(max_lon / INDEX_CELL_SIZE),
+                math.floor(min_lat / INDEX_CELL_SIZE), math.floor(max_lat / INDEX_CELL_SIZE),
+                min_lon, max_lon, min_lat, max_lat,
+            ),
+        ).fetchall()
+        return [(lon, lat) for lon, lat in rows]
+
+    def invalidate(self, taxon_key: Optional[int] = None) -> int:
+        """
+        Delete stored records and coverage for one taxon (or all of them).
+
+        Returns:
+            Number of records removed
+        """
+        with self._conn:
+            if taxon_key is None:
+                self._conn.execute("DELETE FROM occurrence_coverage")
+                cur = self._conn.execute("DELETE FROM occurrence_points")
+            else:
+                self._conn.execute(
+                    "DELETE FROM occurrence_coverage WHERE taxon_key = ?", (int(taxon_key),)
+                )
+                cur = self._conn.execute(
+                    "DELETE FROM occurrence_points WHERE taxon_key = ?", (int(taxon_key),)
+                )
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        """Number of taxa, stored records and coverage rectangles."""
+        n_taxa, n_records = self._conn.execute(
+            "SELECT COUNT(DISTINCT taxon_key), COUNT(*) FROM occurrence_points"
+        ).fetchone()
+        n_areas, oldest = self._conn.execute(
+            "SELECT COUNT(*), MIN(fetched_at) FROM occurrence_coverage"
+        ).fetchone()
+        return {
+            "taxa": n_taxa,
+            "records": n_records,
+            "areas": n_areas,
+            "oldest_days": (time.time() - oldest) / 86400 if oldest is not None else None,
+        }
+
+
+class MatchCache:
+    """
+    Persistent memo of GBIF /species/match responses, keyed by name.
+
+    Responses are kept in memory as well, so repeated lookups within a
+    process do not touch the database. Safe to share between threads.
+    """
+
+    def __init__(self, path: Path, offline: bool = False):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path: SQLite database file
+            offline: Raise OfflineCacheMiss for names that are not stored
+                instead of letting the caller fetch them
+        """
+        self.path = Path(path)
+        self.offline = offline
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(MATCH_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._memory: dict[str, dict] = {}
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        Stored match response for a (normalized) name.
+
+        Returns:
+            The response, or None if the caller should fetch it
+
+        Raises:
+            OfflineCacheMiss: In offline mode, if the name is not stored
+        """
+        with self._lock:
+            if name in self._memory:
+                return self._memory[name]
+            row = self._conn.execute(
+                "SELECT response FROM name_matches WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None:
+                self._memory[name] = json.loads(row[0])
+                return self._memory[name]
+
+        if self.offline:
+            raise OfflineCacheMiss(
+                f"No cached GBIF match for {name!r} ({self.path}); "
+                "rerun without --offline to resolve it"
+            )
+        return None
+
+    def put(self, name: str, response: dict) -> None:
+        """Store the match response for a (normalized) name."""
+        with self._lock:
+            self._memory[name] = response
+            self._conn.execute(
+                "INSERT OR REPLACE INTO name_matches (name, response, fetched_at) VALUES (?, ?, ?)",
+                (name, json.dumps(response), time.time()),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM name_matches").fetchone()[0]
@@ -3,12 +3,19 @@ Tessera embedding mosaic loading and sampling.
 """
 
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
 import rasterio
 from rasterio.transform import Affine
 
+from .instrument import count, traced
+from .pyramid import load_tile_level
+from .tiles import get_catalog
+
+if TYPE_CHECKING:
+    from .projection import EmbeddingProjection
+
 
 class EmbeddingMosaic:
     """
@@ -24,6 +31,8 @@ class EmbeddingMosaic:
         bbox: tuple[float, float, float, float],
         year: int = 2024,
         tile_size: float = 0.1,
+        projection: Optional["EmbeddingProjection"] = None,
+        level: int = 0,
     ):
         """
         Initialize the mosaic for a given bounding box.
@@ -33,54 +42,50 @@ class EmbeddingMosaic:
             bbox: (min_lon, min_lat, max_lon, max_lat)
             year: Year of embeddings to load
             tile_size: Size of each tile in degrees (default 0.1°)
+            projection: If provided, project each tile to fewer channels as
+                it is loaded
+            level: Pyramid level to load (see finder.pyramid); level L has
+                one mean-pooled pixel per 2**L x 2**L tile pixels. Coarse
+                pixels are spread evenly over each tile, so a tile whose
+                size is not a multiple of 2**L is stretched by less than
+                one coarse pixel.
         """
         self.cache_dir = Path(cache_dir)
         self.bbox = bbox
         self.year = year
         self.tile_size = tile_size
+        self.projection = projection
+        self.level = level
 
         self._mosaic: Optional[np.ndarray] = None
+        self._valid_fraction: Optional[np.ndarray] = None
         self._transform: Optional[Affine] = None
         self._tile_coords: list[tuple[float, float]] = []
 
+    @traced("mosaic.load")
     def load(self) -> None:
-        """Load and stitch tiles covering the bounding box."""
-        min_lon, min_lat, max_lon, max_lat = self.bbox
-        tile_dir = self.cache_dir / str(self.year)
-
-        # Calculate tile grid covering bbox
+        """Load and stitch tiles covering the bounding box (found via the tile catalog)."""
+        catalog = get_catalog(self.cache_dir, self.year, self.tile_size)
         step = self.tile_size
-        # Tiles are named by their center, offset by half step
-        half_step = step / 2
-
-        tile_lons = np.arange(
-            np.floor((min_lon + half_step) / step) * step - half_step,
-            max_lon + step,
-            step
-        )
-        tile_lats = np.arange(
-            np.floor((min_lat + half_step) / step) * step - half_step,
-            max_lat + step,
-            step
-        )
 
         # Load available tiles
         tiles: dict[tuple[float, float], np.ndarray] = {}
-        for tlon in tile_lons:
-            for tlat in tile_lats:
-                tlon_r, tlat_r = round(tlon, 2), round(tlat, 2)
-                name = f"grid_{tlon_r:.2f}_{tlat_r:.2f}"
-                npy_path = tile_dir / name / f"{name}.npy"
-                scales_path = tile_dir / name / f"{name}_scales.npy"
-
-                if npy_path.exists() and scales_path.exists():
-                    data = np.load(npy_path).astype(np.float32)
-                    scales = np.load(scales_path)
-                    # Dequantize: multiply by scales
-                    tiles[(tlon_r, tlat_r)] = data * scales[:, :, np.newaxis]
+        fractions: dict[tuple[float, float], np.ndarray] = {}
+        for index in catalog.tiles_in_bbox(self.bbox):
+            if self.level > 0:
+                tile, fractions[catalog.tile_coords(index)] = load_tile_level(
+                    catalog, index, self.level
+                )
+            else:
+                tile = catalog.load_tile(index)
+            # Projections are affine, so projecting pooled means is the
+            # same as pooling projected pixels
+            if self.projection is not None:
+                tile = self.projection.transform(tile)
+            tiles[catalog.tile_coords(index)] = tile
 
         if not tiles:
-            raise ValueError(f"No tiles found in {tile_dir} for bbox {self.bbox}")
+            raise ValueError(f"No tiles found in {catalog.year_dir} for bbox {self.bbox}")
 
         self._tile_coords = list(tiles.keys())
 
@@ -96,6 +101,9 @@ class EmbeddingMosaic:
         mosaic_h = len(unique_lats) * tile_h
         mosaic_w = len(unique_lons) * tile_w
         self._mosaic = np.zeros((mosaic_h, mosaic_w, n_channels), dtype=np.float32)
+        count("mosaic_pixels", mosaic_h * mosaic_w)
+        if fractions:
+            self._valid_fraction = np.zeros((mosaic_h, mosaic_w), dtype=np.float32)
 
         # Stitch tiles
         for i, tlat in enumerate(unique_lats):
@@ -104,6 +112,10 @@ class EmbeddingMosaic:
                     tile = tiles[(tlon, tlat)]
                     h, w = tile.shape[:2]
                     self._mosaic[i*tile_h:i*tile_h+h, j*tile_w:j*tile_w+w, :] = tile
+                    if fractions:
+                        self._valid_fraction[i*tile_h:i*tile_h+h, j*tile_w:j*tile_w+w] = (
+                            fractions[(tlon, tlat)]
+                        )
 
         # Create geotransform
         mosaic_min_lon = min(unique_lons)
@@ -117,6 +129,11 @@ class EmbeddingMosaic:
             mosaic_h
         )
 
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the tiles have been loaded."""
+        return self._mosaic is not None
+
     @property
     def mosaic(self) -> np.ndarray:
         """Get the loaded mosaic array (H, W, C)."""
@@ -131,6 +148,13 @@ class EmbeddingMosaic:
             self.load()
         return self._transform
 
+    @property
+    def valid_fraction(self) -> np.ndarray:
+        """Fraction of non-empty tile pixels behind each mosaic pixel (H, W)."""
+        if self._valid_fraction is None:
+            self._valid_fraction = self.mosaic.any(axis=2).astype(np.float32)
+        return self._valid_fraction
+
     @property
     def shape(self) -> tuple[int, int, int]:
         """Get mosaic shape (height, width, channels)."""
@@ -183,3 +207,22 @@ class EmbeddingMosaic:
         """Convert geographic coordinates to pixel coordinates."""
         row, col = rasterio.transform.rowcol(self.transform, lon, lat)
         return row, col
+
+    def coords_to_pixels(
+        self,
+        coords: list[tuple[float, float]]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Convert many geographic coordinates to pixel coordinates at once.
+
+        Args:
+            coords: List of (longitude, latitude) tuples
+
+        Returns:
+            Tuple of (rows, cols) integer arrays (may fall outside the mosaic)
+        """
+        if len(coords) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        lons, lats = np.asarray(coords, dtype=np.float64).T
+        rows, cols = rasterio.transform.rowcol(self.transform, lons, lats)
+        return np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
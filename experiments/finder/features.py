@@ -0,0 +1,560 @@
+"""
+On-disk feature store for occurrence embeddings.
+
+Persists the occurrences fetched for a species together with their matched
+pixel indices and embeddings, keyed by (taxon_key, bbox, year), so training
+and experiments can skip re-fetching from GBIF and re-sampling the mosaic.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from queue import Full, Queue
+from typing import Iterable, Iterator, Optional, TypeVar
+
+import numpy as np
+
+from .cache import OccurrenceCache
+from .embeddings import EmbeddingMosaic
+from .gbif import iter_occurrence_pages
+from .ingest import OccurrenceArchive
+
+MANIFEST_NAME = "manifest.json"
+
+# Occurrence pages (of up to 300 records) downloaded ahead of sampling
+PREFETCH_ITEMS = 256
+
+T = TypeVar("T")
+
+
+def region_key(bbox: tuple[float, float, float, float], year: int) -> str:
+    """Stable directory-safe key for a (bbox, year) pair."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return f"{min_lon:.4f}_{min_lat:.4f}_{max_lon:.4f}_{max_lat:.4f}_{year}"
+
+
+def parse_region_key(key: str) -> Optional[tuple[tuple[float, float, float, float], int]]:
+    """The (bbox, year) a region key was made from, or None if it is not one."""
+    parts = key.split("_")
+    if len(parts) != 5:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(p) for p in parts[:4])
+        return (min_lon, min_lat, max_lon, max_lat), int(parts[4])
+    except ValueError:
+        return None
+
+
+def mosaic_key(mosaic: EmbeddingMosaic) -> str:
+    """Region key for a mosaic, distinguishing projected and pooled embeddings."""
+    key = region_key(mosaic.bbox, mosaic.year)
+    if mosaic.projection is not None:
+        key += f"_{mosaic.projection.name}"
+    if mosaic.level > 0:
+        key += f"_L{mosaic.level}"
+    return key
+
+
+@dataclass
+class OccurrenceFeatures:
+    """
+    Occurrences of one species in one region, matched to the mosaic.
+
+    `coords` and `pixels` hold every fetched occurrence (pixels are -1 for
+    occurrences that fall outside the mosaic); `embeddings` holds one row per
+    occurrence inside the mosaic, in the same order.
+    """
+
+    taxon_key: int
+    coords: np.ndarray  # (N, 2) longitude, latitude
+    pixels: np.ndarray  # (N, 2) row, col
+    embeddings: np.ndarray  # (M, C) for occurrences inside the mosaic
+
+    @property
+    def n_occurrences(self) -> int:
+        """Number of fetched occurrences, including ones outside the mosaic."""
+        return len(self.coords)
+
+    @property
+    def valid_mask(self) -> np.ndarray:
+        """Boolean mask of occurrences that fall inside the mosaic."""
+        return self.pixels[:, 0] >= 0
+
+    @property
+    def valid_coords(self) -> list[tuple[float, float]]:
+        """(longitude, latitude) of occurrences with an embedding."""
+        return [(float(lon), float(lat)) for lon, lat in self.coords[self.valid_mask]]
+
+    @property
+    def valid_pixels(self) -> np.ndarray:
+        """(row, col) of occurrences with an embedding."""
+        return self.pixels[self.valid_mask]
+
+    def unique_pixels(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Collapse occurrences that fall in the same pixel.
+
+        Occurrences in one pixel share an embedding, so the counts can be
+        used as sample weights in place of the repeated rows.
+
+        Returns:
+            Tuple of (embeddings, counts, pixels), one row per distinct pixel
+        """
+        pixels = self.valid_pixels
+        embeddings = np.asarray(self.embeddings)
+        if len(pixels) == 0:
+            return embeddings, np.zeros(0, dtype=np.int64), pixels
+        unique, first, counts = np.unique(
+            pixels, axis=0, return_index=True, return_counts=True
+        )
+        return embeddings[first], counts, unique
+
+    @classmethod
+    def from_mosaic(
+        cls,
+        taxon_key: int,
+        mosaic: EmbeddingMosaic,
+        occurrences: list[tuple[float, float]],
+    ) -> "OccurrenceFeatures":
+        """Sample the mosaic at the given occurrence coordinates."""
+        h, w, c = mosaic.shape
+        coords = np.asarray(occurrences, dtype=np.float64).reshape(-1, 2)
+        rows, cols = mosaic.coords_to_pixels(occurrences)
+        inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+
+        pixels = np.full((len(coords), 2), -1, dtype=np.int32)
+        pixels[inside, 0] = rows[inside]
+        pixels[inside, 1] = cols[inside]
+        embeddings = mosaic.mosaic[rows[inside], cols[inside], :].reshape(-1, c)
+
+        return cls(
+            taxon_key=taxon_key,
+            coords=coords,
+            pixels=pixels,
+            embeddings=embeddings.astype(np.float32, copy=False),
+        )
+
+    @classmethod
+    def from_pages(
+        cls,
+        taxon_key: int,
+        mosaic: EmbeddingMosaic,
+        pages: Iterable[list[tuple[float, float]]],
+    ) -> "OccurrenceFeatures":
+        """Sample the mosaic page by page, as the occurrence pages arrive."""
+        parts = [cls.from_mosaic(taxon_key, mosaic, page) for page in pages if len(page)]
+        if not parts:
+            return cls.from_mosaic(taxon_key, mosaic, [])
+        return cls.concatenate(taxon_key, parts)
+
+    @classmethod
+    def concatenate(
+        cls,
+        taxon_key: int,
+        parts: list["OccurrenceFeatures"],
+    ) -> "OccurrenceFeatures":
+        """Join features sampled from the same mosaic, in order."""
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            taxon_key=taxon_key,
+            coords=np.vstack([p.coords for p in parts]),
+            pixels=np.vstack([p.pixels for p in parts]),
+            embeddings=np.vstack([p.embeddings for p in parts]),
+        )
+
+
+def _variant(mosaic: EmbeddingMosaic) -> Optional[str]:
+    """Feature store variant for a mosaic (projection name and pyramid level, if any)."""
+    parts = []
+    if mosaic.projection is not None:
+        parts.append(mosaic.projection.name)
+    if mosaic.level > 0:
+        parts.append(f"L{mosaic.level}")
+    return "_".join(parts) or None
+
+
+class FeatureStore:
+    """
+    Directory of memory-mappable occurrence feature arrays.
+
+    Layout::
+
+        {root}/manifest.json
+        {root}/{taxon_key}/{region_key}/coords.npy
+        {root}/{taxon_key}/{region_key}/pixels.npy
+        {root}/{taxon_key}/{region_key}/embeddings.npy
+
+    Entries for projected or pyramid-level mosaics get a variant suffix on
+    the region key (e.g. "_pca64", "_L4"), since their embeddings have fewer
+    channels or pixels.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def entry_dir(
+        self,
+        taxon_key: int,
+        bbox: tuple[float, float, float, float],
+        year: int,
+        variant: Optional[str] = None,
+    ) -> Path:
+        """Directory holding the arrays for one entry."""
+        return self.root / str(taxon_key) / self._key(bbox, year, variant)
+
+    @staticmethod
+    def _key(
+        bbox: tuple[float, float, float, float],
+        year: int,
+        variant: Optional[str] = None,
+    ) -> str:
+        key = region_key(bbox, year)
+        return f"{key}_{variant}" if variant else key
+
+    def manifest(self) -> dict:
+        """Read the manifest describing every stored entry."""
+        path = self.root / MANIFEST_NAME
+        if not path.exists():
+            return {"entries": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def get(
+        self,
+        taxon_key: int,
+        bbox: tuple[float, float, float, float],
+        year: int,
+        mmap: bool = True,
+        variant: Optional[str] = None,
+    ) -> Optional[OccurrenceFeatures]:
+        """
+        Load a stored entry.
+
+        Args:
+            taxon_key: GBIF taxon key
+            bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
+            year: Embedding year
+            mmap: Memory-map the arrays instead of reading them into RAM
+            variant: Projection name and/or pyramid level of the mosaic
+
+        Returns:
+            OccurrenceFeatures, or None if the entry is not stored
+        """
+        entry = self.entry_dir(taxon_key, bbox, year, variant)
+        paths = [entry / f"{name}.npy" for name in ("coords", "pixels", "embeddings")]
+        if not all(p.exists() for p in paths):
+            return None
+
+        mode = "r" if mmap else None
+        coords, pixels, embeddings = (np.load(p, mmap_mode=mode) for p in paths)
+        # Arrays of different writes (e.g. left by an interrupted older
+        # version of the store) are treated as a missing entry
+        if len(coords) != len(pixels) or np.count_nonzero(pixels[:, 0] >= 0) != len(embeddings):
+            return None
+        return OccurrenceFeatures(
+            taxon_key=taxon_key,
+            coords=coords,
+            pixels=pixels,
+            embeddings=embeddings,
+        )
+
+    def append(
+        self,
+        taxon_key: int,
+        mosaic: EmbeddingMosaic,
+        occurrences: list[tuple[float, float]],
+    ) -> OccurrenceFeatures:
+        """
+        Add occurrences to an entry, sampling only ones not already stored.
+
+        Occurrences are compared as a multiset of coordinates, so repeated
+        records at the same location are kept as separate samples.
+
+        Args:
+            taxon_key: GBIF taxon key
+            mosaic: Embedding mosaic for the entry's bbox and year
+            occurrences: Full current list of (longitude, latitude) tuples
+
+        Returns:
+            The updated entry
+        """
+        return self.append_pages(taxon_key, mosaic, [occurrences])
+
+    def append_pages(
+        self,
+        taxon_key: int,
+        mosaic: EmbeddingMosaic,
+        pages: Iterable[list[tuple[float, float]]],
+    ) -> OccurrenceFeatures:
+        """
+        Like `append`, but takes the occurrences in pages.
+
+        Each page's new occurrences are sampled as soon as the page arrives,
+        so sampling overlaps with downloading the later pages.
+
+        Args:
+            taxon_key: GBIF taxon key
+            mosaic: Embedding mosaic for the entry's bbox and year
+            pages: Lists of (longitude, latitude) tuples that together make
+                up the full current set of occurrences
+
+        Returns:
+            The updated entry
+        """
+        variant = _variant(mosaic)
+        existing = self.get(taxon_key, mosaic.bbox, mosaic.year, mmap=False, variant=variant)
+        stored = Counter() if existing is None else Counter(map(tuple, existing.coords.tolist()))
+
+        added = []
+        for page in pages:
+            new_occurrences = []
+            for coord in page:
+                key = (float(coord[0]), float(coord[1]))
+                if stored[key] > 0:
+                    stored[key] -= 1
+                else:
+                    new_occurrences.append(key)
+            if new_occurrences:
+                added.append(OccurrenceFeatures.from_mosaic(taxon_key, mosaic, new_occurrences))
+
+        if existing is not None and not added:
+            self._mark_checked(taxon_key, mosaic.bbox, mosaic.year, variant)
+            return existing
+        if existing is None and not added:
+            added.append(OccurrenceFeatures.from_mosaic(taxon_key, mosaic, []))
+
+        parts = added if existing is None else [existing, *added]
+        merged = OccurrenceFeatures.concatenate(taxon_key, parts)
+        self._write(merged, mosaic.bbox, mosaic.year, variant)
+        return merged
+
+    def _write(
+        self,
+        features: OccurrenceFeatures,
+        bbox: tuple[float, float, float, float],
+        year: int,
+        variant: Optional[str] = None,
+    ) -> None:
+        """
+        Replace an entry's arrays and update the manifest.
+
+        The arrays are written to a private directory that is renamed into
+        place under the store lock, so concurrent writers never mix their
+        arrays. A reader racing the swap may briefly find no entry (and `get`
+        drops arrays whose lengths disagree); memory maps of the old arrays
+        stay valid.
+        """
+        entry = self.entry_dir(features.taxon_key, bbox, year, variant)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        suffix = f"{os.getpid()}_{threading.get_ident()}"
+        tmp_entry = entry.with_name(f"{entry.name}.tmp{suffix}")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        tmp_entry.mkdir()
+        for name in ("coords", "pixels", "embeddings"):
+            np.save(tmp_entry / f"{name}.npy", np.ascontiguousarray(getattr(features, name)))
+
+        with self._locked():
+            old_entry = entry.with_name(f"{entry.name}.old{suffix}")
+            if entry.exists():
+                os.rename(entry, old_entry)
+            os.rename(tmp_entry, entry)
+            shutil.rmtree(old_entry, ignore_errors=True)
+
+            manifest = self.manifest()
+            now = datetime.now(timezone.utc).isoformat()
+            manifest["entries"][f"{features.taxon_key}/{self._key(bbox, year, variant)}"] = {
+                "taxon_key": features.taxon_key,
+                "bbox": list(bbox),
+                "year": year,
+                "variant": variant,
+                "n_occurrences": features.n_occurrences,
+                "n_valid": len(features.embeddings),
+                "n_channels": int(features.embeddings.shape[1]),
+                "dtype": str(features.embeddings.dtype),
+                "updated": now,
+                "checked": now,
+            }
+            self._save_manifest(manifest)
+
+    def checked_age_days(
+        self,
+        taxon_key: int,
+        bbox: tuple[float, float, float, float],
+        year: int,
+        variant: Optional[str] = None,
+    ) -> Optional[float]:
+        """Days since an entry's occurrences were last compared with GBIF (None if unknown)."""
+        entry = self.manifest()["entries"].get(f"{taxon_key}/{self._key(bbox, year, variant)}")
+        if entry is None:
+            return None
+        checked = datetime.fromisoformat(entry.get("checked", entry["updated"]))
+        return (datetime.now(timezone.utc) - checked).total_seconds() / 86400
+
+    def _mark_checked(
+        self,
+        taxon_key: int,
+        bbox: tuple[float, float, float, float],
+        year: int,
+        variant: Optional[str] = None,
+    ) -> None:
+        """Record that an entry was found up to date with GBIF."""
+        with self._locked():
+            manifest = self.manifest()
+            entry = manifest["entries"].get(f"{taxon_key}/{self._key(bbox, year, variant)}")
+            if entry is None:
+                return
+            entry["checked"] = datetime.now(timezone.utc).isoformat()
+            self._save_manifest(manifest)
+
+    def _save_manifest(self, manifest: dict) -> None:
+        tmp_path = self.root / f"{MANIFEST_NAME}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.root / MANIFEST_NAME)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold an exclusive lock on the store while swapping entries or updating the manifest."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _prefetch(items: Iterable[T], max_ahead: int = PREFETCH_ITEMS) -> Iterator[Iterator[T]]:
+    """
+    Iterate `items` in a background thread for the duration of the block.
+
+    Yields an iterator over the same items in order; the producer runs up
+    to `max_ahead` items ahead of the consumer, and an exception it raises
+    is re-raised by the consumer in place of the remaining items. On leaving
+    the block (also on error) the producer is stopped, and joined, so
+    nothing it uses (e.g. an occurrence cache) is touched afterwards.
+    """
+    queue: Queue = Queue(maxsize=max_ahead)
+    stop = threading.Event()
+    end = object()
+
+    def put(entry: tuple) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    break
+            else:
+                put((end, None))
+        except BaseException as e:
+            put((end, e))
+        finally:
+            # Closes a generator early (cancelling its pending requests)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def consume() -> Iterator[T]:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+
+    thread = threading.Thread(target=produce, name="occurrence-prefetch", daemon=True)
+    thread.start()
+    try:
+        yield consume()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _entry_expired(
+    store: FeatureStore,
+    taxon_key: int,
+    mosaic: EmbeddingMosaic,
+    variant: Optional[str],
+    occurrence_cache: Optional[OccurrenceCache],
+) -> bool:
+    """Whether a stored entry is past the occurrence cache's TTL."""
+    if occurrence_cache is None or occurrence_cache.offline:
+        return False
+    if occurrence_cache.refresh == "always":
+        return True
+    if occurrence_cache.refresh == "never" or occurrence_cache.ttl_days is None:
+        return False
+    age = store.checked_age_days(taxon_key, mosaic.bbox, mosaic.year, variant)
+    return age is None or age > occurrence_cache.ttl_days
+
+
+def load_occurrence_features(
+    taxon_key: int,
+    mosaic: EmbeddingMosaic,
+    store: Optional[FeatureStore] = None,
+    refresh: bool = False,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+) -> OccurrenceFeatures:
+    """
+    Get occurrence embeddings for a species, reading from the store if possible.
+
+    With an occurrence cache on the "auto" refresh policy, stored entries
+    last compared with GBIF longer ago than the cache's TTL are refreshed
+    like cached areas are, so new records reach the store (and the model
+    fingerprints) without a forced refetch of everything.
+
+    On a store miss the occurrence pages are downloaded in a background
+    thread while the mosaic loads (if it is not loaded yet), and each page is
+    sampled as it arrives, so network and disk time overlap.
+
+    Args:
+        taxon_key: GBIF taxon key
+        mosaic: Embedding mosaic for the region (loaded lazily on a store miss)
+        store: Feature store to read from and write to (None = always fetch)
+        refresh: Re-fetch occurrences from GBIF and append any new ones
+        occurrence_cache: Local cache of GBIF query results used when fetching
+        occurrence_archive: Ingested GBIF downloads, read instead of the API
+            for the taxa they hold
+
+    Returns:
+        OccurrenceFeatures for the mosaic's bbox and year
+    """
+    if store is not None and not refresh:
+        variant = _variant(mosaic)
+        cached = store.get(taxon_key, mosaic.bbox, mosaic.year, variant=variant)
+        if cached is not None and not _entry_expired(
+            store, taxon_key, mosaic, variant, occurrence_cache
+        ):
+            return cached
+
+    with _prefetch(iter_occurrence_pages(
+        taxon_key, mosaic.bbox, cache=occurrence_cache, archive=occurrence_archive
+    )) as pages:
+        if not mosaic.is_loaded:
+            mosaic.load()
+
+        if store is None:
+            return OccurrenceFeatures.from_pages(taxon_key, mosaic, pages)
+        return store.append_pages(taxon_key, mosaic, pages)
@@ -0,0 +1,65 @@
+"""
+Training-input fingerprints for incremental retraining.
+
+A fingerprint hashes everything that determines a trained model: the
+occurrence set, the background seed, the embedding year and the
+hyperparameters. It is stored next to the model so a later run can tell
+whether retraining would produce anything new.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+
+def compute_fingerprint(
+    coords: np.ndarray,
+    seed: int,
+    year: int,
+    params: dict,
+) -> str:
+    """
+    Hash the inputs that determine a trained model.
+
+    Args:
+        coords: (N, 2) occurrence coordinates; order does not matter
+        seed: Random seed used for background sampling
+        year: Embedding year
+        params: JSON-serializable hyperparameters
+
+    Returns:
+        Hex digest identifying this training configuration
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    order = np.lexsort((coords[:, 1], coords[:, 0]))
+
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(coords[order]).tobytes())
+    digest.update(
+        json.dumps({"seed": seed, "year": year, "params": params}, sort_keys=True).encode()
+    )
+    return digest.hexdigest()
+
+
+def fingerprint_path(model_path: Union[str, Path]) -> Path:
+    """Sidecar file holding the fingerprint for a saved model."""
+    return Path(model_path).with_suffix(".fingerprint.json")
+
+
+def read_fingerprint(model_path: Union[str, Path]) -> Optional[str]:
+    """Read the fingerprint saved for a model, if both exist."""
+    model_path = Path(model_path)
+    path = fingerprint_path(model_path)
+    if not model_path.exists() or not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f).get("fingerprint")
+
+
+def write_fingerprint(model_path: Union[str, Path], fingerprint: str, **info) -> None:
+    """Save a fingerprint (plus any descriptive fields) next to a model."""
+    with open(fingerprint_path(model_path), "w") as f:
+        json.dump({"fingerprint": fingerprint, **info}, f, indent=2)
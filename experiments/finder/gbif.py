@@ -1,33 +1,131 @@
 """
 GBIF API interactions for fetching species data and occurrences.
+
+All requests go through one pooled session per process, with keep-alive,
+timeouts, and retries with backoff on rate limiting and server errors. The
+API base URL can be overridden with the GBIF_API_URL environment variable
+(e.g. to point at a local stand-in server).
 """
 
+import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from .cache import MatchCache, OccurrenceCache
+from .ingest import OccurrenceArchive
+from .instrument import count
 
-def get_species_key(species_name: str) -> int:
-    """Look up GBIF taxon key for a species name."""
-    resp = requests.get(
-        "https://api.gbif.org/v1/species/match",
-        params={"name": species_name}
-    )
+logger = logging.getLogger(__name__)
+
+GBIF_API_URL = os.environ.get("GBIF_API_URL", "https://api.gbif.org/v1").rstrip("/")
+
+# Occurrence search paging (300 is the API's maximum page size)
+PAGE_SIZE = 300
+MAX_FETCH_WORKERS = 8
+
+# Search filters applied to every occurrence query (part of the cache key)
+OCCURRENCE_FILTERS = {"hasCoordinate": True, "hasGeospatialIssue": False}
+
+# Retry and timeout policy for every request
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT = (10, 60)  # (connect, read) seconds
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Shared HTTP session for GBIF requests.
+
+    Connections are pooled (sized for concurrent page fetching) and kept
+    alive between calls. Failed requests are retried with exponential,
+    jittered backoff, honouring Retry-After. A new session is created after
+    a fork so worker processes never share sockets with their parent.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=BACKOFF_SECONDS,
+                backoff_jitter=BACKOFF_SECONDS / 2,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset({"GET"}),
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=MAX_FETCH_WORKERS * 2,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def _get_json(url: str, params: dict) -> dict:
+    """GET a GBIF API endpoint through the shared session."""
+    resp = get_session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+    count("http_requests")
     resp.raise_for_status()
-    data = resp.json()
+    return resp.json()
+
+
+def normalize_name(name: str) -> str:
+    """Collapse whitespace in a scientific name (the form used as match cache key)."""
+    return " ".join(name.split())
+
+
+def match_name(species_name: str, match_cache: Optional[MatchCache] = None) -> dict:
+    """
+    Match a name against the GBIF backbone.
+
+    Args:
+        species_name: Scientific name to match
+        match_cache: Persistent name -> match memo; hits skip the request
+
+    Returns:
+        The raw /species/match response
+    """
+    name = normalize_name(species_name)
+    if match_cache is not None:
+        cached = match_cache.get(name)
+        if cached is not None:
+            return cached
+
+    data = _get_json(f"{GBIF_API_URL}/species/match", {"name": name})
+    if match_cache is not None:
+        match_cache.put(name, data)
+    return data
+
+
+def get_species_key(species_name: str, match_cache: Optional[MatchCache] = None) -> int:
+    """Look up GBIF taxon key for a species name."""
+    data = match_name(species_name, match_cache)
     key = data.get("usageKey")
     if not key:
         raise ValueError(f"Species not found: {species_name}")
     return key
 
 
-def get_species_info(species_name: str) -> dict:
+def get_species_info(species_name: str, match_cache: Optional[MatchCache] = None) -> dict:
     """Get species information including taxon key and matched name."""
-    resp = requests.get(
-        "https://api.gbif.org/v1/species/match",
-        params={"name": species_name}
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    data = match_name(species_name, match_cache)
     if not data.get("usageKey"):
         raise ValueError(f"Species not found: {species_name}")
     return {
@@ -42,7 +140,10 @@ def get_species_info(species_name: str) -> dict:
 def fetch_occurrences(
     taxon_key: int,
     bbox: tuple[float, float, float, float],
-    limit: Optional[int] = None
+    limit: Optional[int] = None,
+    cache: Optional[OccurrenceCache] = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+    archive: Optional[OccurrenceArchive] = None,
 ) -> list[tuple[float, float]]:
     """
     Fetch occurrence coordinates from GBIF.
@@ -51,46 +152,278 @@ def fetch_occurrences(
         taxon_key: GBIF taxon key
         bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
         limit: Maximum number of occurrences to fetch (None = all)
+        cache: Local occurrence store; parts of the bbox it already covers
+            are answered locally (subject to its refresh policy) and only
+            the rest is fetched. With a cache, `limit` only truncates the
+            result.
+        max_workers: Maximum number of pages requested concurrently
+        archive: Store of ingested GBIF downloads; queries a download
+            covers in full are read from it instead of the cache / API
+            (see `_archive_source`)
 
     Returns:
         List of (longitude, latitude) tuples
     """
-    min_lon, min_lat, max_lon, max_lat = bbox
+    if _archive_source(archive, taxon_key, bbox, cache) is not None:
+        results = archive.query(taxon_key, bbox)
+        return results[:limit] if limit else results
+
+    if cache is None:
+        records = _fetch_occurrence_records(taxon_key, bbox, limit, max_workers=max_workers)
+        return [(lon, lat) for _, lon, lat in records]
+
+    # Fetch whatever part of the bbox the cache does not cover, then
+    # answer the query from the cache
+    for area in cache.missing_areas(taxon_key, bbox, OCCURRENCE_FILTERS):
+        records = _fetch_occurrence_records(taxon_key, area, max_workers=max_workers)
+        cache.add_area(taxon_key, area, OCCURRENCE_FILTERS, records)
+
+    results = cache.query(taxon_key, bbox, OCCURRENCE_FILTERS)
+    if limit:
+        results = results[:limit]
+    return results
+
+
+def iter_occurrence_pages(
+    taxon_key: int,
+    bbox: tuple[float, float, float, float],
+    limit: Optional[int] = None,
+    cache: Optional[OccurrenceCache] = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+    archive: Optional[OccurrenceArchive] = None,
+) -> Iterator[list[tuple[float, float]]]:
+    """
+    Fetch occurrence coordinates from GBIF, yielding each page as it arrives.
+
+    Streaming form of `fetch_occurrences`, so callers can process early
+    pages while later ones are still downloading. The pages together hold
+    the same occurrences as `fetch_occurrences` returns (with a cache, in a
+    possibly different order: freshly fetched pages come first, then the
+    records the cache already held, in one batch). Answers from the archive,
+    or from a cache that covers the whole bbox, arrive as a single page.
+
+    Args:
+        taxon_key: GBIF taxon key
+        bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
+        limit: Stop after this many occurrences (None = all)
+        cache: Local occurrence store (see `fetch_occurrences`); fetched
+            areas are added to it as they complete
+        max_workers: Maximum number of pages requested concurrently
+        archive: Store of ingested GBIF downloads (see `fetch_occurrences`)
+
+    Yields:
+        Lists of (longitude, latitude) tuples
+    """
+    remaining = limit
+
+    def truncate(page: list[tuple[float, float]]) -> list[tuple[float, float]]:
+        nonlocal remaining
+        if remaining is None:
+            return page
+        page = page[:remaining]
+        remaining -= len(page)
+        return page
+
+    if _archive_source(archive, taxon_key, bbox, cache) is not None:
+        yield truncate(archive.query(taxon_key, bbox))
+        return
+
+    if cache is None:
+        for records in _iter_occurrence_record_pages(taxon_key, bbox, limit, max_workers):
+            yield [(lon, lat) for _, lon, lat in records]
+        return
+
+    # Stream the areas the cache does not cover (skipping records repeated
+    # on shared area edges), then yield what the cache held for the rest
+    fetched: Counter = Counter()
+    seen_keys: set[int] = set()
+    for area in cache.missing_areas(taxon_key, bbox, OCCURRENCE_FILTERS):
+        area_records = []
+        for records in _iter_occurrence_record_pages(taxon_key, area, max_workers=max_workers):
+            area_records.extend(records)
+            page = [(lon, lat) for key, lon, lat in records if key not in seen_keys]
+            seen_keys.update(key for key, _, _ in records)
+            fetched.update(page)
+            if remaining != 0:
+                yield truncate(page)
+        cache.add_area(taxon_key, area, OCCURRENCE_FILTERS, area_records)
+
+    held = []
+    for coord in cache.query(taxon_key, bbox, OCCURRENCE_FILTERS):
+        if fetched[coord] > 0:
+            fetched[coord] -= 1
+        else:
+            held.append(coord)
+    if held and remaining != 0:
+        yield truncate(held)
+
+
+def _archive_source(
+    archive: Optional[OccurrenceArchive],
+    taxon_key: int,
+    bbox: tuple[float, float, float, float],
+    cache: Optional[OccurrenceCache],
+) -> Optional[dict]:
+    """
+    The ingested download that may answer a query, if any.
+
+    A download answers only if it holds the taxon and covers the whole
+    bbox in full. With a cache, its refresh policy applies to downloads
+    as to cached areas: "always" skips the archive, and "auto" skips
+    downloads older than the TTL (offline, any age will do).
+    """
+    if archive is None:
+        return None
+    max_age_days = None
+    if cache is not None and not cache.offline:
+        if cache.refresh == "always":
+            return None
+        if cache.refresh == "auto":
+            max_age_days = cache.ttl_days
+    source = archive.covering_source(taxon_key, bbox, max_age_days)
+    if source is None and archive.has_taxon(taxon_key):
+        logger.info(
+            f"Ingested downloads of taxon {taxon_key} do not cover {bbox} "
+            f"(or are past the refresh TTL); querying the API"
+        )
+    return source
+
+
+def _page_records(data: dict) -> list[tuple[int, float, float]]:
+    """(gbif_key, longitude, latitude) of the georeferenced records in one search page."""
+    return [
+        (r["key"], r["decimalLongitude"], r["decimalLatitude"])
+        for r in data.get("results", [])
+        if r.get("decimalLatitude") and r.get("decimalLongitude")
+    ]
+
+
+def _fetch_occurrence_records(
+    taxon_key: int,
+    bbox: tuple[float, float, float, float],
+    limit: Optional[int] = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+) -> list[tuple[int, float, float]]:
+    """
+    Fetch every page of an occurrence search.
+
+    Returns:
+        List of (gbif_key, longitude, latitude) tuples
+    """
     results = []
+    for records in _iter_occurrence_record_pages(taxon_key, bbox, limit, max_workers):
+        results.extend(records)
+    return results
+
+
+def _iter_occurrence_record_pages(
+    taxon_key: int,
+    bbox: tuple[float, float, float, float],
+    limit: Optional[int] = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+) -> Iterator[list[tuple[int, float, float]]]:
+    """
+    Yield the pages of an occurrence search in offset order.
+
+    The first page gives the total count; the remaining offsets are then
+    requested in parallel (at most `max_workers` at a time) and yielded in
+    offset order as they complete, so results match a sequential walk.
+    Closing the generator early cancels the pages not yet requested.
+
+    Yields:
+        Lists of (gbif_key, longitude, latitude) tuples
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    url = f"{GBIF_API_URL}/occurrence/search"
+    params = {
+        "taxonKey": taxon_key,
+        "hasCoordinate": "true",
+        "hasGeospatialIssue": "false",
+        "decimalLatitude": f"{min_lat},{max_lat}",
+        "decimalLongitude": f"{min_lon},{max_lon}",
+        "limit": PAGE_SIZE,
+    }
+
+    first = _get_json(url, {**params, "offset": 0})
+    n_wanted = first.get("count", 0)
+    if limit:
+        n_wanted = min(n_wanted, limit)
+    remaining = limit
+
+    def truncate(page: list[tuple[int, float, float]]) -> list[tuple[int, float, float]]:
+        nonlocal remaining
+        if remaining is None:
+            return page
+        page = page[:remaining]
+        remaining -= len(page)
+        return page
+
+    count("occurrence_pages")
+    yield truncate(_page_records(first))
+
+    offsets = range(PAGE_SIZE, n_wanted, PAGE_SIZE)
+    if not offsets:
+        return
+
+    def fetch_page(offset: int) -> list[tuple[int, float, float]]:
+        return _page_records(_get_json(url, {**params, "offset": offset}))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        for page in pool.map(fetch_page, offsets):
+            count("occurrence_pages")
+            yield truncate(page)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_species_counts(
+    bbox: tuple[float, float, float, float],
+    taxon_key: int = 6,
+    page_size: int = 1000,
+) -> dict[int, int]:
+    """
+    Count georeferenced occurrences per species inside a bounding box.
+
+    Uses the occurrence search speciesKey facet, so the whole region is
+    summarised in a handful of requests rather than one per species.
+
+    Args:
+        bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
+        taxon_key: Higher taxon to restrict to (default 6 = Plantae)
+        page_size: Number of facet values per request
+
+    Returns:
+        Mapping of species key to occurrence count in the bbox
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    counts: dict[int, int] = {}
     offset = 0
-    batch_size = 300
 
     while True:
-        resp = requests.get(
-            "https://api.gbif.org/v1/occurrence/search",
+        data = _get_json(
+            f"{GBIF_API_URL}/occurrence/search",
             params={
                 "taxonKey": taxon_key,
                 "hasCoordinate": "true",
                 "hasGeospatialIssue": "false",
                 "decimalLatitude": f"{min_lat},{max_lat}",
                 "decimalLongitude": f"{min_lon},{max_lon}",
-                "limit": batch_size,
-                "offset": offset,
+                "limit": 0,
+                "facet": "speciesKey",
+                "facetLimit": page_size,
+                "facetOffset": offset,
             }
         )
-        resp.raise_for_status()
-        data = resp.json()
-        batch = data.get("results", [])
-
-        if not batch:
-            break
+        facets = data.get("facets", [])
+        values = facets[0].get("counts", []) if facets else []
 
-        for r in batch:
-            if r.get("decimalLatitude") and r.get("decimalLongitude"):
-                results.append((r["decimalLongitude"], r["decimalLatitude"]))
+        for value in values:
+            counts[int(value["name"])] = int(value["count"])
 
-        if limit and len(results) >= limit:
-            results = results[:limit]
+        if len(values) < page_size:
             break
 
-        if len(results) >= data.get("count", 0):
-            break
-
-        offset += batch_size
+        offset += page_size
 
-    return results
+    return counts
@@ -0,0 +1,167 @@
+"""
+Coarse-to-fine scoring of a mosaic.
+
+Most of a region is clearly unsuitable for a species, so scoring every
+pixel at full resolution is mostly wasted work. Here the mosaic is first
+mean-pooled into blocks and the pooled embeddings are scored; only blocks
+whose coarse score comes within a safety margin of the candidate threshold
+are scored pixel by pixel. Skipped blocks keep their coarse score, which is
+below the threshold, so they never produce candidates.
+
+Pooling costs one pass over the mosaic, so the saving grows with the cost
+of the classifier: it is small for logistic regression (itself about one
+pass) and large for the MLP. Candidates lost to pooling depend on how
+smooth the embeddings are within a block; `check_recall` measures it.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Optional, Protocol
+
+import numpy as np
+
+from .embeddings import EmbeddingMosaic
+from .pyramid import pool_blocks
+
+logger = logging.getLogger(__name__)
+
+# Block edge in pixels, and how far below the threshold a coarse score
+# may be for the block to still be refined
+DEFAULT_BLOCK_SIZE = 4
+DEFAULT_MARGIN = 0.3
+
+# Pixels gathered per refinement batch
+REFINE_BATCH = 262_144
+
+
+class Scorer(Protocol):
+    def predict(self, all_embeddings: np.ndarray) -> np.ndarray: ...
+
+
+@dataclass
+class HierarchicalStats:
+    """What the coarse pass saved, and (optionally) what it cost."""
+
+    block_size: int
+    margin: float
+    threshold: float
+    n_blocks: int
+    n_refined_blocks: int
+    n_pixels: int
+    n_refined_pixels: int
+    recall: Optional[float] = None  # vs exhaustive scoring, if checked
+    n_exhaustive_candidates: Optional[int] = None
+
+    @property
+    def skipped_fraction(self) -> float:
+        return 1.0 - self.n_refined_pixels / self.n_pixels if self.n_pixels else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "block_size": self.block_size,
+            "margin": self.margin,
+            "threshold": self.threshold,
+            "n_blocks": self.n_blocks,
+            "n_refined_blocks": self.n_refined_blocks,
+            "n_pixels": self.n_pixels,
+            "n_refined_pixels": self.n_refined_pixels,
+            "skipped_fraction": self.skipped_fraction,
+            "recall": self.recall,
+            "n_exhaustive_candidates": self.n_exhaustive_candidates,
+        }
+
+
+def score_hierarchical(
+    classifier: Scorer,
+    mosaic: EmbeddingMosaic,
+    threshold: float = 0.5,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    margin: float = DEFAULT_MARGIN,
+    check_recall: bool = False,
+) -> tuple[np.ndarray, HierarchicalStats]:
+    """
+    Score a mosaic coarse-to-fine.
+
+    Args:
+        classifier: Fitted classifier with predict(embeddings) -> scores
+        mosaic: Embedding mosaic to score
+        threshold: Candidate threshold the refinement has to preserve
+        block_size: Block edge in pixels for the coarse pass
+        margin: Blocks with coarse score >= threshold - margin are refined
+        check_recall: Also score every pixel and report the fraction of
+            exhaustive candidates (score >= threshold) that were found;
+            costs a full scoring pass
+
+    Returns:
+        Tuple of (scores (H, W) float32, HierarchicalStats). Pixels in
+        refined blocks and empty pixels hold exact scores; the rest hold
+        their block's coarse score.
+    """
+    embeddings = mosaic.mosaic
+    h, w, c = embeddings.shape
+    b = block_size
+
+    # Coarse pass
+    pooled, counts, valid = pool_blocks(embeddings, b)
+    n_block_rows, n_block_cols = counts.shape
+    coarse = classifier.predict(pooled.reshape(-1, c)).reshape(n_block_rows, n_block_cols)
+    refine = coarse >= threshold - margin
+
+    # Empty pixels all share one score (that of the zero embedding), so they
+    # are exact everywhere and blocks without any data need no refinement
+    empty_score = float(classifier.predict(np.zeros((1, c), dtype=np.float32))[0])
+    refine &= counts > 0
+
+    scores = np.repeat(np.repeat(coarse, b, axis=0), b, axis=1)[:h, :w].astype(np.float32)
+    scores[~valid] = empty_score
+    del valid
+
+    # Fine pass over the selected blocks, batched across blocks
+    pending: list[tuple[int, int]] = []
+    pending_pixels = 0
+
+    def flush() -> None:
+        nonlocal pending, pending_pixels
+        if not pending:
+            return
+        batch = np.concatenate([
+            embeddings[i * b:(i + 1) * b, j * b:(j + 1) * b].reshape(-1, c)
+            for i, j in pending
+        ])
+        batch_scores = classifier.predict(batch)
+        offset = 0
+        for i, j in pending:
+            block = scores[i * b:(i + 1) * b, j * b:(j + 1) * b]
+            block[:] = batch_scores[offset:offset + block.size].reshape(block.shape)
+            offset += block.size
+        pending, pending_pixels = [], 0
+
+    n_refined_pixels = 0
+    for i, j in zip(*np.nonzero(refine)):
+        rows = min(b, h - i * b)
+        cols = min(b, w - j * b)
+        pending.append((i, j))
+        pending_pixels += rows * cols
+        n_refined_pixels += rows * cols
+        if pending_pixels >= REFINE_BATCH:
+            flush()
+    flush()
+
+    stats = HierarchicalStats(
+        block_size=b,
+        margin=margin,
+        threshold=threshold,
+        n_blocks=int(refine.size),
+        n_refined_blocks=int(refine.sum()),
+        n_pixels=h * w,
+        n_refined_pixels=n_refined_pixels,
+    )
+
+    if check_recall:
+        exhaustive = classifier.predict(mosaic.get_all_embeddings()).reshape(h, w)
+        expected = exhaustive >= threshold
+        found = expected & (scores >= threshold)
+        stats.n_exhaustive_candidates = int(expected.sum())
+        stats.recall = float(found.sum() / expected.sum()) if expected.any() else 1.0
+
+    return scores, stats
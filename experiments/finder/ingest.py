@@ -0,0 +1,559 @@
+"""
+Bulk ingest of GBIF download archives into a columnar occurrence store.
+
+GBIF downloads (Darwin Core Archive or simple CSV, zipped or not) are
+streamed in chunks and the usable records written as per-column numpy
+arrays, partitioned by taxon and 0.1° tile. Large taxa can then be read
+locally without paging the occurrence search API, which stops at 100,000
+records per query.
+
+A download only answers a query if it holds every record the occurrence
+search would return, so each ingested source records the extent it covers
+in full: the bbox of its coordinate filters, if its predicate filters on
+nothing else (a country or basis-of-record filter leaves records out of
+any bbox). Sources without a covered extent are stored but never queried.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import sys
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Partition tile size in degrees
+TILE_SIZE = 0.1
+
+# Rows parsed per chunk, and rows buffered before partitions are flushed
+CHUNK_ROWS = 500_000
+FLUSH_ROWS = 5_000_000
+
+MANIFEST_NAME = "manifest.json"
+
+# Download request saved next to a download (by the downloader), read for
+# its predicate when none is given
+REQUEST_SUFFIX = ".request.json"
+
+Rect = tuple[float, float, float, float]
+WORLD: Rect = (-180.0, -90.0, 180.0, 90.0)
+
+# Predicate terms that match the filters of the occurrence search queries,
+# or only select taxa (which are stored separately anyway)
+QUERY_FILTER_TERMS = {("HAS_COORDINATE", True), ("HAS_GEOSPATIAL_ISSUE", False)}
+TAXON_PREDICATE_KEYS = frozenset({
+    "TAXON_KEY", "KINGDOM_KEY", "PHYLUM_KEY", "CLASS_KEY", "ORDER_KEY",
+    "FAMILY_KEY", "GENUS_KEY", "SPECIES_KEY",
+})
+
+# Issues that GBIF counts towards hasGeospatialIssue
+GEOSPATIAL_ISSUES = frozenset({
+    "ZERO_COORDINATE",
+    "COORDINATE_OUT_OF_RANGE",
+    "COORDINATE_INVALID",
+    "COUNTRY_COORDINATE_MISMATCH",
+    "PRESUMED_SWAPPED_COORDINATE",
+    "PRESUMED_NEGATED_LATITUDE",
+    "PRESUMED_NEGATED_LONGITUDE",
+})
+
+
+def _parse_value(value) -> object:
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+def _polygon_rect(wkt: str) -> Optional[Rect]:
+    """Bounds of a WKT POLYGON if it is an axis-aligned rectangle."""
+    match = re.fullmatch(r"\s*POLYGON\s*\(\(([^()]*)\)\)\s*", wkt, re.IGNORECASE)
+    if match is None:
+        return None
+    points = {tuple(float(v) for v in pair.split()) for pair in match.group(1).split(",")}
+    lons = sorted({p[0] for p in points})
+    lats = sorted({p[1] for p in points})
+    if len(lons) != 2 or len(lats) != 2 or len(points) != 4:
+        return None
+    return (lons[0], lats[0], lons[1], lats[1])
+
+
+def predicate_extent(predicate: dict) -> Optional[Rect]:
+    """
+    Extent in which a download predicate keeps every searchable record.
+
+    Understands conjunctions of the occurrence search filters, taxon
+    filters, DECIMAL_LONGITUDE / DECIMAL_LATITUDE bounds and rectangular
+    `within` geometries. Any other term (COUNTRY, BASIS_OF_RECORD, YEAR,
+    ...) drops records the search API would return, so the download
+    covers no extent completely.
+
+    Returns:
+        (min_lon, min_lat, max_lon, max_lat), or None if the download is
+        restricted by other terms
+    """
+    terms = predicate.get("predicates", []) if predicate.get("type") == "and" else [predicate]
+    min_lon, min_lat, max_lon, max_lat = WORLD
+    for term in terms:
+        kind, key = term.get("type"), term.get("key")
+        if kind == "equals" and (key, _parse_value(term.get("value"))) in QUERY_FILTER_TERMS:
+            continue
+        if kind in ("equals", "in") and key in TAXON_PREDICATE_KEYS:
+            continue
+        if kind == "within":
+            rect = _polygon_rect(term.get("geometry", ""))
+            if rect is None:
+                return None
+            min_lon, min_lat = max(min_lon, rect[0]), max(min_lat, rect[1])
+            max_lon, max_lat = min(max_lon, rect[2]), min(max_lat, rect[3])
+            continue
+        if key in ("DECIMAL_LONGITUDE", "DECIMAL_LATITUDE") and kind in (
+            "greaterThan", "greaterThanOrEquals", "lessThan", "lessThanOrEquals"
+        ):
+            # Strict bounds still cover everything strictly inside them
+            value = float(term["value"])
+            if key == "DECIMAL_LONGITUDE":
+                if kind.startswith("greater"):
+                    min_lon = max(min_lon, value)
+                else:
+                    max_lon = min(max_lon, value)
+            elif kind.startswith("greater"):
+                min_lat = max(min_lat, value)
+            else:
+                max_lat = min(max_lat, value)
+            continue
+        return None
+    if min_lon >= max_lon or min_lat >= max_lat:
+        return None
+    return (min_lon, min_lat, max_lon, max_lat)
+
+
+def _contains(outer: Rect, inner: Rect) -> bool:
+    return (
+        outer[0] <= inner[0] and outer[1] <= inner[1]
+        and outer[2] >= inner[2] and outer[3] >= inner[3]
+    )
+
+
+def _tile_index(lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return (
+        np.floor(lon / TILE_SIZE).astype(np.int32),
+        np.floor(lat / TILE_SIZE).astype(np.int32),
+    )
+
+
+class OccurrenceArchive:
+    """
+    Partitioned columnar store of ingested occurrence records.
+
+    Layout::
+
+        {root}/manifest.json
+        {root}/{taxon_key}/tile_{ix}_{iy}/part-{id}.npz   (gbif_key, lon, lat)
+
+    where (ix, iy) is the 0.1° tile index floor(lon / 0.1), floor(lat / 0.1).
+    Records are deduplicated by GBIF key when read, so re-ingesting an
+    overlapping download is harmless.
+
+    The manifest records, per source, its predicate, the extent it covers
+    in full (or None), its snapshot time and the taxa it holds; queries
+    should go through `covering_source` first.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._manifest: Optional[dict] = None
+        self._manifest_mtime: Optional[int] = None
+
+    def manifest(self) -> dict:
+        """Read the manifest of ingested sources and per-taxon record counts (before deduplication)."""
+        path = self.root / MANIFEST_NAME
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {"sources": {}, "taxa": {}}
+        if self._manifest is None or mtime != self._manifest_mtime:
+            with open(path) as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def taxa(self) -> set[int]:
+        """Taxon keys with ingested records."""
+        return {int(key) for key in self.manifest()["taxa"]}
+
+    def has_taxon(self, taxon_key: int) -> bool:
+        return (self.root / str(int(taxon_key))).is_dir()
+
+    def covering_source(
+        self,
+        taxon_key: int,
+        bbox: Rect,
+        max_age_days: Optional[float] = None,
+    ) -> Optional[dict]:
+        """
+        The newest ingested download that can answer a query in full.
+
+        Args:
+            taxon_key: GBIF taxon key
+            bbox: Query bbox (min_lon, min_lat, max_lon, max_lat)
+            max_age_days: Ignore downloads whose snapshot is older than this
+
+        Returns:
+            The source's manifest entry, or None if no download holding
+            the taxon covers the whole bbox (the query must go to the API)
+        """
+        now = datetime.now(timezone.utc)
+        best = None
+        for source in self.manifest()["sources"].values():
+            extent = source.get("extent")
+            if extent is None or int(taxon_key) not in source.get("taxon_keys", ()):
+                continue
+            if not _contains(tuple(extent), tuple(float(v) for v in bbox)):
+                continue
+            snapshot = datetime.fromisoformat(source["snapshot"])
+            if max_age_days is not None and (now - snapshot).total_seconds() / 86400 > max_age_days:
+                continue
+            if best is None or source["snapshot"] > best["snapshot"]:
+                best = source
+        return best
+
+    def partition_dir(self, taxon_key: int, ix: int, iy: int) -> Path:
+        return self.root / str(int(taxon_key)) / f"tile_{ix}_{iy}"
+
+    def query(
+        self,
+        taxon_key: int,
+        bbox: tuple[float, float, float, float],
+    ) -> list[tuple[float, float]]:
+        """
+        Records of a taxon inside a bbox.
+
+        Only the tile partitions overlapping the bbox are read.
+
+        Returns:
+            List of (longitude, latitude) tuples, ordered by GBIF key
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        keys, lons, lats = [], [], []
+        for ix in range(math.floor(min_lon / TILE_SIZE), math.floor(max_lon / TILE_SIZE) + 1):
+            for iy in range(math.floor(min_lat / TILE_SIZE), math.floor(max_lat / TILE_SIZE) + 1):
+                for part in sorted(self.partition_dir(taxon_key, ix, iy).glob("part-*.npz")):
+                    with np.load(part) as data:
+                        keys.append(data["gbif_key"])
+                        lons.append(data["lon"])
+                        lats.append(data["lat"])
+
+        if not keys:
+            return []
+
+        key = np.concatenate(keys)
+        lon = np.concatenate(lons)
+        lat = np.concatenate(lats)
+        inside = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+        key, lon, lat = key[inside], lon[inside], lat[inside]
+        _, first = np.unique(key, return_index=True)
+        return [(float(lon[i]), float(lat[i])) for i in first]
+
+    def write_partition(
+        self,
+        taxon_key: int,
+        ix: int,
+        iy: int,
+        part_id: str,
+        gbif_key: np.ndarray,
+        lon: np.ndarray,
+        lat: np.ndarray,
+    ) -> None:
+        """Atomically write one part file of a partition."""
+        directory = self.partition_dir(taxon_key, ix, iy)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / f"part-{part_id}.tmp.npz"
+        np.savez(tmp_path, gbif_key=gbif_key, lon=lon, lat=lat)
+        os.replace(tmp_path, directory / f"part-{part_id}.npz")
+
+    def compact(self, taxon_key: int, ix: int, iy: int) -> None:
+        """Merge a partition's part files into one, dropping duplicate records."""
+        directory = self.partition_dir(taxon_key, ix, iy)
+        parts = sorted(directory.glob("part-*.npz"))
+        if len(parts) <= 1:
+            return
+
+        columns = defaultdict(list)
+        for part in parts:
+            with np.load(part) as data:
+                for name in ("gbif_key", "lon", "lat"):
+                    columns[name].append(data[name])
+        key = np.concatenate(columns["gbif_key"])
+        _, first = np.unique(key, return_index=True)
+
+        self.write_partition(
+            taxon_key, ix, iy, "compact",
+            key[first],
+            np.concatenate(columns["lon"])[first],
+            np.concatenate(columns["lat"])[first],
+        )
+        for part in parts:
+            if part.name != "part-compact.npz":
+                part.unlink()
+
+
+@contextmanager
+def _open_records(path: Path) -> Iterator[io.TextIOBase]:
+    """Open the occurrence table of a download (zip or plain file) as text."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            if "occurrence.txt" in names:
+                member = "occurrence.txt"  # Darwin Core Archive
+            else:
+                tables = [n for n in names if n.endswith((".csv", ".txt"))]
+                if not tables:
+                    raise ValueError(f"No occurrence table found in {path}")
+                member = max(tables, key=lambda n: archive.getinfo(n).file_size)
+            with archive.open(member) as raw:
+                yield io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            yield f
+
+
+def iter_record_chunks(
+    path: Path,
+    taxon_column: str = "speciesKey",
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]]:
+    """
+    Stream usable records from a GBIF download in chunks.
+
+    Applies the same filtering as the occurrence search queries: records
+    need a taxon key and coordinates, and no geospatial issue (read from
+    hasGeospatialIssues when present, otherwise from the issue column).
+
+    Yields:
+        (taxon_key, gbif_key, lon, lat, rows_read) per chunk, where
+        rows_read counts every row parsed, including rejected ones
+    """
+    csv.field_size_limit(sys.maxsize)
+
+    with _open_records(path) as f:
+        header = f.readline().rstrip("\r\n")
+        delimiter = "\t" if "\t" in header else ","
+        columns = header.split(delimiter)
+        index = {name: i for i, name in enumerate(columns)}
+        for required in ("gbifID", taxon_column, "decimalLatitude", "decimalLongitude"):
+            if required not in index:
+                raise ValueError(f"{path} has no {required} column")
+
+        i_key, i_taxon = index["gbifID"], index[taxon_column]
+        i_lat, i_lon = index["decimalLatitude"], index["decimalLongitude"]
+        i_flag = index.get("hasGeospatialIssues")
+        i_issue = index.get("issue")
+
+        # GBIF's tab-separated tables are unquoted; plain CSV exports may quote
+        quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+        reader = csv.reader(f, delimiter=delimiter, quoting=quoting)
+        taxa, keys, lons, lats = [], [], [], []
+        rows_read = 0
+
+        for row in reader:
+            rows_read += 1
+            try:
+                taxon = row[i_taxon]
+                lat, lon = row[i_lat], row[i_lon]
+                if taxon and lat and lon:
+                    if i_flag is not None:
+                        has_issue = row[i_flag].lower() == "true"
+                    else:
+                        has_issue = i_issue is not None and not GEOSPATIAL_ISSUES.isdisjoint(
+                            row[i_issue].split(";")
+                        )
+                    if not has_issue:
+                        taxa.append(int(taxon))
+                        keys.append(int(row[i_key]))
+                        lats.append(float(lat))
+                        lons.append(float(lon))
+            except (IndexError, ValueError):
+                pass  # malformed row
+
+            if rows_read % chunk_rows == 0:
+                yield _chunk_arrays(taxa, keys, lons, lats) + (rows_read,)
+                taxa, keys, lons, lats = [], [], [], []
+                rows_read = 0
+
+        if rows_read:
+            yield _chunk_arrays(taxa, keys, lons, lats) + (rows_read,)
+
+
+def _chunk_arrays(taxa, keys, lons, lats) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    return (
+        np.asarray(taxa, dtype=np.int64),
+        np.asarray(keys, dtype=np.int64),
+        np.asarray(lons, dtype=np.float64),
+        np.asarray(lats, dtype=np.float64),
+    )
+
+
+def ingest_archive(
+    path: Path,
+    store: OccurrenceArchive,
+    taxon_column: str = "speciesKey",
+    chunk_rows: int = CHUNK_ROWS,
+    flush_rows: int = FLUSH_ROWS,
+    predicate: Optional[dict] = None,
+    extent: Optional[Rect] = None,
+) -> dict:
+    """
+    Stream a GBIF download into the store.
+
+    Chunks are grouped by (taxon, tile) and buffered; once `flush_rows`
+    records are buffered every partition is written as a new part file.
+    Touched partitions are compacted at the end. Re-ingesting the same
+    file rewrites the same parts rather than adding duplicates.
+
+    The download's predicate (given, or read from a `.request.json` saved
+    next to it) determines the extent it covers in full. Without either,
+    the records are stored but the archive will not answer queries from
+    them.
+
+    Args:
+        path: Download file (.zip DwC-A / simple CSV, or an extracted table)
+        store: Destination store
+        taxon_column: Column to partition by (speciesKey groups subspecies
+            records under their species, matching taxonKey API queries)
+        chunk_rows: Rows parsed per chunk
+        flush_rows: Buffered records that trigger a flush
+        predicate: The download's GBIF predicate
+        extent: Covered extent (min_lon, min_lat, max_lon, max_lat),
+            overriding the one derived from the predicate
+
+    Returns:
+        Ingest statistics (rows read, records kept, taxa, partitions,
+        predicate, covered extent, snapshot time)
+    """
+    path = Path(path)
+    stat = path.stat()
+    source_id = hashlib.sha256(
+        f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()[:12]
+
+    request = _read_request(path)
+    if predicate is None and request is not None:
+        predicate = request.get("predicate", request)
+    if extent is None and predicate is not None:
+        extent = predicate_extent(predicate)
+    if extent is None:
+        logger.warning(
+            f"{path.name}: no covered extent (predicate "
+            f"{'restricted beyond taxon and coordinates' if predicate else 'unknown'}); "
+            f"its records will not be used to answer queries"
+        )
+    # The download's creation time if recorded, else when the file was written
+    snapshot = (request or {}).get("created") or datetime.fromtimestamp(
+        stat.st_mtime, timezone.utc
+    ).isoformat()
+
+    buffers: dict[tuple[int, int, int], list[tuple[np.ndarray, ...]]] = defaultdict(list)
+    buffered = 0
+    n_flushes = 0
+    touched: set[tuple[int, int, int]] = set()
+    taxon_counts: dict[int, int] = defaultdict(int)
+    rows_read = kept = 0
+
+    def flush() -> None:
+        nonlocal buffered, n_flushes
+        for (taxon, ix, iy), pieces in buffers.items():
+            keys, lons, lats = (np.concatenate(column) for column in zip(*pieces))
+            store.write_partition(taxon, ix, iy, f"{source_id}-{n_flushes:04d}", keys, lons, lats)
+            touched.add((taxon, ix, iy))
+        buffers.clear()
+        buffered = 0
+        n_flushes += 1
+
+    for taxa, keys, lons, lats, n_rows in iter_record_chunks(path, taxon_column, chunk_rows):
+        rows_read += n_rows
+        kept += len(taxa)
+        if len(taxa):
+            ix, iy = _tile_index(lons, lats)
+            order = np.lexsort((iy, ix, taxa))
+            taxa, keys, lons, lats, ix, iy = (a[order] for a in (taxa, keys, lons, lats, ix, iy))
+            starts = np.flatnonzero(
+                np.r_[True, (taxa[1:] != taxa[:-1]) | (ix[1:] != ix[:-1]) | (iy[1:] != iy[:-1])]
+            )
+            for start, end in zip(starts, np.r_[starts[1:], len(taxa)]):
+                partition = (int(taxa[start]), int(ix[start]), int(iy[start]))
+                buffers[partition].append((keys[start:end], lons[start:end], lats[start:end]))
+                taxon_counts[partition[0]] += end - start
+            buffered += len(taxa)
+
+        logger.info(f"  {rows_read:,} rows read, {kept:,} kept")
+        if buffered >= flush_rows:
+            flush()
+
+    if buffers:
+        flush()
+
+    # Merge flushes (and earlier ingests) into one part per partition
+    for partition in touched:
+        store.compact(*partition)
+
+    stats = {
+        "path": str(path),
+        "rows_read": rows_read,
+        "records_kept": kept,
+        "taxa": len(taxon_counts),
+        "partitions": len(touched),
+        "ingested": datetime.now(timezone.utc).isoformat(),
+        "snapshot": _iso_utc(snapshot),
+        "predicate": predicate,
+        "extent": list(extent) if extent is not None else None,
+    }
+    _update_manifest(store, source_id, stats, taxon_counts)
+    return stats
+
+
+def _read_request(path: Path) -> Optional[dict]:
+    """The download request saved next to a download, if any."""
+    request_path = path.with_name(path.name.split(".")[0] + REQUEST_SUFFIX)
+    if not request_path.exists():
+        return None
+    with open(request_path) as f:
+        return json.load(f)
+
+
+def _iso_utc(timestamp: str) -> str:
+    # GBIF writes e.g. "2026-10-18T09:30:00.000+00:00"; naive times are UTC
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.isoformat()
+
+
+def _update_manifest(
+    store: OccurrenceArchive,
+    source_id: str,
+    stats: dict,
+    taxon_counts: dict[int, int],
+) -> None:
+    manifest = store.manifest()
+    already_ingested = source_id in manifest["sources"]
+    manifest["sources"][source_id] = {**stats, "taxon_keys": sorted(int(t) for t in taxon_counts)}
+    for taxon, n in ([] if already_ingested else taxon_counts.items()):
+        manifest["taxa"][str(taxon)] = manifest["taxa"].get(str(taxon), 0) + int(n)
+
+    store.root.mkdir(parents=True, exist_ok=True)
+    tmp_path = store.root / f"{MANIFEST_NAME}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, store.root / MANIFEST_NAME)
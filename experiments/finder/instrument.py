@@ -0,0 +1,315 @@
+"""
+Lightweight timing and memory instrumentation of pipeline stages.
+
+Code marks its stages with `span` (or the `traced` decorator) and reports
+work done with `count`:
+
+    with span("score"):
+        count("pixels", len(embeddings))
+        ...
+
+Nothing is recorded unless a trace is active, and then only in the
+process that started it:
+
+    with tracing(output_dir / "trace.json"):
+        find_candidates(...)
+
+Each span records its wall time, resident memory at start and end, the
+process's peak RSS, and its counts with per-second rates. Counts add up
+in every open span of the thread, so a stage's throughput includes the
+work of its sub-spans. With `allocations=True`, tracemalloc also gives
+each span its net and peak traced allocations (Python and numpy memory,
+over all threads), at a noticeable slowdown of allocation-heavy code.
+
+When no trace is active, `span` returns a shared no-op context manager
+and `count` returns at once, so instrumented code costs one global lookup
+per call.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Protocol, TypeVar
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILENAME = "trace.json"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+F = TypeVar("F", bound=Callable)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """Current resident set size of this process in MB, where /proc is available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _mb(n_bytes: Optional[float]) -> Optional[float]:
+    return round(n_bytes / (1024 * 1024), 3) if n_bytes is not None else None
+
+
+def _mb_round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+class _Span:
+    """An open span of a trace; becomes a record in Trace.spans on exit."""
+
+    def __init__(self, trace: "Trace", name: str, counts: dict[str, float]):
+        self.trace = trace
+        self.name = name
+        self.counts: dict[str, float] = defaultdict(float, counts)
+
+    def __enter__(self) -> "_Span":
+        trace = self.trace
+        stack = trace._stack()
+        self.path = f"{stack[-1].path}/{self.name}" if stack else self.name
+        self.depth = len(stack)
+        if self.counts:
+            trace._add_counts(stack, self.counts)
+        if trace.allocations:
+            trace._fold_alloc_peak(stack)
+            self.alloc_start = tracemalloc.get_traced_memory()[0]
+            self.alloc_peak = self.alloc_start
+        for listener in trace.listeners:
+            listener.span_entered(self)
+        self.rss_start = current_rss_mb()
+        self.start = time.perf_counter()
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        seconds = time.perf_counter() - self.start
+        trace = self.trace
+        stack = trace._stack()
+        record = {
+            "name": self.name,
+            "path": self.path,
+            "depth": self.depth,
+            "start_s": round(self.start - trace.start, 6),
+            "seconds": round(seconds, 6),
+            "rss_start_mb": _mb_round(self.rss_start),
+            "rss_end_mb": _mb_round(current_rss_mb()),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        if trace.allocations:
+            trace._fold_alloc_peak(stack)
+            current = tracemalloc.get_traced_memory()[0]
+            record["alloc_delta_mb"] = _mb(current - self.alloc_start)
+            record["alloc_peak_mb"] = _mb(self.alloc_peak - self.alloc_start)
+        if self.counts:
+            record["counts"] = dict(self.counts)
+            if seconds > 0:
+                record["per_second"] = {k: v / seconds for k, v in self.counts.items()}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        stack.pop()
+        for listener in trace.listeners:
+            listener.span_exited(self, record)
+        with trace._lock:
+            trace.spans.append(record)
+
+
+class SpanListener(Protocol):
+    """Called around every span of a trace (e.g. by finder.profiling)."""
+
+    def span_entered(self, span: "_Span") -> None: ...
+
+    def span_exited(self, span: "_Span", record: dict) -> None: ...
+
+
+class Trace:
+    """Spans, counters and metadata of one traced run."""
+
+    def __init__(self, name: str = "", allocations: bool = False, **metadata):
+        self.name = name
+        self.allocations = allocations
+        self.metadata = dict(metadata)
+        self.spans: list[dict] = []
+        self.counters: dict[str, float] = defaultdict(float)
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.listeners: list[SpanListener] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list[_Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add_counts(self, stack: list[_Span], counts: dict[str, float]) -> None:
+        for open_span in stack:
+            for key, value in counts.items():
+                open_span.counts[key] += value
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] += value
+
+    def _fold_alloc_peak(self, stack: list[_Span]) -> None:
+        # tracemalloc keeps a single peak, so it is folded into every open
+        # span (and reset) at each span boundary
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_span in stack:
+            open_span.alloc_peak = max(open_span.alloc_peak, peak)
+        tracemalloc.reset_peak()
+
+    def to_dict(self) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_s"])
+            counters = dict(self.counters)
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": round(end - self.start, 6),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "allocations": self.allocations,
+            "pid": os.getpid(),
+            "metadata": self.metadata,
+            "counters": counters,
+            "spans": spans,
+        }
+
+    def summary(self, max_depth: int = 1) -> str:
+        """One line per span up to max_depth, for logs."""
+        lines = []
+        for s in self.to_dict()["spans"]:
+            if s["depth"] > max_depth:
+                continue
+            line = f"{'  ' * s['depth']}{s['name']}: {s['seconds']:.2f}s, peak RSS {s['peak_rss_mb']:,.0f} MB"
+            for key, rate in s.get("per_second", {}).items():
+                line += f", {rate:,.0f} {key}/s"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def save(self, path: Path) -> Path:
+        """Write the trace as JSON (atomically)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        os.replace(tmp_path, path)
+        return path
+
+
+_active: Optional[Trace] = None
+_NO_SPAN = contextlib.nullcontext()
+
+
+def active_trace() -> Optional[Trace]:
+    """The trace being recorded, if any."""
+    return _active
+
+
+def span(name: str, **counts: float):
+    """
+    Context manager timing a stage of the active trace (no-op without one).
+
+    Args:
+        name: Stage name; nested spans are recorded with their path
+        **counts: Work done in the stage, known up front (as for `count`)
+    """
+    trace = _active
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, counts)
+
+
+def count(name: str, n: float = 1) -> None:
+    """Add to a counter of the active trace and of this thread's open spans."""
+    trace = _active
+    if trace is None:
+        return
+    trace._add_counts(trace._stack(), {name: n})
+
+
+def annotate(**values) -> None:
+    """Add values to the active trace's metadata."""
+    trace = _active
+    if trace is not None:
+        trace.metadata.update(values)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorator running a function in a span of the active trace."""
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return fn(*args, **kwargs)
+            with _Span(_active, name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+@contextlib.contextmanager
+def tracing(
+    path: Optional[Path] = None,
+    name: str = "",
+    allocations: bool = False,
+    enabled: bool = True,
+    **metadata,
+) -> Iterator[Optional[Trace]]:
+    """
+    Record a trace of everything run inside the block.
+
+    Args:
+        path: Where to write the JSON trace on exit (also on error)
+        name: Name of the traced run
+        allocations: Also trace allocations with tracemalloc (slower)
+        enabled: If False, record nothing and yield None
+        **metadata: Stored in the trace
+
+    Yields:
+        The Trace, or None if disabled
+    """
+    global _active
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace(name, allocations, **metadata)
+    previous = _active
+    started_tracemalloc = allocations and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    _active = trace
+    try:
+        with _Span(trace, name or "run", {}):
+            yield trace
+    finally:
+        _active = previous
+        trace.end = time.perf_counter()
+        if started_tracemalloc:
+            tracemalloc.stop()
+        if path is not None:
+            trace.save(path)
+            logger.info(f"Saved trace: {path}")
@@ -0,0 +1,120 @@
+"""
+Durable job ledger for long-running batch jobs.
+
+Backed by SQLite so progress survives crashes and a rerun can resume where
+the previous one stopped. Only the coordinating process writes to it.
+"""
+
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    expected_cost REAL NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL,
+    duration_s REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, expected_cost);
+"""
+
+
+class JobLedger:
+    """
+    Record of batch jobs, their state, failures and timings.
+
+    Each job moves pending -> running -> done/failed. Jobs left "running"
+    by a crashed run are returned to pending by `recover()`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def add_jobs(self, jobs: Iterable[tuple[str, float]]) -> int:
+        """
+        Register jobs as (job_id, expected_cost), ignoring ones already known.
+
+        Returns:
+            Number of newly added jobs
+        """
+        before = self._conn.total_changes
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO jobs (job_id, expected_cost) VALUES (?, ?)",
+            jobs,
+        )
+        self._conn.commit()
+        return self._conn.total_changes - before
+
+    def recover(self, retry_failed: bool = False) -> int:
+        """
+        Return interrupted (and optionally failed) jobs to pending.
+
+        Returns:
+            Number of jobs reset
+        """
+        states = (RUNNING, FAILED) if retry_failed else (RUNNING,)
+        placeholders = ",".join("?" * len(states))
+        cur = self._conn.execute(
+            f"UPDATE jobs SET state = ? WHERE state IN ({placeholders})",
+            (PENDING, *states),
+        )
+        self._conn.commit()
+        return cur.rowcount
+
+    def pending(self, descending: bool = True, limit: Optional[int] = None) -> list[tuple[str, float]]:
+        """Pending jobs as (job_id, expected_cost), ordered by expected cost."""
+        order = "DESC" if descending else "ASC"
+        sql = f"SELECT job_id, expected_cost FROM jobs WHERE state = ? ORDER BY expected_cost {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self._conn.execute(sql, (PENDING,)).fetchall()
+
+    def mark_running(self, job_id: str) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, started_at = ?, error = NULL "
+            "WHERE job_id = ?",
+            (RUNNING, time.time(), job_id),
+        )
+        self._conn.commit()
+
+    def mark_done(self, job_id: str, result: str, duration_s: float) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET state = ?, result = ?, finished_at = ?, duration_s = ? "
+            "WHERE job_id = ?",
+            (DONE, result, time.time(), duration_s, job_id),
+        )
+        self._conn.commit()
+
+    def mark_failed(self, job_id: str, error: str, duration_s: Optional[float] = None) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET state = ?, error = ?, finished_at = ?, duration_s = ? "
+            "WHERE job_id = ?",
+            (FAILED, error, time.time(), duration_s, job_id),
+        )
+        self._conn.commit()
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs in each state."""
+        rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: n for state, n in rows}
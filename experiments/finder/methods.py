@@ -20,6 +20,24 @@ import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, TensorDataset
 
+from .instrument import count, traced
+from .projection import EmbeddingProjection
+
+
+def _sample_weights(
+    positive_weights: Optional[np.ndarray],
+    n_positive: int,
+    n_negative: int,
+) -> Optional[np.ndarray]:
+    """Per-sample weights for stacked positives then negatives (None = unweighted)."""
+    if positive_weights is None:
+        return None
+    if len(positive_weights) != n_positive:
+        raise ValueError(
+            f"Got {len(positive_weights)} positive weights for {n_positive} positive samples"
+        )
+    return np.concatenate([np.asarray(positive_weights, dtype=np.float64), np.ones(n_negative)])
+
 
 class ClassifierMethod:
     """
@@ -30,14 +48,23 @@ class ClassifierMethod:
     approaches, especially with more training samples.
     """
 
-    def __init__(self):
+    def __init__(self, projection: Optional[EmbeddingProjection] = None):
+        """
+        Args:
+            projection: If provided, project embeddings to fewer dimensions
+                before scaling, both when fitting and when predicting
+        """
+        self.projection = projection
         self._model: Optional[LogisticRegression] = None
         self._scaler: Optional[StandardScaler] = None
 
+    @traced("logistic.fit")
     def fit(
         self,
         positive_embeddings: np.ndarray,
         negative_embeddings: np.ndarray,
+        scaler: Optional[StandardScaler] = None,
+        positive_weights: Optional[np.ndarray] = None,
     ) -> None:
         """
         Train classifier on positive vs negative embeddings.
@@ -45,6 +72,10 @@ class ClassifierMethod:
         Args:
             positive_embeddings: Embeddings at known occurrence locations
             negative_embeddings: Embeddings at random background locations
+            scaler: Already-fitted scaler to use instead of fitting one on
+                the training data (e.g. BackgroundBank.scaler())
+            positive_weights: Per-positive sample weights (e.g. occurrence
+                counts of deduplicated pixels); negatives get weight 1
         """
         if len(positive_embeddings) < 2:
             raise ValueError("Need at least 2 positive samples")
@@ -54,30 +85,43 @@ class ClassifierMethod:
         # Combine and create labels
         X = np.vstack([positive_embeddings, negative_embeddings])
         y = np.array([1] * len(positive_embeddings) + [0] * len(negative_embeddings))
+        count("training_samples", len(X))
+        weights = _sample_weights(positive_weights, len(positive_embeddings), len(negative_embeddings))
+        if self.projection is not None:
+            X = self.projection.transform(X)
 
         # Scale features
-        self._scaler = StandardScaler()
-        X_scaled = self._scaler.fit_transform(X)
+        if scaler is None:
+            self._scaler = StandardScaler()
+            X_scaled = self._scaler.fit_transform(X, sample_weight=weights)
+        else:
+            self._scaler = scaler
+            X_scaled = scaler.transform(X)
 
         # Train classifier
         self._model = LogisticRegression(max_iter=1000, solver="lbfgs")
-        self._model.fit(X_scaled, y)
+        self._model.fit(X_scaled, y, sample_weight=weights)
 
+    @traced("logistic.predict")
     def predict(
         self,
         all_embeddings: np.ndarray,
-        batch_size: int = 15000
+        batch_size: int = 15000,
+        progress: bool = True,
     ) -> np.ndarray:
         """Predict probability of positive class for all embeddings."""
         if self._model is None:
             raise ValueError("Must call fit() first")
 
         n_samples = len(all_embeddings)
+        count("pixels", n_samples)
         scores = np.zeros(n_samples, dtype=np.float32)
 
-        for i in tqdm(range(0, n_samples, batch_size), desc="Classifying"):
+        for i in tqdm(range(0, n_samples, batch_size), desc="Classifying", disable=not progress):
             end = min(i + batch_size, n_samples)
             batch = all_embeddings[i:end]
+            if self.projection is not None:
+                batch = self.projection.transform(batch)
 
             batch_scaled = self._scaler.transform(batch)
             probs = self._model.predict_proba(batch_scaled)
@@ -95,6 +139,7 @@ class ClassifierMethod:
             pickle.dump({
                 "model": self._model,
                 "scaler": self._scaler,
+                "projection": self.projection,
             }, f)
 
     @classmethod
@@ -104,7 +149,7 @@ class ClassifierMethod:
         with open(path, "rb") as f:
             data = pickle.load(f)
 
-        instance = cls()
+        instance = cls(projection=data.get("projection"))
         instance._model = data["model"]
         instance._scaler = data["scaler"]
         return instance
@@ -149,12 +194,14 @@ class MLPClassifierMethod:
         n_epochs: int = 100,
         batch_size: int = 64,
         device: Optional[str] = None,
+        projection: Optional[EmbeddingProjection] = None,
     ):
         self.hidden_dim = hidden_dim
         self.dropout_rate = dropout_rate
         self.learning_rate = learning_rate
         self.n_epochs = n_epochs
         self.batch_size = batch_size
+        self.projection = projection
 
         if device is None:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -163,13 +210,16 @@ class MLPClassifierMethod:
 
         self._model: Optional[MLPNetwork] = None
         self._scaler: Optional[StandardScaler] = None
-        self._input_dim: int = 768
+        self._input_dim: Optional[int] = None
 
+    @traced("mlp.fit")
     def fit(
         self,
         positive_embeddings: np.ndarray,
         negative_embeddings: np.ndarray,
         verbose: bool = True,
+        scaler: Optional[StandardScaler] = None,
+        positive_weights: Optional[np.ndarray] = None,
     ) -> None:
         """
         Train MLP classifier on positive vs negative embeddings.
@@ -178,6 +228,11 @@ class MLPClassifierMethod:
             positive_embeddings: Embeddings at known occurrence locations
             negative_embeddings: Embeddings at random background locations
             verbose: Whether to show training progress
+            scaler: Already-fitted scaler to use instead of fitting one on
+                the training data (e.g. BackgroundBank.scaler())
+            positive_weights: Per-positive sample weights (e.g. occurrence
+                counts of deduplicated pixels); negatives get weight 1.
+                The loss is the weighted mean over each batch.
         """
         if len(positive_embeddings) < 2:
             raise ValueError("Need at least 2 positive samples")
@@ -187,10 +242,18 @@ class MLPClassifierMethod:
         # Combine and create labels
         X = np.vstack([positive_embeddings, negative_embeddings])
         y = np.array([1.0] * len(positive_embeddings) + [0.0] * len(negative_embeddings))
+        count("training_samples", len(X))
+        weights = _sample_weights(positive_weights, len(positive_embeddings), len(negative_embeddings))
+        if self.projection is not None:
+            X = self.projection.transform(X)
 
         # Scale features
-        self._scaler = StandardScaler()
-        X_scaled = self._scaler.fit_transform(X)
+        if scaler is None:
+            self._scaler = StandardScaler()
+            X_scaled = self._scaler.fit_transform(X, sample_weight=weights)
+        else:
+            self._scaler = scaler
+            X_scaled = scaler.transform(X)
 
         # Store input dimension
         self._input_dim = X_scaled.shape[1]
@@ -198,9 +261,12 @@ class MLPClassifierMethod:
         # Convert to tensors
         X_tensor = torch.tensor(X_scaled, dtype=torch.float32)
         y_tensor = torch.tensor(y, dtype=torch.float32)
+        w_tensor = torch.tensor(
+            weights if weights is not None else np.ones(len(y)), dtype=torch.float32
+        )
 
         # Create data loader
-        dataset = TensorDataset(X_tensor, y_tensor)
+        dataset = TensorDataset(X_tensor, y_tensor, w_tensor)
         loader = DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
 
         # Initialize model
@@ -212,7 +278,7 @@ class MLPClassifierMethod:
 
         # Training setup
         optimizer = torch.optim.Adam(self._model.parameters(), lr=self.learning_rate)
-        criterion = nn.BCELoss()
+        criterion = nn.BCELoss(reduction="none")
 
         # Training loop
         self._model.train()
@@ -220,13 +286,14 @@ class MLPClassifierMethod:
 
         for epoch in iterator:
             epoch_loss = 0.0
-            for batch_X, batch_y in loader:
+            for batch_X, batch_y, batch_w in loader:
                 batch_X = batch_X.to(self.device)
                 batch_y = batch_y.to(self.device)
+                batch_w = batch_w.to(self.device)
 
                 optimizer.zero_grad()
                 outputs = self._model(batch_X)
-                loss = criterion(outputs, batch_y)
+                loss = (criterion(outputs, batch_y) * batch_w).sum() / batch_w.sum()
                 loss.backward()
                 optimizer.step()
 
@@ -244,6 +311,7 @@ class MLPClassifierMethod:
         scores, _ = self.predict_with_uncertainty(all_embeddings, batch_size, n_samples=1)
         return scores
 
+    @traced("mlp.predict")
     def predict_with_uncertainty(
         self,
         all_embeddings: np.ndarray,
@@ -266,20 +334,25 @@ class MLPClassifierMethod:
             raise ValueError("Must call fit() first")
 
         n_total = len(all_embeddings)
+        count("pixels", n_total)
+        count("forward_passes", n_total * n_samples)
         all_preds = np.zeros((n_samples, n_total), dtype=np.float32)
 
         # Keep model in training mode to enable dropout
         self._model.train()
 
         with torch.no_grad():
-            for sample_idx in range(n_samples):
-                for i in range(0, n_total, batch_size):
-                    end = min(i + batch_size, n_total)
-                    batch = all_embeddings[i:end]
+            for i in range(0, n_total, batch_size):
+                end = min(i + batch_size, n_total)
+                batch = all_embeddings[i:end]
+                if self.projection is not None:
+                    batch = self.projection.transform(batch)
 
-                    batch_scaled = self._scaler.transform(batch)
-                    batch_tensor = torch.tensor(batch_scaled, dtype=torch.float32).to(self.device)
+                # Project and scale each batch once, then run every MC pass on it
+                batch_scaled = self._scaler.transform(batch)
+                batch_tensor = torch.tensor(batch_scaled, dtype=torch.float32).to(self.device)
 
+                for sample_idx in range(n_samples):
                     preds = self._model(batch_tensor).cpu().numpy()
                     all_preds[sample_idx, i:end] = preds
 
@@ -301,6 +374,7 @@ class MLPClassifierMethod:
             "input_dim": self._input_dim,
             "hidden_dim": self.hidden_dim,
             "dropout_rate": self.dropout_rate,
+            "projection": self.projection,
         }, path)
 
     @classmethod
@@ -317,6 +391,7 @@ class MLPClassifierMethod:
             hidden_dim=data["hidden_dim"],
             dropout_rate=data["dropout_rate"],
             device=device,
+            projection=data.get("projection"),
         )
         instance._scaler = data["scaler"]
         instance._input_dim = data["input_dim"]
@@ -0,0 +1,159 @@
+"""
+Bulk resolution of species names against the GBIF backbone.
+"""
+
+import csv
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .cache import MatchCache, OfflineCacheMiss
+from .gbif import MAX_FETCH_WORKERS, match_name, normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Matches below this confidence are flagged
+MIN_CONFIDENCE = 90
+
+# Flags attached to matches that should not be trained on
+NOT_FOUND = "not_found"
+HIGHER_RANK = "higherrank"
+LOW_CONFIDENCE = "low_confidence"
+UNRESOLVED = "unresolved"
+
+
+@dataclass
+class NameMatch:
+    """Backbone match for one input name."""
+
+    name: str
+    normalized_name: str
+    taxon_key: Optional[int] = None
+    scientific_name: Optional[str] = None
+    canonical_name: Optional[str] = None
+    rank: Optional[str] = None
+    match_type: Optional[str] = None
+    confidence: int = 0
+    flags: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def usable(self) -> bool:
+        """True if the match has a taxon key and no flags."""
+        return self.taxon_key is not None and not self.flags
+
+
+def _match_from_response(
+    name: str,
+    normalized: str,
+    data: dict,
+    min_confidence: int,
+) -> NameMatch:
+    match = NameMatch(
+        name=name,
+        normalized_name=normalized,
+        taxon_key=data.get("usageKey"),
+        scientific_name=data.get("scientificName"),
+        canonical_name=data.get("canonicalName"),
+        rank=data.get("rank"),
+        match_type=data.get("matchType"),
+        confidence=int(data.get("confidence", 0)),
+    )
+    if match.taxon_key is None or match.match_type == "NONE":
+        match.flags.append(NOT_FOUND)
+    if match.match_type == "HIGHERRANK":
+        match.flags.append(HIGHER_RANK)
+    if match.confidence < min_confidence:
+        match.flags.append(LOW_CONFIDENCE)
+    return match
+
+
+def resolve_names(
+    names: Iterable[str],
+    match_cache: Optional[MatchCache] = None,
+    max_workers: int = MAX_FETCH_WORKERS,
+    min_confidence: int = MIN_CONFIDENCE,
+) -> list[NameMatch]:
+    """
+    Resolve many species names at once.
+
+    Names are normalized and deduplicated, looked up in the match cache,
+    and the misses are matched concurrently (then added to the cache).
+    Lookup failures do not abort the batch; they come back flagged
+    "unresolved" with the error message.
+
+    Args:
+        names: Scientific names, possibly with duplicates
+        match_cache: Persistent name -> match memo
+        max_workers: Maximum number of concurrent match requests
+        min_confidence: Matches below this confidence are flagged
+            "low_confidence"
+
+    Returns:
+        One NameMatch per input name, in input order
+    """
+    names = list(names)
+    normalized = [normalize_name(name) for name in names]
+    unique = [name for name in dict.fromkeys(normalized) if name]
+
+    responses: dict[str, dict] = {}
+    errors: dict[str, str] = {}
+    misses = []
+    for name in unique:
+        try:
+            cached = match_cache.get(name) if match_cache is not None else None
+        except OfflineCacheMiss as e:
+            errors[name] = str(e)
+            continue
+        if cached is not None:
+            responses[name] = cached
+        else:
+            misses.append(name)
+
+    logger.info(
+        f"Resolving {len(names)} names ({len(unique)} unique, "
+        f"{len(responses)} cached, {len(misses)} to match)"
+    )
+
+    def fetch(name: str) -> tuple[str, Optional[dict], Optional[str]]:
+        try:
+            return name, match_name(name), None
+        except Exception as e:
+            return name, None, f"{type(e).__name__}: {e}"
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            for name, data, error in pool.map(fetch, misses):
+                if data is None:
+                    errors[name] = error
+                    continue
+                responses[name] = data
+                if match_cache is not None:
+                    match_cache.put(name, data)
+
+    matches = []
+    for name, norm in zip(names, normalized):
+        if norm in responses:
+            matches.append(_match_from_response(name, norm, responses[norm], min_confidence))
+        else:
+            matches.append(NameMatch(
+                name=name,
+                normalized_name=norm,
+                flags=[UNRESOLVED],
+                error=errors.get(norm, "empty name"),
+            ))
+    return matches
+
+
+def write_matches_csv(matches: list[NameMatch], path: Path) -> None:
+    """Write resolved names as a CSV table (flags joined with ';')."""
+    columns = list(NameMatch.__dataclass_fields__)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for match in matches:
+            row = asdict(match)
+            row["flags"] = ";".join(match.flags)
+            writer.writerow(row)
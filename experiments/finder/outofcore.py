@@ -0,0 +1,622 @@
+"""
+Out-of-core candidate search for regions too large to hold in memory.
+
+find_candidates stitches the whole region into one mosaic and scores it in
+one go. Here the region's tiles are streamed instead, in bands of rows sized
+to a memory budget, so memory use does not grow with the region:
+
+1. Occurrences are matched to pixels band by band, and background pixels
+   are drawn in the same pass with a reservoir (a uniform sample without
+   replacement of the region's valid, non-occurrence pixels).
+2. The classifier is trained on the two samples.
+3. The region is scored band by band into a tiled GeoTIFF, and candidates
+   are reservoir-sampled as they are found.
+
+The output grid, files and metadata match find_candidates on the same bbox.
+"""
+
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from .cache import MatchCache, OccurrenceCache
+from .gbif import fetch_occurrences, get_species_info
+from .ingest import OccurrenceArchive
+from .instrument import peak_rss_mb, traced
+from .methods import ClassifierMethod
+from .pipeline import (
+    CANDIDATE_THRESHOLD,
+    NEGATIVE_RATIO,
+    candidate_features,
+    save_occurrences,
+)
+from .tiles import TILE_SIZE, TileCatalog, TileIndex, fit_tile, get_catalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_LIMIT_MB = 2048
+
+# Share of the memory limit for one band of float32 embeddings (and its
+# dequantization temporary); the rest covers the interpreter, the
+# classifier, the samples and the GeoTIFF block cache
+BAND_MEMORY_FRACTION = 0.25
+GDAL_CACHE_FRACTION = 0.1
+
+# GeoTIFF block edge in pixels
+RASTER_BLOCK_SIZE = 256
+
+# Candidates kept for candidates.geojson, as in PredictionResult.to_geojson
+MAX_CANDIDATE_POINTS = 5000
+
+
+class Reservoir:
+    """
+    Uniform sample without replacement from a stream of unknown length.
+
+    Every offered item gets a uniform random key and the `size` items with
+    the smallest keys are kept (bottom-k sampling). Only items whose key
+    beats the current cut-off are gathered, so after the reservoir fills
+    each band costs little more than drawing its keys.
+    """
+
+    def __init__(self, size: int, seed: int = 42):
+        self.size = size
+        self.n_seen = 0
+        self._rng = np.random.default_rng(seed)
+        self._cutoff = 1.0
+        self._keys: list[np.ndarray] = []
+        self._columns: list[tuple[np.ndarray, ...]] = []
+        self._n_pending = 0
+
+    def offer(self, n: int, gather: Callable[[np.ndarray], tuple[np.ndarray, ...]]) -> None:
+        """
+        Offer n stream items.
+
+        Args:
+            n: Number of items offered
+            gather: Called with the positions (0..n-1) of the admitted items;
+                returns their columns (arrays with one row per position)
+        """
+        self.n_seen += n
+        if n == 0 or self.size == 0:
+            return
+        keys = self._rng.random(n)
+        admitted = np.flatnonzero(keys < self._cutoff)
+        if len(admitted) > self.size:
+            admitted = admitted[np.argpartition(keys[admitted], self.size - 1)[:self.size]]
+        if len(admitted) == 0:
+            return
+
+        self._keys.append(keys[admitted])
+        self._columns.append(tuple(gather(admitted)))
+        self._n_pending += len(admitted)
+        if self._n_pending >= 2 * self.size:
+            self._compact()
+
+    def _compact(self) -> None:
+        keys = np.concatenate(self._keys)
+        columns = [np.concatenate(parts) for parts in zip(*self._columns)]
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size - 1)[:self.size]
+            keys = keys[keep]
+            columns = [column[keep] for column in columns]
+            self._cutoff = float(keys.max())
+        self._keys, self._columns = [keys], [tuple(columns)]
+        self._n_pending = len(keys)
+
+    def sample(self) -> list[np.ndarray]:
+        """The sampled columns, in key order (empty list if nothing was admitted)."""
+        if not self._keys:
+            return []
+        self._compact()
+        order = np.argsort(self._keys[0])
+        return [column[order] for column in self._columns[0]]
+
+
+@dataclass
+class RegionGrid:
+    """
+    Tile layout of a region, as EmbeddingMosaic would stitch it.
+
+    Every tile gets a slot of `tile_shape` (the first tile's size); tiles
+    of another size are zero-padded or cropped to it by `load_chunk`.
+    """
+
+    catalog: TileCatalog
+    columns: list[int]  # tile x indices, west to east
+    rows: list[int]  # tile y indices, north to south
+    tiles: set[TileIndex]
+    tile_shape: tuple[int, int, int]
+    transform: Affine
+
+    @classmethod
+    def from_catalog(
+        cls,
+        catalog: TileCatalog,
+        bbox: tuple[float, float, float, float],
+    ) -> "RegionGrid":
+        tiles = catalog.tiles_in_bbox(bbox)
+        if not tiles:
+            raise ValueError(f"No tiles found in {catalog.year_dir} for bbox {bbox}")
+
+        columns = sorted({ix for ix, _ in tiles})
+        rows = sorted({iy for _, iy in tiles}, reverse=True)
+        tile_h, tile_w, n_channels = catalog.tile_shape(tiles[0])
+        step = catalog.tile_size
+        min_lon, north_lat = catalog.tile_coords((columns[0], rows[0]))
+        max_lat = north_lat + step
+        transform = rasterio.transform.from_bounds(
+            min_lon,
+            max_lat - step * len(rows),
+            min_lon + step * len(columns),
+            max_lat,
+            len(columns) * tile_w,
+            len(rows) * tile_h,
+        )
+        return cls(catalog, columns, rows, set(tiles), (tile_h, tile_w, n_channels), transform)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """(height, width) of the region in pixels."""
+        return len(self.rows) * self.tile_shape[0], len(self.columns) * self.tile_shape[1]
+
+    @property
+    def n_channels(self) -> int:
+        return self.tile_shape[2]
+
+    def bands(
+        self, band_rows: int
+    ) -> Iterator[tuple[int, slice, list[tuple[int, Optional[TileIndex]]]]]:
+        """
+        Walk the region in horizontal bands, north to south.
+
+        Yields:
+            (region row of the band, rows of the band within its tiles,
+            [(region column of each tile, tile index or None if missing)])
+        """
+        tile_h, tile_w, _ = self.tile_shape
+        for i, iy in enumerate(self.rows):
+            tiles = [
+                (j * tile_w, (ix, iy) if (ix, iy) in self.tiles else None)
+                for j, ix in enumerate(self.columns)
+            ]
+            for start in range(0, tile_h, band_rows):
+                yield i * tile_h + start, slice(start, min(start + band_rows, tile_h)), tiles
+
+    def load_chunk(self, index: TileIndex, rows: slice) -> np.ndarray:
+        """Rows of a tile fitted to its slot: (len(rows), tile width, C)."""
+        chunk = self.catalog.load_tile(index, rows)
+        return fit_tile(chunk, rows.stop - rows.start, self.tile_shape[1])
+
+    def n_bands(self, band_rows: int) -> int:
+        return len(self.rows) * -(-self.tile_shape[0] // band_rows)
+
+
+def band_rows_for(memory_limit_mb: float, grid: RegionGrid) -> int:
+    """Rows per band so one band of one tile stays within its memory share."""
+    _, tile_w, n_channels = grid.tile_shape
+    # float32 band plus the dequantization temporary
+    row_bytes = tile_w * n_channels * 4 * 2
+    budget = memory_limit_mb * 1024 * 1024 * BAND_MEMORY_FRACTION
+    return int(max(1, min(grid.tile_shape[0], budget // row_bytes)))
+
+
+@dataclass
+class LargeRegionResult:
+    """Summary of an out-of-core run; the scores themselves are on disk."""
+
+    species_name: str
+    taxon_key: int
+    n_occurrences: int
+    n_background: int
+    n_candidates: int  # pixels at or above the threshold
+    shape: tuple[int, int]
+    transform: Affine
+    bbox: tuple[float, float, float, float]
+    memory_limit_mb: float
+    peak_rss_mb: float
+    paths: dict[str, Path] = field(default_factory=dict)
+
+
+@traced("sample_training_data")
+def _sample_training_data(
+    grid: RegionGrid,
+    occurrence_pixels: np.ndarray,
+    n_background: int,
+    band_rows: int,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    One pass over the region: occurrence embeddings and a background sample.
+
+    Args:
+        grid: Region layout
+        occurrence_pixels: (N, 2) region row, col of occurrences inside it
+        n_background: Background sample size
+        band_rows: Rows per band
+        seed: Random seed for the background reservoir
+
+    Returns:
+        Tuple of (occurrence embeddings (N, C), background embeddings (M, C));
+        occurrences in missing tiles get empty (zero) embeddings
+    """
+    _, tile_w, n_channels = grid.tile_shape
+    positives = np.zeros((len(occurrence_pixels), n_channels), dtype=np.float32)
+    background = Reservoir(n_background, seed=seed)
+
+    order = np.argsort(occurrence_pixels[:, 0], kind="stable")
+    sorted_rows = occurrence_pixels[order, 0]
+
+    for row0, rows, tiles in tqdm(
+        grid.bands(band_rows), total=grid.n_bands(band_rows), desc="Sampling", unit="band"
+    ):
+        n_rows = rows.stop - rows.start
+        lo, hi = np.searchsorted(sorted_rows, [row0, row0 + n_rows])
+        band_occurrences = order[lo:hi]
+
+        for col0, index in tiles:
+            if index is None:
+                continue
+            chunk = grid.load_chunk(index, rows)
+            cols = occurrence_pixels[band_occurrences, 1]
+            in_tile = band_occurrences[(cols >= col0) & (cols < col0 + tile_w)]
+            local_rows = occurrence_pixels[in_tile, 0] - row0
+            local_cols = occurrence_pixels[in_tile, 1] - col0
+            positives[in_tile] = chunk[local_rows, local_cols]
+
+            valid = chunk.any(axis=2)
+            valid[local_rows, local_cols] = False
+            flat = np.flatnonzero(valid)
+            pixels = chunk.reshape(-1, n_channels)
+            background.offer(len(flat), lambda idx: (pixels[flat[idx]],))
+            del chunk, pixels
+
+    sample = background.sample()
+    negatives = sample[0] if sample else np.zeros((0, n_channels), dtype=np.float32)
+    return positives, negatives
+
+
+@traced("score_region")
+def _score_region(
+    grid: RegionGrid,
+    classifier: ClassifierMethod,
+    path: Path,
+    band_rows: int,
+    threshold: float,
+    cache_mb: int,
+    seed: int,
+) -> tuple[dict, Reservoir]:
+    """
+    Score the region band by band into a tiled GeoTIFF.
+
+    Returns:
+        Tuple of (score statistics, reservoir of candidate (pixels, scores))
+    """
+    h, w = grid.shape
+    tile_w = grid.tile_shape[1]
+    empty_score = float(
+        classifier.predict(np.zeros((1, grid.n_channels), dtype=np.float32), progress=False)[0]
+    )
+    candidates = Reservoir(MAX_CANDIDATE_POINTS, seed=seed)
+    stats = {"min": np.inf, "max": -np.inf, "n_high": 0, "n_pixels": h * w}
+
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb), rasterio.open(
+        path, "w",
+        driver="GTiff",
+        height=h,
+        width=w,
+        count=1,
+        dtype=np.float32,
+        crs="EPSG:4326",
+        transform=grid.transform,
+        tiled=True,
+        blockxsize=RASTER_BLOCK_SIZE,
+        blockysize=RASTER_BLOCK_SIZE,
+        compress="deflate",
+        BIGTIFF="IF_SAFER",
+    ) as dst:
+        for row0, rows, tiles in tqdm(
+            grid.bands(band_rows), total=grid.n_bands(band_rows), desc="Scoring", unit="band"
+        ):
+            for col0, index in tiles:
+                if index is None:
+                    scores = np.full((rows.stop - rows.start, tile_w), empty_score, dtype=np.float32)
+                else:
+                    chunk = grid.load_chunk(index, rows)
+                    scores = classifier.predict(
+                        chunk.reshape(-1, grid.n_channels), progress=False
+                    ).reshape(chunk.shape[:2])
+                    del chunk
+                dst.write(scores, 1, window=Window(col0, row0, scores.shape[1], scores.shape[0]))
+
+                stats["min"] = min(stats["min"], float(scores.min()))
+                stats["max"] = max(stats["max"], float(scores.max()))
+                high_rows, high_cols = np.nonzero(scores >= threshold)
+                stats["n_high"] += len(high_rows)
+                candidates.offer(len(high_rows), lambda idx: (
+                    np.stack([high_rows[idx] + row0, high_cols[idx] + col0], axis=1),
+                    scores[high_rows[idx], high_cols[idx]],
+                ))
+
+    return stats, candidates
+
+
+@dataclass
+class TrainedRegion:
+    """A classifier trained out of core, with the region it was trained on."""
+
+    species_info: dict
+    grid: RegionGrid
+    classifier: ClassifierMethod
+    valid_coords: list[tuple[float, float]]  # occurrences inside the tiles
+    n_background: int
+    band_rows: int
+
+
+@traced("train_region")
+def train_region(
+    species_name: str,
+    bbox: tuple[float, float, float, float],
+    cache_dir: Path,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    negative_ratio: int = NEGATIVE_RATIO,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    match_cache: Optional[MatchCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    dedupe_pixels: bool = False,
+    year: int = 2024,
+    seed: int = 42,
+) -> TrainedRegion:
+    """
+    Resolve a species and train its classifier over a region, out of core.
+
+    Steps 1-3 of find_candidates_large (see there for the arguments).
+    """
+    # 1. Resolve species and lay out the region
+    logger.info("\n[1/4] Resolving species and region...")
+    species_info = get_species_info(species_name, match_cache)
+    taxon_key = species_info["taxon_key"]
+    logger.info(f"  Matched: {species_info['scientific_name']} (key: {taxon_key})")
+
+    grid = RegionGrid.from_catalog(get_catalog(cache_dir, year, TILE_SIZE), bbox)
+    h, w = grid.shape
+    band_rows = band_rows_for(memory_limit_mb, grid)
+    logger.info(
+        f"  Region: {len(grid.tiles):,} tiles, {h:,} x {w:,} x {grid.n_channels} "
+        f"({h * w * grid.n_channels * 4 / 1e9:.1f} GB as float32)"
+    )
+    logger.info(f"  Memory limit: {memory_limit_mb:,.0f} MB -> bands of {band_rows} rows")
+
+    # 2. Occurrences and background in one pass over the tiles
+    logger.info("\n[2/4] Sampling occurrence and background embeddings...")
+    start = time.perf_counter()
+    coords = fetch_occurrences(
+        taxon_key, bbox, cache=occurrence_cache, archive=occurrence_archive
+    )
+    if coords:
+        lons, lats = np.asarray(coords, dtype=np.float64).T
+        occ_rows, occ_cols = rasterio.transform.rowcol(grid.transform, lons, lats)
+        pixels = np.stack([occ_rows, occ_cols], axis=1).astype(np.int64)
+    else:
+        pixels = np.zeros((0, 2), dtype=np.int64)
+    inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < h) & (pixels[:, 1] >= 0) & (pixels[:, 1] < w)
+    pixels = pixels[inside]
+    valid_coords = [c for c, keep in zip(coords, inside) if keep]
+    logger.info(f"  Found {len(coords)} occurrences, {len(valid_coords)} inside the tiles")
+
+    if len(valid_coords) < 2:
+        raise ValueError(f"Need at least 2 occurrences, found {len(valid_coords)}")
+
+    positive_embeddings, negative_embeddings = _sample_training_data(
+        grid, pixels, len(valid_coords) * negative_ratio, band_rows, seed
+    )
+    n_background = len(negative_embeddings)
+    logger.info(f"  Background samples: {n_background}")
+    logger.info(f"  Sampled in {time.perf_counter() - start:.1f}s")
+
+    positive_weights = None
+    if dedupe_pixels:
+        flat = pixels[:, 0] * w + pixels[:, 1]
+        _, first, counts = np.unique(flat, return_index=True, return_counts=True)
+        positive_embeddings, positive_weights = positive_embeddings[first], counts.astype(np.float64)
+        logger.info(
+            f"  Unique occurrence pixels: {len(first)} "
+            f"({len(first) / len(valid_coords):.1%} of valid samples)"
+        )
+        if len(first) < 2:
+            raise ValueError("Need at least 2 distinct occurrence pixels")
+
+    # 3. Train
+    logger.info("\n[3/4] Training classifier...")
+    classifier = ClassifierMethod()
+    classifier.fit(positive_embeddings, negative_embeddings, positive_weights=positive_weights)
+
+    return TrainedRegion(
+        species_info=species_info,
+        grid=grid,
+        classifier=classifier,
+        valid_coords=valid_coords,
+        n_background=n_background,
+        band_rows=band_rows,
+    )
+
+
+def write_candidates(
+    path: Path,
+    trained: TrainedRegion,
+    bbox: tuple[float, float, float, float],
+    pixels: np.ndarray,
+    scores: np.ndarray,
+    n_candidate_pixels: int,
+    **metadata,
+) -> int:
+    """
+    Write candidates.geojson for candidate pixels of a region.
+
+    Args:
+        path: Output file
+        trained: The trained region (species and grid)
+        bbox: Requested bounding box
+        pixels: (N, 2) region row, col of the candidates to write
+        scores: (N,) their probabilities
+        n_candidate_pixels: Pixels at or above the threshold in the region
+        **metadata: Further metadata entries
+
+    Returns:
+        Number of candidates written
+    """
+    features = candidate_features(trained.grid.transform, pixels[:, 0], pixels[:, 1], scores)
+    geojson = {
+        "type": "FeatureCollection",
+        "features": features,
+        "metadata": {
+            "species": trained.species_info["canonical_name"],
+            "taxon_key": trained.species_info["taxon_key"],
+            "n_occurrences": len(trained.valid_coords),
+            "n_candidates": len(features),
+            "threshold": CANDIDATE_THRESHOLD,
+            "bbox": list(bbox),
+            "n_candidate_pixels": n_candidate_pixels,
+            **metadata,
+        },
+    }
+    with open(path, "w") as f:
+        json.dump(geojson, f)
+    logger.info(f"Saved {len(features)} candidates: {path}")
+    return len(features)
+
+
+@traced("find_candidates_large")
+def find_candidates_large(
+    species_name: str,
+    bbox: tuple[float, float, float, float],
+    cache_dir: Path,
+    output_dir: Path,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    negative_ratio: int = NEGATIVE_RATIO,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    match_cache: Optional[MatchCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    dedupe_pixels: bool = False,
+    year: int = 2024,
+    seed: int = 42,
+) -> LargeRegionResult:
+    """
+    Find candidate locations for a species over a large region, out of core.
+
+    Same model and outputs as find_candidates, but the region is streamed
+    tile band by tile band, so memory stays near `memory_limit_mb` however
+    many tiles the bbox spans. Occurrences are not read from or written to
+    the feature store.
+
+    Args:
+        species_name: Scientific name of the species
+        bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
+        cache_dir: Directory containing Tessera embeddings
+        output_dir: Directory for probability.tif, candidates.geojson and
+            occurrences.geojson
+        memory_limit_mb: Memory budget the band size and GeoTIFF cache are
+            derived from; the peak RSS is reported against it
+        negative_ratio: Ratio of background samples to occurrences
+        occurrence_cache: Local cache of GBIF occurrence queries
+        match_cache: Persistent memo of GBIF name matches
+        occurrence_archive: Ingested GBIF downloads to read occurrences from
+        dedupe_pixels: Train on one count-weighted positive per distinct
+            occurrence pixel instead of one per occurrence
+        year: Embedding year
+        seed: Random seed for the background and candidate samples
+
+    Returns:
+        LargeRegionResult with counts, the raster grid and output paths
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    logger.info("=" * 60)
+    logger.info(f"Finding candidates (large region) for: {species_name}")
+    logger.info("=" * 60)
+
+    trained = train_region(
+        species_name,
+        bbox,
+        cache_dir,
+        memory_limit_mb=memory_limit_mb,
+        negative_ratio=negative_ratio,
+        occurrence_cache=occurrence_cache,
+        match_cache=match_cache,
+        occurrence_archive=occurrence_archive,
+        dedupe_pixels=dedupe_pixels,
+        year=year,
+        seed=seed,
+    )
+    grid = trained.grid
+
+    # 4. Score band by band
+    logger.info("\n[4/4] Scoring region...")
+    start = time.perf_counter()
+    raster_path = output_dir / "probability.tif"
+    cache_mb = max(16, int(memory_limit_mb * GDAL_CACHE_FRACTION))
+    stats, candidates = _score_region(
+        grid, trained.classifier, raster_path, trained.band_rows, CANDIDATE_THRESHOLD, cache_mb, seed
+    )
+    logger.info(f"  Scored in {time.perf_counter() - start:.1f}s")
+    logger.info(f"  Score range: {stats['min']:.3f} - {stats['max']:.3f}")
+    logger.info(
+        f"  High probability pixels (>={CANDIDATE_THRESHOLD}): {stats['n_high']:,} "
+        f"({100 * stats['n_high'] / stats['n_pixels']:.1f}%)"
+    )
+    logger.info(f"Saved probability raster: {raster_path}")
+
+    peak = peak_rss_mb()
+    sample = candidates.sample()
+    candidate_pixels, candidate_scores = sample if sample else (np.zeros((0, 2), int), np.zeros(0))
+    candidates_path = output_dir / "candidates.geojson"
+    write_candidates(
+        candidates_path,
+        trained,
+        bbox,
+        candidate_pixels,
+        candidate_scores,
+        stats["n_high"],
+        memory={
+            "limit_mb": memory_limit_mb,
+            "peak_rss_mb": round(peak, 1),
+            "band_rows": trained.band_rows,
+        },
+    )
+    occurrences_path = save_occurrences(output_dir, trained.valid_coords)
+
+    logger.info(f"\n  Peak RSS: {peak:,.0f} MB (limit {memory_limit_mb:,.0f} MB)")
+    if peak > memory_limit_mb:
+        logger.warning("  Peak RSS exceeded the memory limit")
+
+    logger.info("\n" + "=" * 60)
+    logger.info("COMPLETE")
+    logger.info("=" * 60)
+
+    return LargeRegionResult(
+        species_name=trained.species_info["canonical_name"],
+        taxon_key=trained.species_info["taxon_key"],
+        n_occurrences=len(trained.valid_coords),
+        n_background=trained.n_background,
+        n_candidates=stats["n_high"],
+        shape=grid.shape,
+        transform=grid.transform,
+        bbox=bbox,
+        memory_limit_mb=memory_limit_mb,
+        peak_rss_mb=peak,
+        paths={
+            "raster": raster_path,
+            "candidates": candidates_path,
+            "occurrences": occurrences_path,
+        },
+    )
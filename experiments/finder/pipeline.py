@@ -4,6 +4,7 @@ Main pipeline for finding candidate locations.
 
 import json
 import logging
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
@@ -11,8 +12,14 @@ from typing import Optional
 import numpy as np
 import rasterio
 
-from .gbif import get_species_info, fetch_occurrences
+from .background import sample_background
+from .cache import MatchCache, OccurrenceCache
+from .gbif import get_species_info
 from .embeddings import EmbeddingMosaic
+from .features import FeatureStore, load_occurrence_features
+from .hierarchical import DEFAULT_BLOCK_SIZE, DEFAULT_MARGIN, score_hierarchical
+from .ingest import OccurrenceArchive
+from .instrument import count, span, traced
 from .methods import ClassifierMethod
 
 logger = logging.getLogger(__name__)
@@ -24,11 +31,39 @@ REGIONS = {
         "bbox": (0.03, 52.13, 0.22, 52.29),
         "description": "Cambridge, UK test region",
     },
+    "great_britain": {
+        "bbox": (-8.2, 49.9, 1.8, 60.9),
+        "description": "Great Britain (run with --large-region)",
+    },
 }
 
 # Default ratio of background samples to occurrences
 NEGATIVE_RATIO = 5
 
+# Probability at or above which a pixel is a candidate
+CANDIDATE_THRESHOLD = 0.5
+
+
+def candidate_features(
+    transform: rasterio.transform.Affine,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    probabilities: np.ndarray,
+) -> list[dict]:
+    """GeoJSON point features for candidate pixels, sorted by probability."""
+    features = []
+    for row, col, probability in zip(rows, cols, probabilities):
+        lon, lat = rasterio.transform.xy(transform, row, col)
+        features.append({
+            "type": "Feature",
+            "properties": {"probability": float(probability)},
+            "geometry": {"type": "Point", "coordinates": [lon, lat]}
+        })
+
+    # Sort by probability (ascending, so high values rendered on top)
+    features.sort(key=lambda f: f["properties"]["probability"])
+    return features
+
 
 @dataclass
 class PredictionResult:
@@ -41,6 +76,7 @@ class PredictionResult:
     scores: np.ndarray  # (H, W) probability map
     transform: rasterio.transform.Affine
     bbox: tuple[float, float, float, float]
+    search_stats: Optional[dict] = None  # coarse-to-fine statistics, if used
 
     def to_geojson(
         self,
@@ -55,17 +91,7 @@ class PredictionResult:
             idx = np.random.choice(len(rows), max_points, replace=False)
             rows, cols = rows[idx], cols[idx]
 
-        features = []
-        for row, col in zip(rows, cols):
-            lon, lat = rasterio.transform.xy(self.transform, row, col)
-            features.append({
-                "type": "Feature",
-                "properties": {"probability": float(self.scores[row, col])},
-                "geometry": {"type": "Point", "coordinates": [lon, lat]}
-            })
-
-        # Sort by probability (ascending, so high values rendered on top)
-        features.sort(key=lambda f: f["properties"]["probability"])
+        features = candidate_features(self.transform, rows, cols, self.scores[rows, cols])
 
         return {
             "type": "FeatureCollection",
@@ -77,6 +103,7 @@ class PredictionResult:
                 "n_candidates": len(features),
                 "threshold": threshold,
                 "bbox": list(self.bbox),
+                **({"search": self.search_stats} if self.search_stats else {}),
             }
         }
 
@@ -114,59 +141,44 @@ class PredictionResult:
         return paths
 
 
-def sample_background(
-    mosaic: EmbeddingMosaic,
-    n_samples: int,
-    exclude_coords: list[tuple[float, float]],
-    seed: int = 42,
-) -> tuple[np.ndarray, list[tuple[float, float]]]:
-    """
-    Sample random background points from the mosaic.
-
-    Args:
-        mosaic: Loaded embedding mosaic
-        n_samples: Number of background samples to generate
-        exclude_coords: Coordinates to exclude (occurrence locations)
-        seed: Random seed for reproducibility
-
-    Returns:
-        Tuple of (embeddings array, coordinates list)
-    """
-    rng = np.random.default_rng(seed)
-    h, w, _ = mosaic.shape
-
-    # Get pixel indices of exclusions
-    exclude_pixels = set()
-    for lon, lat in exclude_coords:
-        row, col = mosaic.coords_to_pixel(lon, lat)
-        exclude_pixels.add((row, col))
-
-    coords = []
-    embeddings = []
-    attempts = 0
-    max_attempts = n_samples * 20
-
-    while len(coords) < n_samples and attempts < max_attempts:
-        row = rng.integers(0, h)
-        col = rng.integers(0, w)
-        if (row, col) not in exclude_pixels:
-            emb = mosaic.mosaic[row, col, :]
-            if not np.allclose(emb, 0):  # Skip empty pixels
-                lon, lat = mosaic.pixel_to_coords(row, col)
-                coords.append((lon, lat))
-                embeddings.append(emb)
-                exclude_pixels.add((row, col))
-        attempts += 1
-
-    return np.array(embeddings), coords
+def save_occurrences(output_dir: Path, coords: list[tuple[float, float]]) -> Path:
+    """Save the occurrences used for training as occurrences.geojson."""
+    occ_geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {"type": "Point", "coordinates": [lon, lat]}
+            }
+            for lon, lat in coords
+        ]
+    }
+    occ_path = Path(output_dir) / "occurrences.geojson"
+    with open(occ_path, "w") as f:
+        json.dump(occ_geojson, f, indent=2)
+    logger.info(f"Saved occurrences: {occ_path}")
+    return occ_path
 
 
+@traced("find_candidates")
 def find_candidates(
     species_name: str,
     bbox: tuple[float, float, float, float],
     cache_dir: Path,
     output_dir: Optional[Path] = None,
     negative_ratio: int = NEGATIVE_RATIO,
+    feature_store: Optional[FeatureStore] = None,
+    refresh_occurrences: bool = False,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    match_cache: Optional[MatchCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    dedupe_pixels: bool = False,
+    hierarchical: bool = False,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    margin: float = DEFAULT_MARGIN,
+    check_recall: bool = False,
+    level: int = 0,
 ) -> PredictionResult:
     """
     Find candidate locations for a species using a classifier.
@@ -180,6 +192,22 @@ def find_candidates(
         cache_dir: Directory containing Tessera embeddings
         output_dir: If provided, save results to this directory
         negative_ratio: Ratio of background samples to occurrences
+        feature_store: If provided, reuse stored occurrence embeddings
+        refresh_occurrences: Re-fetch occurrences even if they are stored
+        occurrence_cache: Local cache of GBIF occurrence queries
+        match_cache: Persistent memo of GBIF name matches
+        occurrence_archive: Ingested GBIF downloads to read occurrences from
+        dedupe_pixels: Train on one count-weighted positive per distinct
+            occurrence pixel instead of one per occurrence
+        hierarchical: Score block-pooled embeddings first and refine only
+            blocks that could hold candidates (see finder.hierarchical)
+        block_size: Block edge in pixels for hierarchical scoring
+        margin: Probability margin below the candidate threshold within
+            which hierarchical blocks are still refined
+        check_recall: With hierarchical scoring, also score exhaustively
+            and report the recall of the candidates
+        level: Embedding pyramid level to work at (0 = full resolution);
+            coarser levels give quick-look maps of large regions
 
     Returns:
         PredictionResult with probability scores and metadata
@@ -188,50 +216,94 @@ def find_candidates(
     logger.info(f"Finding candidates for: {species_name}")
     logger.info("=" * 60)
 
-    # 1. Get species info and occurrences
-    logger.info("\n[1/5] Fetching GBIF data...")
-    species_info = get_species_info(species_name)
+    # 1. Resolve species
+    logger.info("\n[1/4] Resolving species...")
+    with span("resolve_species"):
+        species_info = get_species_info(species_name, match_cache)
     taxon_key = species_info["taxon_key"]
     logger.info(f"  Matched: {species_info['scientific_name']} (key: {taxon_key})")
 
-    occurrences = fetch_occurrences(taxon_key, bbox)
-    n_occurrences = len(occurrences)
+    # 2. Load the embedding mosaic while occurrences download, sampling
+    # each page of occurrences as it arrives
+    logger.info("\n[2/4] Loading embedding mosaic and occurrence embeddings...")
+    start = time.perf_counter()
+    with span("load"):
+        mosaic = EmbeddingMosaic(cache_dir, bbox, level=level)
+        features = load_occurrence_features(
+            taxon_key,
+            mosaic,
+            store=feature_store,
+            refresh=refresh_occurrences,
+            occurrence_cache=occurrence_cache,
+            occurrence_archive=occurrence_archive,
+        )
+        count("occurrences", features.n_occurrences)
+    h, w, c = mosaic.shape
+    logger.info(f"  Mosaic shape: {h} x {w} x {c}")
+    n_occurrences = features.n_occurrences
     logger.info(f"  Found {n_occurrences} occurrences in region")
+    logger.info(f"  Loaded in {time.perf_counter() - start:.1f}s")
 
     if n_occurrences < 2:
         raise ValueError(f"Need at least 2 occurrences, found {n_occurrences}")
 
-    # 2. Load embedding mosaic
-    logger.info("\n[2/5] Loading embedding mosaic...")
-    mosaic = EmbeddingMosaic(cache_dir, bbox)
-    mosaic.load()
-    h, w, c = mosaic.shape
-    logger.info(f"  Mosaic shape: {h} x {w} x {c}")
-
-    # 3. Sample embeddings at occurrence locations
-    logger.info("\n[3/5] Sampling occurrence embeddings...")
-    positive_embeddings, valid_coords = mosaic.sample_at_coords(occurrences)
+    positive_embeddings = np.asarray(features.embeddings)
+    valid_coords = features.valid_coords
     logger.info(f"  Valid occurrence samples: {len(positive_embeddings)}")
 
     if len(positive_embeddings) < 2:
         raise ValueError("Need at least 2 valid embeddings at occurrence locations")
 
-    # 4. Sample background embeddings
-    logger.info("\n[4/5] Sampling background embeddings...")
+    # 3. Sample background embeddings
+    logger.info("\n[3/4] Sampling background embeddings...")
     n_background = len(positive_embeddings) * negative_ratio
-    negative_embeddings, neg_coords = sample_background(
-        mosaic, n_background, valid_coords
-    )
+    positive_weights = None
+    if dedupe_pixels:
+        positive_embeddings, positive_weights, _ = features.unique_pixels()
+        logger.info(
+            f"  Unique occurrence pixels: {len(positive_embeddings)} "
+            f"({len(positive_embeddings) / len(valid_coords):.1%} of valid samples)"
+        )
+        if len(positive_embeddings) < 2:
+            raise ValueError("Need at least 2 distinct occurrence pixels")
+    with span("sample_background", background_samples=n_background):
+        negative_embeddings, neg_coords = sample_background(
+            mosaic, n_background, valid_coords
+        )
     logger.info(f"  Background samples: {len(negative_embeddings)}")
 
-    # 5. Train classifier and predict
-    logger.info("\n[5/5] Training classifier and predicting...")
-    classifier = ClassifierMethod()
-    classifier.fit(positive_embeddings, negative_embeddings)
-
-    all_embeddings = mosaic.get_all_embeddings()
-    scores = classifier.predict(all_embeddings)
-    scores_map = scores.reshape(h, w)
+    # 4. Train classifier and predict
+    logger.info("\n[4/4] Training classifier and predicting...")
+    with span("train"):
+        classifier = ClassifierMethod()
+        classifier.fit(positive_embeddings, negative_embeddings, positive_weights=positive_weights)
+
+    search_stats = None
+    with span("score"):
+        if hierarchical:
+            scores_map, stats = score_hierarchical(
+                classifier,
+                mosaic,
+                threshold=CANDIDATE_THRESHOLD,
+                block_size=block_size,
+                margin=margin,
+                check_recall=check_recall,
+            )
+            scores = scores_map.ravel()
+            search_stats = stats.to_dict()
+            logger.info(
+                f"  Coarse-to-fine: refined {stats.n_refined_blocks:,}/{stats.n_blocks:,} blocks, "
+                f"skipped {stats.skipped_fraction:.1%} of pixels"
+            )
+            if stats.recall is not None:
+                logger.info(
+                    f"  Recall vs exhaustive: {stats.recall:.2%} "
+                    f"of {stats.n_exhaustive_candidates:,} candidates"
+                )
+        else:
+            all_embeddings = mosaic.get_all_embeddings()
+            scores = classifier.predict(all_embeddings)
+            scores_map = scores.reshape(h, w)
 
     # Log statistics
     logger.info(f"\n  Score range: {scores.min():.3f} - {scores.max():.3f}")
@@ -247,28 +319,16 @@ def find_candidates(
         scores=scores_map,
         transform=mosaic.transform,
         bbox=bbox,
+        search_stats=search_stats,
     )
 
     # Save if output directory specified
     if output_dir:
-        result.save(output_dir, threshold=0.5)
+        with span("save"):
+            result.save(output_dir, threshold=CANDIDATE_THRESHOLD)
 
-        # Also save occurrences
-        occ_geojson = {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "properties": {},
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]}
-                }
-                for lon, lat in valid_coords
-            ]
-        }
-        occ_path = output_dir / "occurrences.geojson"
-        with open(occ_path, "w") as f:
-            json.dump(occ_geojson, f, indent=2)
-        logger.info(f"Saved occurrences: {occ_path}")
+            # Also save occurrences
+            save_occurrences(output_dir, valid_coords)
 
     logger.info("\n" + "=" * 60)
     logger.info("COMPLETE")
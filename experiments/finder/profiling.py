@@ -0,0 +1,433 @@
+"""
+Opt-in profiling of a whole run.
+
+`profiling()` wraps a run and leaves artifacts in a directory, so a slow
+run can be triaged from the files alone:
+
+- "cprofile" mode: profile.prof, a deterministic cProfile of the calling
+  thread (open with `python -m pstats` or snakeviz)
+- "sample" mode: profile.folded, call stacks of the calling thread sampled
+  every few milliseconds by a background thread, in the folded format of
+  flamegraph.pl and speedscope. Much cheaper than cProfile on code that
+  makes many small Python calls; a C call holding the GIL is sampled once
+  it returns, with the time since the previous sample.
+- memory=True: tracemalloc snapshots around the instrumented stages (spans
+  of finder.instrument up to a depth), recording the allocation sites that
+  grew most in each, plus per-stage traced allocation peaks in trace.json.
+  Tracing allocations slows allocation-heavy code severalfold.
+- always: torch and BLAS/OpenMP thread counts, and hotspots.txt /
+  profile.json with the top-N functions by self and total time
+"""
+
+import cProfile
+import contextlib
+import json
+import logging
+import os
+import pstats
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import CodeType
+from typing import Callable, ContextManager, Iterator, Literal, Optional
+
+from . import instrument
+from .instrument import TRACE_FILENAME, active_trace, tracing
+
+logger = logging.getLogger(__name__)
+
+ProfileMode = Literal["cprofile", "sample"]
+PROFILE_MODES = ("cprofile", "sample")
+
+DEFAULT_TOP_N = 25
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds
+
+# Spans up to this depth get tracemalloc snapshots with memory=True (the
+# run itself is depth 0, pipeline stages depth 1-2)
+SNAPSHOT_DEPTH = 2
+
+# Allocation sites listed per stage
+MEMORY_SITES = 10
+
+_STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def thread_counts() -> dict:
+    """CPU count, thread settings and the threads torch and BLAS/OpenMP pools use."""
+    info: dict = {
+        "cpu_count": os.cpu_count(),
+        "env": {name: os.environ[name] for name in THREAD_ENV_VARS if name in os.environ},
+    }
+    if hasattr(os, "sched_getaffinity"):
+        info["usable_cpus"] = len(os.sched_getaffinity(0))
+    try:
+        import torch
+
+        info["torch"] = {
+            "num_threads": torch.get_num_threads(),
+            "num_interop_threads": torch.get_num_interop_threads(),
+        }
+    except ImportError:
+        pass
+    try:
+        from threadpoolctl import threadpool_info
+
+        info["threadpools"] = [
+            {key: pool.get(key) for key in ("user_api", "internal_api", "num_threads", "version")}
+            for pool in threadpool_info()
+        ]
+    except ImportError:
+        pass
+    return info
+
+
+def _short_path(filename: str) -> str:
+    if "site-packages" in filename:
+        return filename.split("site-packages" + os.sep, 1)[-1]
+    if filename.startswith(_STDLIB_DIR + os.sep):
+        return filename[len(_STDLIB_DIR) + 1:]
+    try:
+        relative = os.path.relpath(filename)
+    except ValueError:
+        return filename
+    return filename if relative.startswith("..") else relative
+
+
+def frame_label(filename: str, lineno: int, name: str) -> str:
+    """Readable 'path:line(function)' for a code location."""
+    if filename == "~":
+        # Built-in functions in cProfile stats
+        return name
+    return f"{_short_path(filename)}:{lineno}({name})"
+
+
+class StackSampler:
+    """Samples the call stack of one thread from a background thread."""
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        # Seconds attributed to each stack (outermost frame first)
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.n_samples = 0
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._paused = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @contextlib.contextmanager
+    def paused(self) -> Iterator[None]:
+        """Leave the time spent inside the block out of the samples."""
+        self._paused.set()
+        try:
+            yield
+        finally:
+            self._paused.clear()
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = frame_label(code.co_filename, code.co_firstlineno, code.co_name)
+        return label
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None or self._paused.is_set():
+                last = now
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            # Weight by elapsed time, so samples delayed by a C call that
+            # held the GIL still account for it
+            self.stacks[tuple(reversed(stack))] += now - last
+            self.n_samples += 1
+            last = now
+
+    def folded(self) -> str:
+        """Stacks in folded format: 'outer;...;inner <milliseconds>' per line."""
+        return "".join(
+            f"{';'.join(stack)} {round(seconds * 1000)}\n"
+            for stack, seconds in self.stacks.most_common()
+        )
+
+    def hotspots(self) -> list[dict]:
+        """Self and total seconds per function."""
+        self_s: Counter[str] = Counter()
+        total_s: Counter[str] = Counter()
+        for stack, seconds in self.stacks.items():
+            self_s[stack[-1]] += seconds
+            for label in set(stack):
+                total_s[label] += seconds
+        return [
+            {"function": label, "self_s": self_s.get(label, 0.0), "total_s": total}
+            for label, total in total_s.items()
+        ]
+
+
+def _cprofile_hotspots(profiler: cProfile.Profile) -> list[dict]:
+    """Self and total seconds (and calls) per function of a cProfile run."""
+    stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+    return [
+        {"function": frame_label(*location), "self_s": tt, "total_s": ct, "calls": nc}
+        for location, (_, nc, tt, ct, _) in stats.items()
+    ]
+
+
+class _MemorySnapshots:
+    """
+    Span listener taking tracemalloc snapshots around shallow spans.
+
+    `pause` returns a context manager that keeps the snapshots out of the
+    CPU profile. cProfile cannot be paused inside a call without skewing
+    its totals, so in cprofile mode snapshots show up as tracemalloc
+    functions.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = SNAPSHOT_DEPTH,
+        n_sites: int = MEMORY_SITES,
+        pause: Callable[[], ContextManager] = contextlib.nullcontext,
+    ):
+        self.max_depth = max_depth
+        self.n_sites = n_sites
+        self.pause = pause
+        self.stages: dict[str, dict] = {}
+        self._open: dict[int, tracemalloc.Snapshot] = {}
+        # Allocations of the profiling machinery itself are left out
+        self._ignored = {tracemalloc.__file__, __file__, instrument.__file__}
+
+    def span_entered(self, span) -> None:
+        if span.depth <= self.max_depth and tracemalloc.is_tracing():
+            with self.pause():
+                self._open[id(span)] = tracemalloc.take_snapshot()
+
+    def span_exited(self, span, record: dict) -> None:
+        before = self._open.pop(id(span), None)
+        if before is None or not tracemalloc.is_tracing():
+            return
+        with self.pause():
+            self._record(span, record, before)
+
+    def _record(self, span, record: dict, before: tracemalloc.Snapshot) -> None:
+        diffs = [
+            d for d in tracemalloc.take_snapshot().compare_to(before, "lineno")
+            if d.traceback[0].filename not in self._ignored
+        ]
+        growth = sum(d.size_diff for d in diffs)
+        stage = self.stages.setdefault(span.path, {"calls": 0, "growth_mb": None})
+        stage["calls"] += 1
+        # Keep the call of each stage that grew memory most
+        if stage["growth_mb"] is None or growth / 1e6 > stage["growth_mb"]:
+            stage["growth_mb"] = growth / 1e6
+            stage["alloc_peak_mb"] = record.get("alloc_peak_mb")
+            stage["sites"] = [
+                {
+                    "site": f"{_short_path(d.traceback[0].filename)}:{d.traceback[0].lineno}",
+                    "size_diff_mb": d.size_diff / 1e6,
+                    "count_diff": d.count_diff,
+                }
+                for d in sorted(diffs, key=lambda d: d.size_diff, reverse=True)[:self.n_sites]
+                if d.size_diff > 0
+            ]
+
+
+@dataclass
+class ProfileReport:
+    """What a profiled run wrote and found."""
+
+    output_dir: Path
+    name: str
+    mode: Optional[str]
+    seconds: float = 0.0
+    hotspots: list[dict] = field(default_factory=list)
+    threads: dict = field(default_factory=dict)
+    memory: Optional[dict] = None
+    artifacts: list[str] = field(default_factory=list)
+    metadata: dict = field(default_factory=dict)
+
+    def top(self, key: str, n: int) -> list[dict]:
+        return sorted(self.hotspots, key=lambda h: h[key], reverse=True)[:n]
+
+    def to_dict(self, top_n: int = DEFAULT_TOP_N) -> dict:
+        return {
+            "name": self.name,
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "metadata": self.metadata,
+            "threads": self.threads,
+            "top_self": self.top("self_s", top_n),
+            "top_total": self.top("total_s", top_n),
+            "memory": self.memory,
+            "artifacts": self.artifacts,
+        }
+
+    def summary(self, top_n: int = DEFAULT_TOP_N) -> str:
+        """Plain-text hotspot summary."""
+        lines = [f"Profile of {self.name or 'run'} ({self.mode or 'memory only'}): {self.seconds:.1f}s wall"]
+
+        torch_threads = self.threads.get("torch", {})
+        pools = ", ".join(
+            f"{p['internal_api']} {p['num_threads']}" for p in self.threads.get("threadpools", [])
+        )
+        lines.append(
+            f"Threads: {self.threads.get('usable_cpus', self.threads.get('cpu_count'))} CPUs, "
+            f"torch {torch_threads.get('num_threads', '-')} (interop {torch_threads.get('num_interop_threads', '-')}), "
+            f"pools: {pools or '-'}"
+        )
+        if self.threads.get("env"):
+            lines.append("Env: " + ", ".join(f"{k}={v}" for k, v in self.threads["env"].items()))
+
+        for key, title in (("self_s", "self"), ("total_s", "total")):
+            if not self.hotspots:
+                break
+            lines.append(f"\nTop {top_n} by {title} time:")
+            lines.append(f"{'self s':>9} {'total s':>9} {'calls':>9}  function")
+            for h in self.top(key, top_n):
+                calls = f"{h['calls']:>9,}" if "calls" in h else f"{'':>9}"
+                lines.append(f"{h['self_s']:>9.3f} {h['total_s']:>9.3f} {calls}  {h['function']}")
+
+        if self.memory:
+            lines.append("\nMemory growth by stage (tracemalloc, largest call of each):")
+            for path, stage in self.memory.items():
+                lines.append(
+                    f"  {path}: {stage['growth_mb']:+,.1f} MB net, "
+                    f"peak {stage.get('alloc_peak_mb') or 0:,.1f} MB ({stage['calls']} calls)"
+                )
+                for site in stage.get("sites", [])[:3]:
+                    lines.append(f"      {site['size_diff_mb']:+,.1f} MB  {site['site']}")
+        return "\n".join(lines) + "\n"
+
+
+def profile_dir(base_dir: Path, name: str) -> Path:
+    """A new timestamped directory name for the artifacts of one run."""
+    return Path(base_dir) / f"{name}_{datetime.now():%Y%m%d_%H%M%S}"
+
+
+def _save_text(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def profiling(
+    output_dir: Path,
+    mode: Optional[ProfileMode] = "cprofile",
+    memory: bool = False,
+    top_n: int = DEFAULT_TOP_N,
+    interval: float = DEFAULT_SAMPLE_INTERVAL,
+    name: str = "",
+    **metadata,
+) -> Iterator[Optional[ProfileReport]]:
+    """
+    Profile everything run inside the block and write the artifacts.
+
+    Artifacts are written on exit, also when the block raises.
+
+    Args:
+        output_dir: Directory for the artifacts (created)
+        mode: "cprofile", "sample", or None for no CPU profile
+        memory: Take tracemalloc snapshots around the instrumented stages
+            (starts a trace, saved as trace.json, unless one is active)
+        top_n: Functions listed in the hotspot summary
+        interval: Seconds between samples in "sample" mode
+        name: Name of the profiled run
+        **metadata: Stored in profile.json
+
+    Yields:
+        The ProfileReport (filled in on exit), or None if neither a mode
+        nor memory is given
+    """
+    if mode is None and not memory:
+        yield None
+        return
+    if mode is not None and mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {mode!r}; expected one of {PROFILE_MODES}")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    report = ProfileReport(output_dir=output_dir, name=name, mode=mode, metadata=dict(metadata))
+
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    sampler = StackSampler(interval) if mode == "sample" else None
+
+    with contextlib.ExitStack() as stack:
+        snapshots = None
+        if memory:
+            trace = active_trace()
+            if trace is None:
+                trace = stack.enter_context(
+                    tracing(output_dir / TRACE_FILENAME, name=name, allocations=True, **metadata)
+                )
+                report.artifacts.append(TRACE_FILENAME)
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start()
+                stack.callback(tracemalloc.stop)
+            snapshots = _MemorySnapshots(pause=sampler.paused if sampler is not None else contextlib.nullcontext)
+            trace.listeners.append(snapshots)
+            stack.callback(trace.listeners.remove, snapshots)
+
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        if sampler is not None:
+            sampler.start()
+        try:
+            yield report
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            report.seconds = time.perf_counter() - start
+            report.threads = thread_counts()
+
+            if profiler is not None:
+                profiler.dump_stats(output_dir / "profile.prof")
+                report.artifacts.append("profile.prof")
+                report.hotspots = _cprofile_hotspots(profiler)
+            if sampler is not None:
+                _save_text(output_dir / "profile.folded", sampler.folded())
+                report.artifacts.append("profile.folded")
+                report.hotspots = sampler.hotspots()
+                report.metadata["n_samples"] = sampler.n_samples
+            if snapshots is not None:
+                report.memory = snapshots.stages
+
+            report.artifacts += ["hotspots.txt", "profile.json"]
+            summary = report.summary(top_n)
+            _save_text(output_dir / "hotspots.txt", summary)
+            _save_text(output_dir / "profile.json", json.dumps(report.to_dict(top_n), indent=2, default=str))
+            logger.info("\n" + "\n".join(summary.splitlines()[:min(top_n, 10) + 5]))
+            logger.info(f"Saved profile: {output_dir}/")
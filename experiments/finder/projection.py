@@ -0,0 +1,194 @@
+"""
+Dimensionality reduction for Tessera embeddings.
+
+A linear projection (PCA or Gaussian random projection) fitted once per
+region and stored next to the tiles. It can be applied while the mosaic is
+loaded (so the full-dimension mosaic never sits in memory) or inside a
+classifier at fit/score time (so saved models work on raw tiles).
+"""
+
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+
+from .background import BackgroundBank
+from .embeddings import EmbeddingMosaic
+from .features import region_key
+
+ProjectionMethod = Literal["pca", "random"]
+
+# Pixels sampled from the mosaic to fit a projection
+FIT_SAMPLES = 50_000
+
+
+class EmbeddingProjection:
+    """
+    Linear map from C-dimensional embeddings to k dimensions.
+
+    Empty (all-zero) pixels stay all-zero after projection so the
+    "empty pixel" checks used elsewhere keep working.
+    """
+
+    def __init__(
+        self,
+        components: np.ndarray,
+        mean: np.ndarray,
+        method: ProjectionMethod,
+        explained_variance_ratio: Optional[np.ndarray] = None,
+    ):
+        self.components = components.astype(np.float32)  # (C, k)
+        self.mean = mean.astype(np.float32)  # (C,)
+        self.method = method
+        self.explained_variance_ratio = explained_variance_ratio
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def name(self) -> str:
+        """Short identifier such as "pca64", used in cache keys and file names."""
+        return f"{self.method}{self.n_components}"
+
+    @classmethod
+    def fit(
+        cls,
+        embeddings: np.ndarray,
+        n_components: int,
+        method: ProjectionMethod = "pca",
+        seed: int = 42,
+    ) -> "EmbeddingProjection":
+        """
+        Fit a projection on a sample of (non-empty) embeddings.
+
+        Args:
+            embeddings: (N, C) embedding sample
+            n_components: Output dimension k
+            method: "pca" (top-k principal components) or "random"
+                (Gaussian random projection)
+            seed: Random seed for the random projection
+
+        Returns:
+            Fitted EmbeddingProjection
+        """
+        X = np.asarray(embeddings, dtype=np.float64)
+        n_channels = X.shape[1]
+        if not 0 < n_components <= n_channels:
+            raise ValueError(f"n_components must be in 1..{n_channels}, got {n_components}")
+
+        mean = X.mean(axis=0)
+
+        if method == "pca":
+            _, s, vt = np.linalg.svd(X - mean, full_matrices=False)
+            variance = s ** 2
+            return cls(
+                components=vt[:n_components].T,
+                mean=mean,
+                method=method,
+                explained_variance_ratio=variance[:n_components] / variance.sum(),
+            )
+        if method == "random":
+            rng = np.random.default_rng(seed)
+            components = rng.normal(0.0, 1.0 / np.sqrt(n_components), (n_channels, n_components))
+            return cls(components=components, mean=mean, method=method)
+
+        raise ValueError(f"Unknown projection method: {method}")
+
+    def transform(self, embeddings: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """
+        Project embeddings of shape (..., C) to (..., k).
+
+        Works in batches so large tiles do not need a float64 copy.
+        """
+        shape = embeddings.shape
+        flat = embeddings.reshape(-1, shape[-1])
+        out = np.empty((len(flat), self.n_components), dtype=np.float32)
+
+        for i in range(0, len(flat), batch_size):
+            batch = np.asarray(flat[i:i + batch_size], dtype=np.float32)
+            projected = (batch - self.mean) @ self.components
+            projected[~np.any(batch != 0, axis=1)] = 0
+            out[i:i + batch_size] = projected
+
+        return out.reshape(*shape[:-1], self.n_components)
+
+    def save(self, path: Path) -> None:
+        """Save to an .npz file."""
+        np.savez(
+            path,
+            components=self.components,
+            mean=self.mean,
+            method=self.method,
+            explained_variance_ratio=(
+                self.explained_variance_ratio
+                if self.explained_variance_ratio is not None else np.array([])
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "EmbeddingProjection":
+        """Load from an .npz file written by `save`."""
+        with np.load(path) as data:
+            ratio = data["explained_variance_ratio"]
+            return cls(
+                components=data["components"],
+                mean=data["mean"],
+                method=str(data["method"]),
+                explained_variance_ratio=ratio if len(ratio) else None,
+            )
+
+
+def parse_projection_spec(spec: str) -> tuple[ProjectionMethod, int]:
+    """Parse a "method:k" command-line spec such as "pca:64"."""
+    method, _, k = spec.partition(":")
+    if method not in ("pca", "random") or not k.isdigit():
+        raise ValueError(f"Projection must look like pca:64 or random:64, got {spec!r}")
+    return method, int(k)
+
+
+def load_projection(
+    cache_dir: Path,
+    bbox: tuple[float, float, float, float],
+    n_components: int,
+    method: ProjectionMethod = "pca",
+    year: int = 2024,
+    seed: int = 42,
+) -> EmbeddingProjection:
+    """
+    Load the projection for a region, fitting and saving it on first use.
+
+    Projections are stored with the tiles in
+    {cache_dir}/{year}/projections/{region_key}_{method}{k}.npz and fitted on
+    a random sample of valid pixels from the full-dimension mosaic.
+
+    Args:
+        cache_dir: Directory containing year subdirectories with tiles
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        n_components: Output dimension k
+        method: "pca" or "random"
+        year: Year of embeddings
+        seed: Random seed for pixel sampling and random projection
+
+    Returns:
+        EmbeddingProjection for the region
+    """
+    path = (
+        Path(cache_dir) / str(year) / "projections"
+        / f"{region_key(bbox, year)}_{method}{n_components}.npz"
+    )
+    if path.exists():
+        return EmbeddingProjection.load(path)
+
+    mosaic = EmbeddingMosaic(cache_dir, bbox, year=year)
+    sample = BackgroundBank.build(mosaic, n_samples=FIT_SAMPLES, seed=seed).embeddings
+    del mosaic
+
+    projection = EmbeddingProjection.fit(sample, n_components, method=method, seed=seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    projection.save(path)
+    return projection
@@ -0,0 +1,166 @@
+"""
+Multi-resolution pyramid of Tessera embedding tiles.
+
+Level L pools 2**L x 2**L pixel blocks of a tile: each block holds the mean
+embedding of its non-empty pixels and the fraction of its pixels that are
+non-empty. Levels are stored next to each tile, as
+{tile_dir}/{name}_L{level}.npy (float16 means) and
+{tile_dir}/{name}_L{level}_valid.npy (float16 fractions), and are built on
+first use if missing, so a mosaic can be loaded at a coarse level for quick
+previews of large areas.
+"""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from .tiles import TileCatalog, TileIndex
+
+# Levels built by default (pool factors 4, 16 and 64)
+PYRAMID_LEVELS = (2, 4, 6)
+
+
+def pool_blocks(
+    mosaic: np.ndarray,
+    block_size: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Mean of the non-empty pixels in each block of a (H, W, C) mosaic.
+
+    Edge blocks may be smaller than block_size. Blocks without any
+    non-empty pixel get an all-zero (empty) embedding.
+
+    Returns:
+        Tuple of (pooled (BH, BW, C) float32, non-empty pixel counts
+        (BH, BW), non-empty pixel mask (H, W))
+    """
+    h, w, c = mosaic.shape
+    col_starts = np.arange(0, w, block_size)
+    n_rows = -(-h // block_size)
+    pooled = np.zeros((n_rows, len(col_starts), c), dtype=np.float32)
+    counts = np.zeros((n_rows, len(col_starts)), dtype=np.int64)
+    valid = np.zeros((h, w), dtype=bool)
+
+    # One band of block rows at a time, so no full-size temporaries
+    for i, r0 in enumerate(range(0, h, block_size)):
+        band = mosaic[r0:r0 + block_size]
+        valid[r0:r0 + block_size] = band.any(axis=2)
+        counts[i] = np.add.reduceat(valid[r0:r0 + block_size].sum(axis=0), col_starts)
+        pooled[i] = np.add.reduceat(band.sum(axis=0), col_starts, axis=0)
+
+    nonempty = counts > 0
+    pooled[nonempty] /= counts[nonempty, None]
+    return pooled, counts, valid
+
+
+def pool_tile(tile: np.ndarray, level: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pool a full-resolution (H, W, C) tile to a pyramid level.
+
+    Returns:
+        Tuple of (mean embeddings (H', W', C), valid fractions (H', W')),
+        both float32
+    """
+    factor = 2 ** level
+    h, w, _ = tile.shape
+    pooled, counts, _ = pool_blocks(tile, factor)
+    block_rows = np.minimum(factor, h - np.arange(0, h, factor))
+    block_cols = np.minimum(factor, w - np.arange(0, w, factor))
+    fraction = counts / np.outer(block_rows, block_cols)
+    return pooled, fraction.astype(np.float32)
+
+
+def level_paths(tile_dir: Path, level: int) -> tuple[Path, Path]:
+    """(embeddings, valid fraction) files of one pyramid level of a tile."""
+    name = tile_dir.name
+    return tile_dir / f"{name}_L{level}.npy", tile_dir / f"{name}_L{level}_valid.npy"
+
+
+def _save_atomic(path: Path, array: np.ndarray) -> None:
+    tmp_path = path.with_name(f"{path.stem}.tmp{os.getpid()}.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def write_tile_levels(
+    catalog: TileCatalog,
+    index: TileIndex,
+    levels: tuple[int, ...] = PYRAMID_LEVELS,
+    tile: Optional[np.ndarray] = None,
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """
+    Compute and store pyramid levels for one tile.
+
+    Args:
+        catalog: Tile catalog holding the tile
+        index: Grid index of the tile
+        levels: Levels to write
+        tile: The dequantized tile, if already loaded
+
+    Returns:
+        Mapping of level to (embeddings, valid fraction), as stored
+    """
+    tile_dir = catalog.path(index)
+    if tile is None:
+        tile = catalog.load_tile(index)
+
+    written = {}
+    for level in levels:
+        pooled, fraction = pool_tile(tile, level)
+        emb_path, valid_path = level_paths(tile_dir, level)
+        pooled, fraction = pooled.astype(np.float16), fraction.astype(np.float16)
+        _save_atomic(emb_path, pooled)
+        _save_atomic(valid_path, fraction)
+        written[level] = (pooled, fraction)
+    return written
+
+
+def load_tile_level(
+    catalog: TileCatalog,
+    index: TileIndex,
+    level: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load one pyramid level of a tile, building and storing it if missing.
+
+    Returns:
+        Tuple of (mean embeddings (H', W', C), valid fractions (H', W')),
+        both float32
+    """
+    emb_path, valid_path = level_paths(catalog.path(index), level)
+    if emb_path.exists() and valid_path.exists():
+        pooled, fraction = np.load(emb_path), np.load(valid_path)
+    else:
+        pooled, fraction = write_tile_levels(catalog, index, (level,))[level]
+    return pooled.astype(np.float32), fraction.astype(np.float32)
+
+
+def build_pyramid(
+    catalog: TileCatalog,
+    levels: tuple[int, ...] = PYRAMID_LEVELS,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    overwrite: bool = False,
+) -> int:
+    """
+    Write pyramid levels for every tile in a catalog (or a bbox of it).
+
+    Each tile is read once for all of its missing levels.
+
+    Returns:
+        Number of tiles written
+    """
+    indices = catalog.tiles_in_bbox(bbox) if bbox is not None else sorted(catalog.tiles)
+    n_written = 0
+    for index in tqdm(indices, desc="Pyramid", unit="tile"):
+        tile_dir = catalog.path(index)
+        missing = tuple(
+            level for level in levels
+            if overwrite or not all(p.exists() for p in level_paths(tile_dir, level))
+        )
+        if missing:
+            write_tile_levels(catalog, index, missing)
+            n_written += 1
+    return n_written
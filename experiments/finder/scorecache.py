@@ -0,0 +1,216 @@
+"""
+Cache of full-tile classifier scores.
+
+Local predictions around nearby points keep rescoring the same pixels:
+every window inside a tile is a slice of that tile's scores. TileScoreCache
+holds the scores (and MC Dropout uncertainties) of whole tiles, keyed by
+species, model type, tile, year and number of MC samples, so only the
+first window in a tile pays for scoring and later ones are array slices.
+
+Entries are kept in memory up to a byte budget, least recently used first
+out. With a spill directory, entries pushed out of memory (and, on flush,
+all remaining ones) are written to disk and read back on a later miss;
+the directory has its own byte budget, oldest files first out. Keys carry
+the model file's mtime, so retrained models never hit stale entries.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 512
+DEFAULT_SPILL_MAX_MB = 4096
+
+
+class ScoreKey(NamedTuple):
+    """What a full-tile score array depends on."""
+
+    species_key: int
+    model_type: str
+    tile: tuple[int, int]
+    year: int
+    n_mc_samples: int  # 0 for models without MC Dropout
+    model_version: int  # model file mtime (ns)
+
+    @property
+    def filename(self) -> str:
+        ix, iy = self.tile
+        return (
+            f"{self.species_key}_{self.model_type}_{ix}_{iy}_{self.year}"
+            f"_mc{self.n_mc_samples}_v{self.model_version}.npz"
+        )
+
+
+class TileScores(NamedTuple):
+    """
+    Scores of every pixel of a tile, (H, W) float32.
+
+    Empty pixels (no embedding) are NaN. Uncertainties are None for models
+    without MC Dropout.
+    """
+
+    scores: np.ndarray
+    uncertainties: Optional[np.ndarray]
+
+    @property
+    def nbytes(self) -> int:
+        return self.scores.nbytes + (self.uncertainties.nbytes if self.uncertainties is not None else 0)
+
+
+class TileScoreCache:
+    """Byte-bounded LRU cache of TileScores, with optional disk spill."""
+
+    def __init__(
+        self,
+        max_mb: float = DEFAULT_MAX_MB,
+        spill_dir: Optional[Path] = None,
+        spill_max_mb: float = DEFAULT_SPILL_MAX_MB,
+    ):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.spill_max_bytes = int(spill_max_mb * 1024 * 1024)
+        self._entries: OrderedDict[ScoreKey, TileScores] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: ScoreKey) -> bool:
+        return key in self._entries
+
+    def get(self, key: ScoreKey) -> Optional[TileScores]:
+        """Cached scores for a key (from memory, else from disk), or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        entry = self._read_spilled(key)
+        if entry is not None:
+            self.disk_hits += 1
+            self._insert(key, entry)
+            return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key: ScoreKey, entry: TileScores) -> None:
+        """Add scores to the cache, evicting least recently used entries."""
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes
+        self._insert(key, entry)
+
+    def flush(self) -> int:
+        """
+        Write every in-memory entry not yet on disk to the spill directory.
+
+        For short-lived processes, where nothing would otherwise leave
+        memory. Entries stay in memory.
+
+        Returns:
+            Number of entries written
+        """
+        if self.spill_dir is None:
+            return 0
+        n_written = 0
+        for key, entry in self._entries.items():
+            if not (self.spill_dir / key.filename).exists():
+                self._write_spilled(key, entry)
+                n_written += 1
+        self._trim_spill_dir()
+        return n_written
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """Counters and sizes, for logs and reports."""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "entries": len(self._entries),
+            "memory_mb": self._bytes / (1024 * 1024),
+            "max_mb": self.max_bytes / (1024 * 1024),
+        }
+
+    # Internals
+
+    def _insert(self, key: ScoreKey, entry: TileScores) -> None:
+        self._entries[key] = entry
+        self._bytes += entry.nbytes
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._bytes -= old_entry.nbytes
+            self.evictions += 1
+            if self.spill_dir is not None and not (self.spill_dir / old_key.filename).exists():
+                self._write_spilled(old_key, old_entry)
+                self._trim_spill_dir()
+
+    def _write_spilled(self, key: ScoreKey, entry: TileScores) -> None:
+        path = self.spill_dir / key.filename
+        tmp_path = path.with_name(f"{path.stem}.tmp{os.getpid()}.npz")
+        arrays = {"scores": entry.scores}
+        if entry.uncertainties is not None:
+            arrays["uncertainties"] = entry.uncertainties
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        self.spills += 1
+
+    def _read_spilled(self, key: ScoreKey) -> Optional[TileScores]:
+        if self.spill_dir is None:
+            return None
+        path = self.spill_dir / key.filename
+        try:
+            with np.load(path) as data:
+                entry = TileScores(
+                    data["scores"],
+                    data["uncertainties"] if "uncertainties" in data.files else None,
+                )
+            # Mark as recently used for the spill directory's own eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable score cache file {path}: {e}")
+            return None
+        return entry
+
+    def _trim_spill_dir(self) -> None:
+        files = []
+        for path in self.spill_dir.glob("*.npz"):
+            if ".tmp" in path.name:
+                continue  # being written
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.spill_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
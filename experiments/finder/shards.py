@@ -0,0 +1,564 @@
+"""
+Region-sharded scoring on worker processes.
+
+For national runs the region is split into tile-aligned shards of
+`shard_tiles` x `shard_tiles` tiles. The classifier is trained once by the
+coordinator (out of core, see finder.outofcore) and saved in the work
+directory. A worker reads only its shard spec, the model and the tiles, and
+writes its outputs next to the spec, so shards can also be run on other
+nodes that share the work directory and tile cache:
+
+    python -m finder.shards WORK_DIR/0003_0001/spec.json
+
+The coordinator merges the shards' cores into one raster and candidate set,
+and reruns shards that fail.
+
+Each shard also scores a halo of pixels around its core. Per-pixel scores
+do not depend on it, but it lets shard rasters be post-processed with
+neighbourhood operations (smoothing, windows) without edge effects; the
+merge keeps only the cores.
+
+Layout::
+
+    {work_dir}/model.pkl
+    {work_dir}/{shard_id}/spec.json
+    {work_dir}/{shard_id}/scores.tif         shard window, halo included
+    {work_dir}/{shard_id}/candidates.npz     core candidates (region pixels)
+    {work_dir}/{shard_id}/done.json          shard statistics, written last
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from .cache import MatchCache, OccurrenceCache
+from .ingest import OccurrenceArchive
+from .methods import ClassifierMethod
+from .outofcore import (
+    BAND_MEMORY_FRACTION,
+    DEFAULT_MEMORY_LIMIT_MB,
+    GDAL_CACHE_FRACTION,
+    MAX_CANDIDATE_POINTS,
+    RASTER_BLOCK_SIZE,
+    LargeRegionResult,
+    RegionGrid,
+    peak_rss_mb,
+    train_region,
+    write_candidates,
+)
+from .pipeline import CANDIDATE_THRESHOLD, NEGATIVE_RATIO, save_occurrences
+from .tiles import fit_tile, get_catalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_TILES = 4
+DEFAULT_HALO = 16  # pixels
+DEFAULT_MAX_RETRIES = 2
+
+# Window = (row, col, height, width) in region pixels
+PixelWindow = tuple[int, int, int, int]
+
+
+@dataclass
+class ShardSpec:
+    """Everything a worker needs to score one shard."""
+
+    shard_id: str
+    run_id: str
+    cache_dir: str
+    year: int
+    tile_size: float
+    model_path: str
+    threshold: float
+    memory_limit_mb: float
+    region_transform: list[float]  # first six Affine coefficients
+    tile_shape: list[int]  # (H, W, C) of every tile's slot (see RegionGrid)
+    window: list[int]  # scored window, halo included
+    core: list[int]  # window of the region this shard owns
+    tiles: list[list]  # [ix, iy, region row, region col] of available tiles
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ShardSpec":
+        with open(path) as f:
+            return cls(**json.load(f))
+
+
+def plan_shards(
+    grid: RegionGrid,
+    shard_tiles: int = DEFAULT_SHARD_TILES,
+    halo: int = DEFAULT_HALO,
+) -> list[tuple[str, PixelWindow, PixelWindow, list[list]]]:
+    """
+    Split a region into tile-aligned shards.
+
+    Shards align with the grid's uniform tile slots; tiles of another size
+    are fitted to their slot when a shard is scored (see RegionGrid).
+
+    Args:
+        grid: Region layout
+        shard_tiles: Shard edge in tiles
+        halo: Pixels scored around each shard's core (clamped to the region)
+
+    Returns:
+        List of (shard id, window incl. halo, core window, [ix, iy, row, col]
+        of the available tiles the window touches)
+    """
+    tile_h, tile_w, _ = grid.tile_shape
+    region_h, region_w = grid.shape
+    shards = []
+    for i in range(0, len(grid.rows), shard_tiles):
+        for j in range(0, len(grid.columns), shard_tiles):
+            core_rows = min(shard_tiles, len(grid.rows) - i) * tile_h
+            core_cols = min(shard_tiles, len(grid.columns) - j) * tile_w
+            core = (i * tile_h, j * tile_w, core_rows, core_cols)
+
+            r0, c0 = max(0, core[0] - halo), max(0, core[1] - halo)
+            r1 = min(region_h, core[0] + core_rows + halo)
+            c1 = min(region_w, core[1] + core_cols + halo)
+            window = (r0, c0, r1 - r0, c1 - c0)
+
+            tiles = [
+                [grid.columns[b], grid.rows[a], a * tile_h, b * tile_w]
+                for a in range(r0 // tile_h, -(-r1 // tile_h))
+                for b in range(c0 // tile_w, -(-c1 // tile_w))
+                if (grid.columns[b], grid.rows[a]) in grid.tiles
+            ]
+            shards.append((f"{i // shard_tiles:04d}_{j // shard_tiles:04d}", window, core, tiles))
+    return shards
+
+
+def run_shard(spec_path: Path) -> dict:
+    """
+    Score one shard and write its outputs next to its spec.
+
+    A shard already completed for the same run is not rerun.
+
+    Returns:
+        Shard statistics (also written to done.json)
+    """
+    spec_path = Path(spec_path)
+    shard_dir = spec_path.parent
+    spec = ShardSpec.load(spec_path)
+    done_path = shard_dir / "done.json"
+    if done_path.exists():
+        with open(done_path) as f:
+            done = json.load(f)
+        if done["run_id"] == spec.run_id:
+            return done
+
+    start = time.perf_counter()
+    classifier = ClassifierMethod.load(spec.model_path)
+    catalog = get_catalog(Path(spec.cache_dir), spec.year, spec.tile_size)
+    tile_h, tile_w, n_channels = spec.tile_shape
+    row0, col0, h, w = spec.window
+    core_r0, core_c0, core_h, core_w = spec.core
+
+    # Band height from the memory limit, as in the single-process mode
+    budget = spec.memory_limit_mb * 1024 * 1024 * BAND_MEMORY_FRACTION
+    band_rows = int(max(1, min(h, budget // (w * n_channels * 4 * 2))))
+
+    stats = {"min": np.inf, "max": -np.inf, "n_high": 0, "n_pixels": core_h * core_w}
+    candidate_pixels, candidate_scores = [], []
+
+    raster_path = shard_dir / "scores.tif"
+    tmp_raster_path = shard_dir / f"scores.tmp{os.getpid()}.tif"
+    cache_mb = max(16, int(spec.memory_limit_mb * GDAL_CACHE_FRACTION))
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb), rasterio.open(
+        tmp_raster_path, "w",
+        driver="GTiff",
+        height=h,
+        width=w,
+        count=1,
+        dtype=np.float32,
+        crs="EPSG:4326",
+        transform=Affine(*spec.region_transform) * Affine.translation(col0, row0),
+        tiled=True,
+        blockxsize=RASTER_BLOCK_SIZE,
+        blockysize=RASTER_BLOCK_SIZE,
+        compress="deflate",
+        BIGTIFF="IF_SAFER",
+    ) as dst:
+        for band_start in range(0, h, band_rows):
+            r_lo = row0 + band_start
+            r_hi = min(r_lo + band_rows, row0 + h)
+
+            # Assemble the band from the tiles it crosses; missing tiles
+            # stay empty (zero) as in the stitched mosaic, and tiles of
+            # another size are padded or cropped to their slot
+            band = np.zeros((r_hi - r_lo, w, n_channels), dtype=np.float32)
+            for ix, iy, t_r0, t_c0 in spec.tiles:
+                rr0, rr1 = max(r_lo, t_r0), min(r_hi, t_r0 + tile_h)
+                cc0, cc1 = max(col0, t_c0), min(col0 + w, t_c0 + tile_w)
+                if rr0 >= rr1 or cc0 >= cc1:
+                    continue
+                chunk = fit_tile(
+                    catalog.load_tile((ix, iy), slice(rr0 - t_r0, rr1 - t_r0)), rr1 - rr0, tile_w
+                )
+                band[rr0 - r_lo:rr1 - r_lo, cc0 - col0:cc1 - col0] = chunk[:, cc0 - t_c0:cc1 - t_c0]
+                del chunk
+
+            scores = classifier.predict(band.reshape(-1, n_channels), progress=False)
+            scores = scores.reshape(r_hi - r_lo, w)
+            del band
+            dst.write(scores, 1, window=Window(0, band_start, w, r_hi - r_lo))
+
+            # Statistics and candidates over the core only
+            lo, hi = max(r_lo, core_r0), min(r_hi, core_r0 + core_h)
+            if lo >= hi:
+                continue
+            core_scores = scores[lo - r_lo:hi - r_lo, core_c0 - col0:core_c0 - col0 + core_w]
+            stats["min"] = min(stats["min"], float(core_scores.min()))
+            stats["max"] = max(stats["max"], float(core_scores.max()))
+            high_rows, high_cols = np.nonzero(core_scores >= spec.threshold)
+            stats["n_high"] += len(high_rows)
+            candidate_pixels.append(np.stack([high_rows + lo, high_cols + core_c0], axis=1))
+            candidate_scores.append(core_scores[high_rows, high_cols])
+    os.replace(tmp_raster_path, raster_path)
+
+    np.savez(
+        shard_dir / "candidates.npz",
+        pixels=np.concatenate(candidate_pixels) if candidate_pixels else np.zeros((0, 2), np.int64),
+        scores=np.concatenate(candidate_scores) if candidate_scores else np.zeros(0, np.float32),
+    )
+
+    done = {
+        "run_id": spec.run_id,
+        "shard_id": spec.shard_id,
+        **stats,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+    }
+    tmp_path = shard_dir / "done.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(done, f, indent=2)
+    os.replace(tmp_path, done_path)
+    return done
+
+
+def _init_worker() -> None:
+    """One BLAS/torch thread per worker; the pool provides the parallelism."""
+    import torch
+    torch.set_num_threads(1)
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_shards(
+    spec_paths: list[Path],
+    workers: int,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+) -> tuple[dict[str, dict], int]:
+    """
+    Run shards on a process pool, rerunning failures.
+
+    Failed shards (including those lost when a worker dies) are rerun in a
+    fresh pool, up to max_retries times each.
+
+    Returns:
+        Tuple of (statistics by shard id, number of reruns)
+
+    Raises:
+        RuntimeError: If a shard still fails after max_retries reruns
+    """
+    attempts: Counter = Counter()
+    results: dict[str, dict] = {}
+    pending = list(spec_paths)
+    n_reruns = 0
+
+    while pending:
+        failed = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(run_shard, path): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                shard_id = path.parent.name
+                attempts[path] += 1
+                try:
+                    done = future.result()
+                    results[shard_id] = done
+                    logger.info(
+                        f"  [{len(results)}/{len(spec_paths)}] shard {shard_id}: "
+                        f"{done['seconds']:.1f}s, {done['n_high']:,} candidates"
+                    )
+                except Exception as e:
+                    error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                    logger.warning(f"  Shard {shard_id} failed (attempt {attempts[path]}): {error}")
+                    failed.append(path)
+
+        gave_up = [path.parent.name for path in failed if attempts[path] > max_retries]
+        if gave_up:
+            raise RuntimeError(f"Shards failed after {max_retries} retries: {', '.join(gave_up)}")
+        n_reruns += len(failed)
+        pending = failed
+
+    return results, n_reruns
+
+
+def merge_shards(
+    shard_dirs: list[Path],
+    specs: list[ShardSpec],
+    grid: RegionGrid,
+    path: Path,
+    memory_limit_mb: float,
+) -> None:
+    """Write the cores of the shard rasters into one region raster."""
+    h, w = grid.shape
+    cache_mb = max(16, int(memory_limit_mb * GDAL_CACHE_FRACTION))
+    rows_per_read = RASTER_BLOCK_SIZE * 4
+
+    with rasterio.Env(GDAL_CACHEMAX=cache_mb), rasterio.open(
+        path, "w",
+        driver="GTiff",
+        height=h,
+        width=w,
+        count=1,
+        dtype=np.float32,
+        crs="EPSG:4326",
+        transform=grid.transform,
+        tiled=True,
+        blockxsize=RASTER_BLOCK_SIZE,
+        blockysize=RASTER_BLOCK_SIZE,
+        compress="deflate",
+        BIGTIFF="IF_SAFER",
+    ) as dst:
+        for shard_dir, spec in zip(shard_dirs, specs):
+            row0, col0, _, _ = spec.window
+            core_r0, core_c0, core_h, core_w = spec.core
+            with rasterio.open(shard_dir / "scores.tif") as src:
+                for start in range(0, core_h, rows_per_read):
+                    n_rows = min(rows_per_read, core_h - start)
+                    scores = src.read(1, window=Window(
+                        core_c0 - col0, core_r0 - row0 + start, core_w, n_rows
+                    ))
+                    dst.write(scores, 1, window=Window(core_c0, core_r0 + start, core_w, n_rows))
+
+
+def find_candidates_sharded(
+    species_name: str,
+    bbox: tuple[float, float, float, float],
+    cache_dir: Path,
+    output_dir: Path,
+    work_dir: Optional[Path] = None,
+    workers: int = 4,
+    shard_tiles: int = DEFAULT_SHARD_TILES,
+    halo: int = DEFAULT_HALO,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    negative_ratio: int = NEGATIVE_RATIO,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    match_cache: Optional[MatchCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    dedupe_pixels: bool = False,
+    year: int = 2024,
+    seed: int = 42,
+) -> LargeRegionResult:
+    """
+    Find candidate locations over a large region, scoring shards in parallel.
+
+    Trains once, out of core, as find_candidates_large does, then scores the
+    region shard by shard on `workers` processes and merges the results into
+    the same outputs.
+
+    Args:
+        species_name: Scientific name of the species
+        bbox: Bounding box as (min_lon, min_lat, max_lon, max_lat)
+        cache_dir: Directory containing Tessera embeddings
+        output_dir: Directory for probability.tif, candidates.geojson and
+            occurrences.geojson
+        work_dir: Directory for the model and shard files (default:
+            output_dir / "shards"); must be shared with remote workers
+        workers: Worker processes
+        shard_tiles: Shard edge in tiles
+        halo: Pixels scored around each shard's core
+        max_retries: Reruns allowed per failed shard
+        memory_limit_mb: Memory budget of each process (see
+            find_candidates_large)
+        negative_ratio: Ratio of background samples to occurrences
+        occurrence_cache: Local cache of GBIF occurrence queries
+        match_cache: Persistent memo of GBIF name matches
+        occurrence_archive: Ingested GBIF downloads to read occurrences from
+        dedupe_pixels: Train on one count-weighted positive per distinct
+            occurrence pixel instead of one per occurrence
+        year: Embedding year
+        seed: Random seed for the background and candidate samples
+
+    Returns:
+        LargeRegionResult; its peak RSS is the largest of any process
+    """
+    output_dir = Path(output_dir)
+    work_dir = Path(work_dir) if work_dir else output_dir / "shards"
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    logger.info("=" * 60)
+    logger.info(f"Finding candidates (sharded) for: {species_name}")
+    logger.info("=" * 60)
+
+    trained = train_region(
+        species_name,
+        bbox,
+        cache_dir,
+        memory_limit_mb=memory_limit_mb,
+        negative_ratio=negative_ratio,
+        occurrence_cache=occurrence_cache,
+        match_cache=match_cache,
+        occurrence_archive=occurrence_archive,
+        dedupe_pixels=dedupe_pixels,
+        year=year,
+        seed=seed,
+    )
+    grid = trained.grid
+    model_path = work_dir / "model.pkl"
+    trained.classifier.save(model_path)
+
+    # 4. Score shards on the worker pool
+    shards = plan_shards(grid, shard_tiles, halo)
+    logger.info(
+        f"\n[4/4] Scoring {len(shards)} shards of {shard_tiles}x{shard_tiles} tiles "
+        f"(halo {halo} px) on {workers} workers..."
+    )
+    start = time.perf_counter()
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}"
+    spec_paths, specs = [], []
+    for shard_id, window, core, tiles in shards:
+        spec = ShardSpec(
+            shard_id=shard_id,
+            run_id=run_id,
+            cache_dir=str(Path(cache_dir).resolve()),
+            year=year,
+            tile_size=grid.catalog.tile_size,
+            model_path=str(model_path.resolve()),
+            threshold=CANDIDATE_THRESHOLD,
+            memory_limit_mb=memory_limit_mb,
+            region_transform=list(grid.transform)[:6],
+            tile_shape=list(grid.tile_shape),
+            window=list(window),
+            core=list(core),
+            tiles=tiles,
+        )
+        shard_dir = work_dir / shard_id
+        shard_dir.mkdir(exist_ok=True)
+        spec.save(shard_dir / "spec.json")
+        spec_paths.append(shard_dir / "spec.json")
+        specs.append(spec)
+
+    results, n_reruns = run_shards(spec_paths, workers, max_retries)
+    elapsed = time.perf_counter() - start
+    shard_seconds = sum(r["seconds"] for r in results.values())
+    logger.info(
+        f"  Scored in {elapsed:.1f}s ({shard_seconds:.1f}s of shard time, {n_reruns} reruns)"
+    )
+
+    # Merge
+    raster_path = output_dir / "probability.tif"
+    merge_shards([p.parent for p in spec_paths], specs, grid, raster_path, memory_limit_mb)
+    logger.info(f"Saved probability raster: {raster_path}")
+
+    n_high = sum(r["n_high"] for r in results.values())
+    logger.info(
+        f"  Score range: {min(r['min'] for r in results.values()):.3f} - "
+        f"{max(r['max'] for r in results.values()):.3f}"
+    )
+    logger.info(f"  High probability pixels (>={CANDIDATE_THRESHOLD}): {n_high:,}")
+
+    pixels, scores = [], []
+    for path in spec_paths:
+        with np.load(path.parent / "candidates.npz") as data:
+            pixels.append(data["pixels"])
+            scores.append(data["scores"])
+    pixels, scores = np.concatenate(pixels), np.concatenate(scores)
+    if len(scores) > MAX_CANDIDATE_POINTS:
+        keep = np.random.default_rng(seed).choice(len(scores), MAX_CANDIDATE_POINTS, replace=False)
+        pixels, scores = pixels[keep], scores[keep]
+
+    worker_peak = max(r["peak_rss_mb"] for r in results.values())
+    coordinator_peak = peak_rss_mb()
+    peak = max(coordinator_peak, worker_peak)
+    candidates_path = output_dir / "candidates.geojson"
+    write_candidates(
+        candidates_path,
+        trained,
+        bbox,
+        pixels,
+        scores,
+        n_high,
+        memory={
+            "limit_mb": memory_limit_mb,
+            "peak_rss_mb": round(peak, 1),
+            "coordinator_peak_rss_mb": round(coordinator_peak, 1),
+            "worker_peak_rss_mb": worker_peak,
+        },
+        shards={
+            "n_shards": len(specs),
+            "shard_tiles": shard_tiles,
+            "halo": halo,
+            "workers": workers,
+            "reruns": n_reruns,
+            "seconds": round(elapsed, 1),
+        },
+    )
+    occurrences_path = save_occurrences(output_dir, trained.valid_coords)
+
+    logger.info(
+        f"\n  Peak RSS: {coordinator_peak:,.0f} MB coordinator, {worker_peak:,.0f} MB worker "
+        f"(limit {memory_limit_mb:,.0f} MB)"
+    )
+    if peak > memory_limit_mb:
+        logger.warning("  Peak RSS exceeded the memory limit")
+
+    logger.info("\n" + "=" * 60)
+    logger.info("COMPLETE")
+    logger.info("=" * 60)
+
+    return LargeRegionResult(
+        species_name=trained.species_info["canonical_name"],
+        taxon_key=trained.species_info["taxon_key"],
+        n_occurrences=len(trained.valid_coords),
+        n_background=trained.n_background,
+        n_candidates=n_high,
+        shape=grid.shape,
+        transform=grid.transform,
+        bbox=bbox,
+        memory_limit_mb=memory_limit_mb,
+        peak_rss_mb=peak,
+        paths={
+            "raster": raster_path,
+            "candidates": candidates_path,
+            "occurrences": occurrences_path,
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score shards from their spec files")
+    parser.add_argument("specs", nargs="+", help="spec.json files written by the coordinator")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for path in args.specs:
+        done = run_shard(Path(path))
+        logger.info(f"{done['shard_id']}: {done['seconds']:.1f}s, {done['n_high']:,} candidates")
+
+
+if __name__ == "__main__":
+    main()
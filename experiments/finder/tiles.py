@@ -0,0 +1,342 @@
+"""
+Catalog of the Tessera embedding tiles in the cache.
+
+Tiles live in `{cache_dir}/{year}/grid_{lon:.2f}_{lat:.2f}/` and are
+identified here by integer grid indices, so lookups never depend on float
+formatting of the tile coordinates. The catalog is built once by listing the
+year directory, saved as a manifest next to it, and rebuilt when the
+directory changes.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .instrument import count
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 0.1  # degrees
+
+TILE_NAME = re.compile(r"^grid_(-?\d+\.\d+)_(-?\d+\.\d+)$")
+
+# Tolerance when converting coordinates to grid indices, so values such as
+# 0.15000000000000002 land in the intended cell
+INDEX_EPSILON = 1e-9
+
+TileIndex = tuple[int, int]
+
+
+def tile_name(tile_lon: float, tile_lat: float) -> str:
+    """Directory and file stem of the tile at (tile_lon, tile_lat)."""
+    return f"grid_{tile_lon:.2f}_{tile_lat:.2f}"
+
+
+def fit_tile(tile: np.ndarray, height: int, width: int, fill: float = 0.0) -> np.ndarray:
+    """
+    Fit (rows of) a tile to a tile slot of height x width pixels.
+
+    Tiles vary slightly in size; like EmbeddingMosaic, a tile fills its slot
+    from the top-left corner, missing rows and columns are empty (`fill`)
+    and extra ones are cropped. Returns the array itself if it already fits.
+    """
+    h, w = tile.shape[:2]
+    if (h, w) == (height, width):
+        return tile
+    fitted = np.full((height, width, *tile.shape[2:]), fill, dtype=tile.dtype)
+    rows, cols = min(h, height), min(w, width)
+    fitted[:rows, :cols] = tile[:rows, :cols]
+    return fitted
+
+
+class TileCatalog:
+    """
+    In-memory index of the tiles available for one year.
+
+    Tile (ix, iy) is named by (ix * tile_size - tile_size / 2,
+    iy * tile_size - tile_size / 2), the convention used by the downloader.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        year: int = 2024,
+        tile_size: float = TILE_SIZE,
+        tiles: Optional[dict[TileIndex, str]] = None,
+    ):
+        """
+        Args:
+            cache_dir: Directory containing year subdirectories with tiles
+            year: Year of embeddings
+            tile_size: Size of each tile in degrees
+            tiles: Mapping of grid index to tile name (None = empty)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.year = year
+        self.tile_size = tile_size
+        self.tiles: dict[TileIndex, str] = dict(tiles or {})
+
+    @property
+    def year_dir(self) -> Path:
+        return self.cache_dir / str(self.year)
+
+    @property
+    def manifest_path(self) -> Path:
+        # Kept outside the year directory so writing it does not change the
+        # directory's mtime, which is what marks the manifest stale
+        return self.cache_dir / f"tiles_{self.year}.json"
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    def __contains__(self, index: TileIndex) -> bool:
+        return index in self.tiles
+
+    # Grid arithmetic
+
+    def _to_index(self, value: float) -> int:
+        return math.floor((value + self.tile_size / 2) / self.tile_size + INDEX_EPSILON)
+
+    def index_of(self, lon: float, lat: float) -> TileIndex:
+        """Grid index of the tile a point falls in."""
+        return self._to_index(lon), self._to_index(lat)
+
+    def index_of_tile(self, tile_lon: float, tile_lat: float) -> TileIndex:
+        """Grid index of the tile named by (tile_lon, tile_lat)."""
+        half_step = self.tile_size / 2
+        return (
+            round((tile_lon + half_step) / self.tile_size),
+            round((tile_lat + half_step) / self.tile_size),
+        )
+
+    def tile_coords(self, index: TileIndex) -> tuple[float, float]:
+        """(tile_lon, tile_lat) naming a tile, rounded as in its name."""
+        half_step = self.tile_size / 2
+        ix, iy = index
+        return round(ix * self.tile_size - half_step, 2), round(iy * self.tile_size - half_step, 2)
+
+    def grid_range(
+        self,
+        bbox: tuple[float, float, float, float],
+    ) -> tuple[range, range]:
+        """
+        Grid indices (x range, y range) loaded for a bbox.
+
+        Starts at the tile containing the bbox's south-west corner and
+        extends to the last tile starting before max + tile_size, matching
+        the grid EmbeddingMosaic has always stitched.
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        half_step = self.tile_size / 2
+
+        def stop(value: float) -> int:
+            return math.ceil((value + self.tile_size + half_step) / self.tile_size - INDEX_EPSILON)
+
+        return (
+            range(self._to_index(min_lon), stop(max_lon)),
+            range(self._to_index(min_lat), stop(max_lat)),
+        )
+
+    # Lookup
+
+    def path(self, index: TileIndex) -> Optional[Path]:
+        """Directory of an available tile (None if the tile is not cached)."""
+        name = self.tiles.get(index)
+        return self.year_dir / name if name is not None else None
+
+    def find(self, lon: float, lat: float) -> Optional[TileIndex]:
+        """Index of the available tile containing a point (None if not cached)."""
+        index = self.index_of(lon, lat)
+        return index if index in self.tiles else None
+
+    def tiles_in_bbox(self, bbox: tuple[float, float, float, float]) -> list[TileIndex]:
+        """Available tiles in a bbox's grid range, in row-major (x, y) order."""
+        xs, ys = self.grid_range(bbox)
+        if len(xs) * len(ys) > len(self.tiles):
+            return sorted(
+                index for index in self.tiles
+                if index[0] in xs and index[1] in ys
+            )
+        return [(ix, iy) for ix in xs for iy in ys if (ix, iy) in self.tiles]
+
+    def coverage(self, bbox: tuple[float, float, float, float]) -> dict:
+        """
+        How much of a bbox's tile grid is cached.
+
+        Returns:
+            Dict with n_tiles (grid cells), n_available, fraction and the
+            (tile_lon, tile_lat) of missing tiles
+        """
+        xs, ys = self.grid_range(bbox)
+        available = set(self.tiles_in_bbox(bbox))
+        missing = [
+            self.tile_coords((ix, iy))
+            for ix in xs for iy in ys
+            if (ix, iy) not in available
+        ]
+        n_tiles = len(xs) * len(ys)
+        return {
+            "n_tiles": n_tiles,
+            "n_available": len(available),
+            "fraction": len(available) / n_tiles if n_tiles else 0.0,
+            "missing": missing,
+        }
+
+    def stats(self) -> dict:
+        """Tile count and the extent of the cached tiles."""
+        if not self.tiles:
+            return {"year": self.year, "n_tiles": 0, "bbox": None}
+        xs = [ix for ix, _ in self.tiles]
+        ys = [iy for _, iy in self.tiles]
+        min_lon, min_lat = self.tile_coords((min(xs), min(ys)))
+        max_lon, max_lat = self.tile_coords((max(xs), max(ys)))
+        return {
+            "year": self.year,
+            "n_tiles": len(self.tiles),
+            "bbox": [min_lon, min_lat, max_lon + self.tile_size, max_lat + self.tile_size],
+        }
+
+    def _tile_file(self, index: TileIndex) -> Path:
+        tile_dir = self.path(index)
+        if tile_dir is None:
+            raise KeyError(f"Tile {self.tile_coords(index)} is not in the catalog")
+        return tile_dir / f"{tile_dir.name}.npy"
+
+    def tile_shape(self, index: TileIndex) -> tuple[int, int, int]:
+        """(H, W, C) of an available tile, read from the file header only."""
+        return np.load(self._tile_file(index), mmap_mode="r").shape
+
+    def load_tile(self, index: TileIndex, rows: Optional[slice] = None) -> np.ndarray:
+        """
+        Load and dequantize an available tile as float32 (H, W, C).
+
+        Args:
+            index: Grid index of the tile
+            rows: Only read these rows (the file is memory-mapped, so the
+                rest is never read)
+        """
+        path = self._tile_file(index)
+        if rows is None:
+            data = np.load(path).astype(np.float32)
+            scales = np.load(path.with_name(f"{path.stem}_scales.npy"))
+            count("tiles_loaded")
+        else:
+            data = np.load(path, mmap_mode="r")[rows].astype(np.float32)
+            scales = np.load(path.with_name(f"{path.stem}_scales.npy"), mmap_mode="r")[rows]
+            count("tile_bands_loaded")
+        return data * scales[:, :, np.newaxis]
+
+    # Building and persistence
+
+    @classmethod
+    def scan(
+        cls,
+        cache_dir: Path,
+        year: int = 2024,
+        tile_size: float = TILE_SIZE,
+    ) -> "TileCatalog":
+        """Build a catalog by listing the year directory."""
+        catalog = cls(cache_dir, year, tile_size)
+        if not catalog.year_dir.is_dir():
+            return catalog
+
+        for entry in os.scandir(catalog.year_dir):
+            match = TILE_NAME.match(entry.name)
+            if match is None or not entry.is_dir():
+                continue
+            files = set(os.listdir(entry.path))
+            if f"{entry.name}.npy" not in files or f"{entry.name}_scales.npy" not in files:
+                continue
+            index = catalog.index_of_tile(float(match.group(1)), float(match.group(2)))
+            catalog.tiles[index] = entry.name
+        return catalog
+
+    def save(self, dir_mtime_ns: int) -> None:
+        """Write the manifest, recording the year directory mtime it reflects."""
+        manifest = {
+            "year": self.year,
+            "tile_size": self.tile_size,
+            "dir_mtime_ns": dir_mtime_ns,
+            "built": datetime.now(timezone.utc).isoformat(),
+            "tiles": [[ix, iy, name] for (ix, iy), name in sorted(self.tiles.items())],
+        }
+        tmp_path = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @classmethod
+    def open(
+        cls,
+        cache_dir: Path,
+        year: int = 2024,
+        tile_size: float = TILE_SIZE,
+    ) -> "TileCatalog":
+        """
+        Load the saved manifest, or rebuild it if the year directory changed.
+
+        A manifest that cannot be written (e.g. read-only cache) is only
+        kept in memory.
+        """
+        catalog = cls(cache_dir, year, tile_size)
+        try:
+            dir_mtime_ns = catalog.year_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return catalog
+
+        try:
+            with open(catalog.manifest_path) as f:
+                manifest = json.load(f)
+            if (
+                manifest["dir_mtime_ns"] == dir_mtime_ns
+                and manifest["tile_size"] == tile_size
+            ):
+                catalog.tiles = {(ix, iy): name for ix, iy, name in manifest["tiles"]}
+                return catalog
+        except (OSError, ValueError, KeyError):
+            pass
+
+        catalog = cls.scan(cache_dir, year, tile_size)
+        try:
+            catalog.save(dir_mtime_ns)
+        except OSError as e:
+            logger.warning(f"Could not write tile manifest {catalog.manifest_path}: {e}")
+        return catalog
+
+
+_catalogs: dict[tuple[Path, int, float], tuple[int, TileCatalog]] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(
+    cache_dir: Path,
+    year: int = 2024,
+    tile_size: float = TILE_SIZE,
+) -> TileCatalog:
+    """
+    Shared catalog for a cache directory and year.
+
+    Catalogs are kept per process and reopened only when the year
+    directory's mtime changes, so repeated lookups cost a single stat.
+    """
+    key = (Path(cache_dir).resolve(), year, tile_size)
+    try:
+        dir_mtime_ns = (key[0] / str(year)).stat().st_mtime_ns
+    except FileNotFoundError:
+        dir_mtime_ns = -1
+
+    with _catalogs_lock:
+        cached = _catalogs.get(key)
+        if cached is not None and cached[0] == dir_mtime_ns:
+            return cached[1]
+        catalog = TileCatalog.open(cache_dir, year, tile_size)
+        _catalogs[key] = (dir_mtime_ns, catalog)
+        return catalog
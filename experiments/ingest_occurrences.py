@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Ingest GBIF download archives into the local columnar occurrence store.
+
+Accepts downloads made with downloader/download-gbif-occurrences.ts (DWCA
+or SIMPLE_CSV, zipped or extracted). Queries for a taxon inside the extent
+a download covers in full are then answered by run.py, train_models.py,
+experiment.py and train_catalog.py from the store instead of by paging the
+GBIF API. The extent comes from the download's predicate, read from the
+.request.json the downloader saves next to it (or --predicate); only
+downloads filtered by bbox, not by country, cover one.
+
+Usage:
+    uv run python ingest_occurrences.py ../downloader/data/gbif-occurrences-plantae-bbox-*.zip
+    uv run python ingest_occurrences.py download.zip --predicate request.json
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from finder.ingest import CHUNK_ROWS, FLUSH_ROWS, OccurrenceArchive, ingest_archive
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent
+CACHE_DIR = PROJECT_ROOT / "cache"
+OCCURRENCE_ARCHIVE_DIR = CACHE_DIR / "gbif" / "archive"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest GBIF download archives")
+    parser.add_argument("archives", nargs="+", help="Download files (.zip, occurrence.txt or .csv)")
+    parser.add_argument("--store", default=str(OCCURRENCE_ARCHIVE_DIR), help="Destination store")
+    parser.add_argument("--taxon-column", default="speciesKey",
+                        help="Column to partition by (default: speciesKey)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows parsed per chunk")
+    parser.add_argument("--flush-rows", type=int, default=FLUSH_ROWS,
+                        help="Buffered records before partitions are written")
+    parser.add_argument("--predicate",
+                        help="JSON file with the download's predicate (or whole request)")
+    parser.add_argument("--extent", metavar="MIN_LON,MIN_LAT,MAX_LON,MAX_LAT",
+                        help="Extent the downloads hold every record of, overriding the predicate")
+    args = parser.parse_args()
+
+    predicate = None
+    if args.predicate:
+        with open(args.predicate) as f:
+            request = json.load(f)
+        predicate = request.get("predicate", request)
+    extent = None
+    if args.extent:
+        extent = tuple(float(v) for v in args.extent.split(","))
+        if len(extent) != 4:
+            parser.error("--extent needs four comma-separated numbers")
+
+    store = OccurrenceArchive(Path(args.store))
+    for path in args.archives:
+        logger.info(f"Ingesting {path}...")
+        stats = ingest_archive(
+            Path(path),
+            store,
+            taxon_column=args.taxon_column,
+            chunk_rows=args.chunk_rows,
+            flush_rows=args.flush_rows,
+            predicate=predicate,
+            extent=extent,
+        )
+        logger.info(
+            f"  {stats['records_kept']:,}/{stats['rows_read']:,} records kept, "
+            f"{stats['taxa']:,} taxa, {stats['partitions']:,} partitions, "
+            f"covered extent {stats['extent']}"
+        )
+
+    logger.info(f"Store: {store.root} ({len(store.taxa()):,} taxa)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,31 +3,49 @@
 Predict habitat suitability for a species in a local area around a point.
 
 Uses pre-trained classifier models for fast predictions.
-Only loads the single tile containing the point (not the full mosaic).
+Only loads the tile containing the point, plus any neighbours the window
+crosses (not the full mosaic).
 
 Supports two model types:
 1. logistic - Logistic Regression (fast, no uncertainty)
 2. mlp - MLP with MC Dropout (provides uncertainty estimates)
+
+Many points (and species) can be predicted in one call with --batch or
+predict_local_batch, which loads each tile and model once.
+
+With --score-cache (or a TileScoreCache passed to predict_local_batch), the
+first window in a tile scores the whole tile and later windows in it are
+slices of the cached scores (kept in memory and spilled to cache/scores/).
 """
 
 import argparse
 import json
 import sys
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Literal, Optional, Union
 
 import numpy as np
 import rasterio
 
+from finder.features import parse_region_key
+from finder.instrument import annotate, count, span, traced, tracing
 from finder.methods import ClassifierMethod, MLPClassifierMethod
+from finder.scorecache import DEFAULT_MAX_MB, ScoreKey, TileScoreCache, TileScores
+from finder.tiles import TileCatalog, fit_tile, get_catalog
 
 PROJECT_ROOT = Path(__file__).parent
 CACHE_DIR = PROJECT_ROOT / "cache"
 MODELS_DIR = PROJECT_ROOT / "models"
+SCORE_CACHE_DIR = CACHE_DIR / "scores"
 
 YEAR = 2024
 TILE_SIZE = 0.1  # degrees
 
+# Tiles kept in memory while windows are stitched (a tile and its neighbours)
+MAX_OPEN_TILES = 9
+
 ModelType = Literal["logistic", "mlp"]
 
 
@@ -38,30 +56,24 @@ def meters_to_degrees(meters: float, lat: float) -> tuple[float, float]:
     return lon_deg, lat_deg
 
 
-def get_tile_coords(lon: float, lat: float) -> tuple[float, float]:
-    """Get the tile center coordinates for a given point."""
-    # Tiles are named by their center, offset by half step
-    # Formula from EmbeddingMosaic: floor((coord + half_step) / step) * step - half_step
-    half_step = TILE_SIZE / 2
-    tile_lon = np.floor((lon + half_step) / TILE_SIZE) * TILE_SIZE - half_step
-    tile_lat = np.floor((lat + half_step) / TILE_SIZE) * TILE_SIZE - half_step
-    return round(tile_lon, 2), round(tile_lat, 2)
+def get_tile_coords(lon: float, lat: float, cache_dir: Path = CACHE_DIR) -> tuple[float, float]:
+    """Get the tile coordinates (as in its name) for a given point."""
+    catalog = get_catalog(cache_dir, YEAR, TILE_SIZE)
+    return catalog.tile_coords(catalog.index_of(lon, lat))
 
 
-def load_single_tile(tile_lon: float, tile_lat: float) -> tuple[np.ndarray, rasterio.Affine] | None:
+def load_single_tile(
+    tile_lon: float,
+    tile_lat: float,
+    cache_dir: Path = CACHE_DIR,
+) -> tuple[np.ndarray, rasterio.Affine] | None:
     """Load a single embedding tile. Returns (embeddings, transform) or None."""
-    tile_dir = CACHE_DIR / str(YEAR)
-    name = f"grid_{tile_lon:.2f}_{tile_lat:.2f}"
-    npy_path = tile_dir / name / f"{name}.npy"
-    scales_path = tile_dir / name / f"{name}_scales.npy"
-
-    if not npy_path.exists() or not scales_path.exists():
+    catalog = get_catalog(cache_dir, YEAR, TILE_SIZE)
+    index = catalog.index_of_tile(tile_lon, tile_lat)
+    if index not in catalog:
         return None
 
-    # Load and dequantize
-    data = np.load(npy_path).astype(np.float32)
-    scales = np.load(scales_path)
-    embeddings = data * scales[:, :, np.newaxis]
+    embeddings = catalog.load_tile(index)
 
     # Create transform for this tile
     h, w = embeddings.shape[:2]
@@ -72,6 +84,479 @@ def load_single_tile(tile_lon: float, tile_lat: float) -> tuple[np.ndarray, rast
     return embeddings, transform
 
 
+@dataclass
+class LocalQuery:
+    """One point to predict around."""
+
+    lat: float
+    lon: float
+    species_key: int
+    grid_size_m: int = 100
+    model_type: ModelType = "mlp"
+
+
+def region_model_dirs(
+    models_dir: Path = MODELS_DIR,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+) -> list[Path]:
+    """
+    Per-region model directories (see train_models.region_models_dir).
+
+    Only regions of YEAR containing the point are listed when one is
+    given; the smallest region comes first.
+    """
+    models_dir = Path(models_dir)
+    if not models_dir.is_dir():
+        return []
+    regions = []
+    for path in models_dir.iterdir():
+        parsed = parse_region_key(path.name)
+        if not path.is_dir() or parsed is None or parsed[1] != YEAR:
+            continue
+        min_lon, min_lat, max_lon, max_lat = parsed[0]
+        if lon is not None and not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            continue
+        regions.append(((max_lon - min_lon) * (max_lat - min_lat), path.name, path))
+    return [path for *_, path in sorted(regions)]
+
+
+def model_path(
+    species_key: int,
+    model_type: ModelType,
+    models_dir: Path = MODELS_DIR,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+) -> Path:
+    """
+    Path of the pre-trained classifier for a species.
+
+    Models trained on a region containing the point (or on any region, if no
+    point is given) take precedence over models saved directly in models_dir.
+    """
+    models_dir = Path(models_dir)
+    filename = f"{species_key}.pkl" if model_type == "logistic" else f"{species_key}.pt"
+    for directory in [*region_model_dirs(models_dir, lon, lat), models_dir]:
+        path = directory / model_type / filename
+        if path.exists():
+            return path
+
+    if model_type == "logistic":
+        # Fall back to old location for backward compatibility
+        path = models_dir / filename
+        if not path.exists():
+            raise ValueError(f"No logistic model for species key {species_key}. Run train_models.py first.")
+        return path
+    raise ValueError(f"No MLP model for species key {species_key}. Run train_models.py --model-type mlp first.")
+
+
+def load_model_file(path: Path, model_type: ModelType) -> Union[ClassifierMethod, MLPClassifierMethod]:
+    """Load a pre-trained classifier saved at path."""
+    if model_type == "logistic":
+        return ClassifierMethod.load(path)
+    return MLPClassifierMethod.load(path)
+
+
+def load_model(
+    species_key: int,
+    model_type: ModelType,
+    models_dir: Path = MODELS_DIR,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+) -> Union[ClassifierMethod, MLPClassifierMethod]:
+    """Load the pre-trained classifier for a species (around a point, if given)."""
+    return load_model_file(model_path(species_key, model_type, models_dir, lon, lat), model_type)
+
+
+class TileReader:
+    """Loads tiles by grid index, keeping the most recently used ones in memory."""
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_tiles: int = MAX_OPEN_TILES):
+        self.cache_dir = cache_dir
+        self.catalog = get_catalog(cache_dir, YEAR, TILE_SIZE)
+        self.max_tiles = max_tiles
+        self._tiles: OrderedDict[tuple[int, int], Optional[tuple[np.ndarray, rasterio.Affine]]] = OrderedDict()
+
+    def get(self, index: tuple[int, int]) -> Optional[tuple[np.ndarray, rasterio.Affine]]:
+        """(embeddings, transform) of a tile, or None if it is not cached."""
+        if index in self._tiles:
+            self._tiles.move_to_end(index)
+            return self._tiles[index]
+        tile = load_single_tile(*self.catalog.tile_coords(index), self.cache_dir)
+        self._tiles[index] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+
+def tile_grid(catalog: TileCatalog, index: tuple[int, int]) -> tuple[int, int, rasterio.Affine]:
+    """(height, width, transform) of an available tile, without loading it."""
+    h, w, _ = catalog.tile_shape(index)
+    tile_lon, tile_lat = catalog.tile_coords(index)
+    transform = rasterio.transform.from_bounds(
+        tile_lon, tile_lat, tile_lon + TILE_SIZE, tile_lat + TILE_SIZE, w, h
+    )
+    return h, w, transform
+
+
+def _window_pieces(
+    transform: rasterio.Affine,
+    h: int,
+    w: int,
+    lat: float,
+    lon: float,
+    grid_size_m: int,
+):
+    """
+    Lay out a window around a point on a tile's pixel grid.
+
+    Returns:
+        Tuple of ((min_row, min_col), (rows, cols) window shape, pieces),
+        where pieces lists (tile_row, tile_col, tile slices, window slices)
+        for every tile the window overlaps, relative to this one (rows run
+        south, so tile rows below this one have smaller y indices)
+    """
+    # Calculate grid bounds in degrees
+    lon_offset, lat_offset = meters_to_degrees(grid_size_m / 2, lat)
+
+    # Window corners in pixels of this tile (may fall outside it)
+    min_row, min_col = rasterio.transform.rowcol(transform, lon - lon_offset, lat + lat_offset)
+    max_row, max_col = rasterio.transform.rowcol(transform, lon + lon_offset, lat - lat_offset)
+
+    pieces = []
+    for tile_row in range(min_row // h, max_row // h + 1):
+        for tile_col in range(min_col // w, max_col // w + 1):
+            r0, r1 = max(min_row, tile_row * h), min(max_row + 1, (tile_row + 1) * h)
+            c0, c1 = max(min_col, tile_col * w), min(max_col + 1, (tile_col + 1) * w)
+            pieces.append((
+                tile_row,
+                tile_col,
+                (slice(r0 - tile_row * h, r1 - tile_row * h), slice(c0 - tile_col * w, c1 - tile_col * w)),
+                (slice(r0 - min_row, r1 - min_row), slice(c0 - min_col, c1 - min_col)),
+            ))
+    shape = (max_row - min_row + 1, max_col - min_col + 1)
+    return (min_row, min_col), shape, pieces
+
+
+def nonempty_mask(embeddings: np.ndarray) -> np.ndarray:
+    """Pixels of an (..., C) array holding data (empty pixels have all channels ~0)."""
+    return np.any(np.abs(embeddings) > 1e-8, axis=-1)
+
+
+def extract_window(
+    reader: TileReader,
+    index: tuple[int, int],
+    lat: float,
+    lon: float,
+    grid_size_m: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Non-empty pixels within a square window around a point.
+
+    The window is laid out on the pixel grid of the tile containing the
+    point (`index`) and stitched from neighbouring tiles where it crosses
+    tile borders; parts over missing tiles are left out. Neighbours of a
+    different size are fitted to this tile's size first, as the stitched
+    mosaic pads or crops them.
+
+    Returns:
+        Tuple of (embeddings (N, C), pixel centre longitudes (N,),
+        pixel centre latitudes (N,)), in row-major window order
+    """
+    embeddings, transform = reader.get(index)
+    h, w, c = embeddings.shape
+    ix, iy = index
+
+    # Stitch the window from every tile it overlaps
+    (min_row, min_col), shape, pieces = _window_pieces(transform, h, w, lat, lon, grid_size_m)
+    window = np.zeros((*shape, c), dtype=np.float32)
+    for tile_row, tile_col, tile_slices, window_slices in pieces:
+        if (tile_row, tile_col) == (0, 0):
+            tile = embeddings
+        else:
+            neighbour = reader.get((ix + tile_col, iy - tile_row))
+            if neighbour is None:
+                continue
+            tile = fit_tile(neighbour[0], h, w)
+        window[window_slices] = tile[tile_slices]
+
+    rows, cols = np.nonzero(nonempty_mask(window))
+    lons, lats = transform * (cols + min_col + 0.5, rows + min_row + 0.5)
+    return window[rows, cols], np.asarray(lons), np.asarray(lats)
+
+
+def score_tile(
+    model: Union[ClassifierMethod, MLPClassifierMethod],
+    embeddings: np.ndarray,
+    n_mc_samples: Optional[int],
+) -> TileScores:
+    """
+    Score every non-empty pixel of an (H, W, C) tile.
+
+    Args:
+        model: Classifier to score with
+        embeddings: The tile
+        n_mc_samples: Number of MC Dropout samples, or None for a model
+            without uncertainty
+
+    Returns:
+        TileScores with NaN at empty pixels
+    """
+    valid = nonempty_mask(embeddings)
+    scores = np.full(valid.shape, np.nan, dtype=np.float32)
+    uncertainties = None
+    pixels = embeddings[valid]
+    if n_mc_samples is not None:
+        uncertainties = np.full(valid.shape, np.nan, dtype=np.float32)
+        if len(pixels):
+            scores[valid], uncertainties[valid] = model.predict_with_uncertainty(pixels, n_samples=n_mc_samples)
+    elif len(pixels):
+        scores[valid] = model.predict(pixels, progress=False)
+    return TileScores(scores, uncertainties)
+
+
+def extract_window_scores(
+    catalog: TileCatalog,
+    index: tuple[int, int],
+    lat: float,
+    lon: float,
+    grid_size_m: int,
+    tile_scores: Callable[[tuple[int, int]], Optional[TileScores]],
+) -> tuple[np.ndarray, Optional[np.ndarray], np.ndarray, np.ndarray]:
+    """
+    Scores of the non-empty pixels within a square window around a point.
+
+    Same window as extract_window, sliced from full-tile scores instead
+    of scored pixel by pixel.
+
+    Args:
+        catalog: Tile catalog
+        index: Grid index of the tile containing the point
+        lat: Center latitude
+        lon: Center longitude
+        grid_size_m: Window size in meters
+        tile_scores: Full-tile scores of a tile index, or None if the tile
+            is missing
+
+    Returns:
+        Tuple of (scores (N,), uncertainties (N,) or None, pixel centre
+        longitudes (N,), pixel centre latitudes (N,)), in row-major window order
+    """
+    h, w, transform = tile_grid(catalog, index)
+    ix, iy = index
+
+    (min_row, min_col), shape, pieces = _window_pieces(transform, h, w, lat, lon, grid_size_m)
+    scores = np.full(shape, np.nan, dtype=np.float32)
+    uncertainties = None
+    for tile_row, tile_col, tile_slices, window_slices in pieces:
+        entry = tile_scores((ix + tile_col, iy - tile_row))
+        if entry is None:
+            continue
+        # Neighbours of another size fill their slot as in extract_window
+        scores[window_slices] = fit_tile(entry.scores, h, w, np.nan)[tile_slices]
+        if entry.uncertainties is not None:
+            if uncertainties is None:
+                uncertainties = np.full(shape, np.nan, dtype=np.float32)
+            uncertainties[window_slices] = fit_tile(entry.uncertainties, h, w, np.nan)[tile_slices]
+
+    rows, cols = np.nonzero(~np.isnan(scores))
+    lons, lats = transform * (cols + min_col + 0.5, rows + min_row + 0.5)
+    return (
+        scores[rows, cols],
+        uncertainties[rows, cols] if uncertainties is not None else None,
+        np.asarray(lons),
+        np.asarray(lats),
+    )
+
+
+def _predictions(
+    lons: np.ndarray,
+    lats: np.ndarray,
+    scores: np.ndarray,
+    uncertainties: Optional[np.ndarray],
+) -> list[dict]:
+    """Per-pixel prediction dicts."""
+    lons, lats, scores = lons.tolist(), lats.tolist(), np.asarray(scores, dtype=np.float64).tolist()
+    if uncertainties is None:
+        # Logistic regression - no uncertainty
+        return [
+            {"lon": px_lon, "lat": px_lat, "score": score}
+            for px_lon, px_lat, score in zip(lons, lats, scores)
+        ]
+
+    # MLP with MC Dropout - score and uncertainty. Uncertainty is converted to
+    # confidence (1 - normalized uncertainty); it is typically 0-0.5, so it is
+    # normalized and inverted
+    uncertainties = np.asarray(uncertainties, dtype=np.float64)
+    confidences = (1.0 - np.minimum(uncertainties * 2, 1.0)).tolist()
+    return [
+        {
+            "lon": px_lon,
+            "lat": px_lat,
+            "score": score,
+            "uncertainty": uncertainty,
+            "confidence": confidence,
+        }
+        for px_lon, px_lat, score, uncertainty, confidence in zip(
+            lons, lats, scores, uncertainties.tolist(), confidences
+        )
+    ]
+
+
+@traced("predict_local_batch")
+def predict_local_batch(
+    queries: list[LocalQuery],
+    n_mc_samples: int = 30,
+    cache_dir: Path = CACHE_DIR,
+    models_dir: Path = MODELS_DIR,
+    score_cache: Optional[TileScoreCache] = None,
+) -> list[dict]:
+    """
+    Predictions around many points, for any mix of species and model types.
+
+    Each model and each tile is loaded once. Queries are grouped by tile and
+    then by model, and all windows of a group are scored in one call (for
+    the MLP, one set of MC Dropout passes over all of them).
+
+    With a score cache, windows are instead sliced from full-tile scores,
+    which are computed (for every tile a window touches) on a cache miss.
+    A miss costs a whole tile, so this pays off when windows repeat or
+    cluster, e.g. in a long-lived process or with the disk spill.
+
+    Args:
+        queries: Points to predict around
+        n_mc_samples: Number of MC Dropout samples (only used for mlp)
+        cache_dir: Directory containing Tessera embeddings
+        models_dir: Directory containing trained models
+        score_cache: Cache of full-tile scores to read from and add to
+
+    Returns:
+        One result per query, in input order, as returned by predict_local
+
+    Raises:
+        ValueError: If a model is missing (checked before any scoring)
+    """
+    catalog = get_catalog(cache_dir, YEAR, TILE_SIZE)
+    # Each query uses the model of the smallest trained region containing it
+    query_models = [
+        (model_path(q.species_key, q.model_type, models_dir, q.lon, q.lat), q.model_type)
+        for q in queries
+    ]
+    model_keys = list(dict.fromkeys(query_models))
+    # Model file mtimes version the cached scores
+    model_versions = {key: key[0].stat().st_mtime_ns for key in model_keys}
+    with span("load_models"):
+        models = {key: load_model_file(*key) for key in model_keys}
+    count("queries", len(queries))
+
+    by_tile: dict[tuple[int, int], list[int]] = defaultdict(list)
+    for i, q in enumerate(queries):
+        by_tile[catalog.index_of(q.lon, q.lat)].append(i)
+
+    reader = TileReader(cache_dir)
+    results: list[Optional[dict]] = [None] * len(queries)
+    for index in sorted(by_tile):
+        members = by_tile[index]
+        tile_lon, tile_lat = catalog.tile_coords(index)
+
+        if index not in catalog:
+            for i in members:
+                q = queries[i]
+                results[i] = {
+                    "predictions": [],
+                    "species_key": q.species_key,
+                    "model_type": q.model_type,
+                    "center": {"lon": q.lon, "lat": q.lat},
+                    "grid_size_m": q.grid_size_m,
+                    "n_pixels": 0,
+                    "error": f"No tile data at {tile_lon}, {tile_lat}",
+                }
+            continue
+
+        if score_cache is not None:
+            for i in members:
+                q = queries[i]
+                model_key = query_models[i]
+                mc_samples = n_mc_samples if q.model_type == "mlp" else None
+
+                def tile_scores(tile: tuple[int, int]) -> Optional[TileScores]:
+                    if tile not in catalog:
+                        return None
+                    key = ScoreKey(
+                        q.species_key, q.model_type, tile, YEAR, mc_samples or 0, model_versions[model_key]
+                    )
+                    entry = score_cache.get(key)
+                    if entry is None:
+                        entry = score_tile(models[model_key], reader.get(tile)[0], mc_samples)
+                        score_cache.put(key, entry)
+                    return entry
+
+                scores, uncertainties, lons, lats = extract_window_scores(
+                    catalog, index, q.lat, q.lon, q.grid_size_m, tile_scores
+                )
+                predictions = _predictions(lons, lats, scores, uncertainties)
+                count("predicted_pixels", len(predictions))
+                results[i] = {
+                    "predictions": predictions,
+                    "species_key": q.species_key,
+                    "model_type": q.model_type,
+                    "has_uncertainty": mc_samples is not None,
+                    "center": {"lon": q.lon, "lat": q.lat},
+                    "grid_size_m": q.grid_size_m,
+                    "n_pixels": len(predictions),
+                }
+            continue
+
+        windows = {
+            i: extract_window(reader, index, queries[i].lat, queries[i].lon, queries[i].grid_size_m)
+            for i in members
+        }
+
+        by_model: dict[tuple[Path, str], list[int]] = defaultdict(list)
+        for i in members:
+            by_model[query_models[i]].append(i)
+
+        for model_key, group in by_model.items():
+            model_type = model_key[1]
+            has_uncertainty = model_type == "mlp"
+            batch = np.concatenate([windows[i][0] for i in group])
+            scores, uncertainties = np.zeros(0), None
+            if len(batch):
+                if has_uncertainty:
+                    scores, uncertainties = models[model_key].predict_with_uncertainty(
+                        batch, n_samples=n_mc_samples
+                    )
+                else:
+                    scores = models[model_key].predict(batch, progress=False)
+
+            offset = 0
+            for i in group:
+                q = queries[i]
+                _, lons, lats = windows[i]
+                end = offset + len(lons)
+                predictions = _predictions(
+                    lons,
+                    lats,
+                    scores[offset:end],
+                    uncertainties[offset:end] if uncertainties is not None else None,
+                )
+                offset = end
+                count("predicted_pixels", len(predictions))
+                results[i] = {
+                    "predictions": predictions,
+                    "species_key": q.species_key,
+                    "model_type": q.model_type,
+                    "has_uncertainty": has_uncertainty,
+                    "center": {"lon": q.lon, "lat": q.lat},
+                    "grid_size_m": q.grid_size_m,
+                    "n_pixels": len(predictions),
+                }
+
+    if score_cache is not None:
+        annotate(score_cache=score_cache.stats())
+    return results
+
+
 def predict_local(
     lat: float,
     lon: float,
@@ -79,10 +564,13 @@ def predict_local(
     grid_size_m: int = 100,
     model_type: ModelType = "mlp",
     n_mc_samples: int = 30,
+    cache_dir: Path = CACHE_DIR,
+    models_dir: Path = MODELS_DIR,
+    score_cache: Optional[TileScoreCache] = None,
 ) -> dict:
     """
     Get predictions for a grid around a point using pre-trained model.
-    Only loads the single tile containing the point.
+    Only loads the tile containing the point (and neighbours the window crosses).
 
     Args:
         lat: Center latitude
@@ -91,121 +579,27 @@ def predict_local(
         grid_size_m: Grid size in meters
         model_type: "logistic" or "mlp"
         n_mc_samples: Number of MC Dropout samples (only used for mlp)
+        cache_dir: Directory containing Tessera embeddings
+        models_dir: Directory containing trained models
+        score_cache: Cache of full-tile scores (see predict_local_batch)
 
     Returns:
         Dictionary with predictions, each containing score and optionally uncertainty
     """
-    # Load pre-trained classifier based on model type
-    if model_type == "logistic":
-        model_path = MODELS_DIR / "logistic" / f"{species_key}.pkl"
-        if not model_path.exists():
-            # Fall back to old location for backward compatibility
-            model_path = MODELS_DIR / f"{species_key}.pkl"
-        if not model_path.exists():
-            raise ValueError(f"No logistic model for species key {species_key}. Run train_models.py first.")
-        classifier = ClassifierMethod.load(model_path)
-        has_uncertainty = False
-    else:  # mlp
-        model_path = MODELS_DIR / "mlp" / f"{species_key}.pt"
-        if not model_path.exists():
-            raise ValueError(f"No MLP model for species key {species_key}. Run train_models.py --model-type mlp first.")
-        classifier = MLPClassifierMethod.load(model_path)
-        has_uncertainty = True
-
-    # Find and load only the tile containing this point
-    tile_lon, tile_lat = get_tile_coords(lon, lat)
-    tile_data = load_single_tile(tile_lon, tile_lat)
-
-    if tile_data is None:
-        return {
-            "predictions": [],
-            "species_key": species_key,
-            "model_type": model_type,
-            "center": {"lon": lon, "lat": lat},
-            "grid_size_m": grid_size_m,
-            "n_pixels": 0,
-            "error": f"No tile data at {tile_lon}, {tile_lat}",
-        }
-
-    embeddings, transform = tile_data
-    h, w, _ = embeddings.shape
-
-    # Calculate grid bounds in degrees
-    lon_offset, lat_offset = meters_to_degrees(grid_size_m / 2, lat)
-    min_lon = lon - lon_offset
-    max_lon = lon + lon_offset
-    min_lat = lat - lat_offset
-    max_lat = lat + lat_offset
-
-    # Convert corner coordinates to pixel indices within this tile
-    min_row, min_col = rasterio.transform.rowcol(transform, min_lon, max_lat)
-    max_row, max_col = rasterio.transform.rowcol(transform, max_lon, min_lat)
-
-    # Clamp to valid range
-    min_row = max(0, min(min_row, h - 1))
-    max_row = max(0, min(max_row, h - 1))
-    min_col = max(0, min(min_col, w - 1))
-    max_col = max(0, min(max_col, w - 1))
-
-    # Collect embeddings and coordinates
-    embeddings_to_predict = []
-    coords_to_predict = []
-
-    for row in range(min_row, max_row + 1):
-        for col in range(min_col, max_col + 1):
-            emb = embeddings[row, col, :]
-            if not np.allclose(emb, 0):
-                px_lon, px_lat = rasterio.transform.xy(transform, row, col)
-                embeddings_to_predict.append(emb)
-                coords_to_predict.append((px_lon, px_lat))
-
-    # Batch predict
-    predictions = []
-    if embeddings_to_predict:
-        embeddings_array = np.array(embeddings_to_predict)
-
-        if has_uncertainty:
-            # MLP with MC Dropout - get both score and uncertainty
-            scores, uncertainties = classifier.predict_with_uncertainty(
-                embeddings_array, n_samples=n_mc_samples
-            )
-            for (px_lon, px_lat), score, uncertainty in zip(coords_to_predict, scores, uncertainties):
-                # Convert uncertainty to confidence (1 - normalized uncertainty)
-                # Uncertainty is typically 0-0.5, so we normalize and invert
-                confidence = float(1.0 - min(uncertainty * 2, 1.0))
-                predictions.append({
-                    "lon": float(px_lon),
-                    "lat": float(px_lat),
-                    "score": float(score),
-                    "uncertainty": float(uncertainty),
-                    "confidence": confidence,
-                })
-        else:
-            # Logistic regression - no uncertainty
-            scores = classifier.predict(embeddings_array)
-            for (px_lon, px_lat), score in zip(coords_to_predict, scores):
-                predictions.append({
-                    "lon": float(px_lon),
-                    "lat": float(px_lat),
-                    "score": float(score),
-                })
-
-    return {
-        "predictions": predictions,
-        "species_key": species_key,
-        "model_type": model_type,
-        "has_uncertainty": has_uncertainty,
-        "center": {"lon": lon, "lat": lat},
-        "grid_size_m": grid_size_m,
-        "n_pixels": len(predictions),
-    }
+    query = LocalQuery(lat, lon, species_key, grid_size_m, model_type)
+    return predict_local_batch([query], n_mc_samples, cache_dir, models_dir, score_cache)[0]
 
 
 def main():
     parser = argparse.ArgumentParser(description="Predict local habitat suitability")
-    parser.add_argument("--lat", type=float, required=True, help="Center latitude")
-    parser.add_argument("--lon", type=float, required=True, help="Center longitude")
-    parser.add_argument("--species-key", type=int, required=True, help="GBIF species key")
+    parser.add_argument("--lat", type=float, help="Center latitude")
+    parser.add_argument("--lon", type=float, help="Center longitude")
+    parser.add_argument("--species-key", type=int, help="GBIF species key")
+    parser.add_argument(
+        "--batch",
+        help="JSON file ('-' for stdin) with a list of queries: objects with lat, lon, "
+             "species_key and optionally grid_size_m and model_type; prints a list of results",
+    )
     parser.add_argument("--grid-size", type=int, default=100, help="Grid size in meters")
     parser.add_argument(
         "--model-type",
@@ -220,22 +614,68 @@ def main():
         default=30,
         help="Number of MC Dropout samples for MLP (default: 30)",
     )
+    parser.add_argument(
+        "--score-cache",
+        action="store_true",
+        help=f"Slice windows from cached full-tile scores, spilled to {SCORE_CACHE_DIR.relative_to(PROJECT_ROOT)}/ "
+             "(the first window in a tile scores the whole tile); hit rates are printed to stderr",
+    )
+    parser.add_argument(
+        "--score-cache-mb",
+        type=float,
+        default=DEFAULT_MAX_MB,
+        help=f"Memory budget of the score cache in MB (default: {DEFAULT_MAX_MB})",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="Write stage timings, memory and throughput to this JSON file",
+    )
 
     args = parser.parse_args()
 
-    try:
-        result = predict_local(
-            lat=args.lat,
-            lon=args.lon,
-            species_key=args.species_key,
-            grid_size_m=args.grid_size,
-            model_type=args.model_type,
-            n_mc_samples=args.mc_samples,
-        )
-        print(json.dumps(result))
-    except Exception as e:
-        print(json.dumps({"error": str(e)}), file=sys.stderr)
-        sys.exit(1)
+    if args.batch is None and (args.lat is None or args.lon is None or args.species_key is None):
+        parser.error("Specify --lat, --lon and --species-key, or --batch")
+
+    score_cache = TileScoreCache(args.score_cache_mb, SCORE_CACHE_DIR) if args.score_cache else None
+
+    with tracing(args.trace, name="predict_local.py", enabled=args.trace is not None, mc_samples=args.mc_samples):
+        try:
+            if args.batch is not None:
+                if args.batch == "-":
+                    raw_queries = json.load(sys.stdin)
+                else:
+                    with open(args.batch) as f:
+                        raw_queries = json.load(f)
+                queries = [
+                    LocalQuery(
+                        lat=q["lat"],
+                        lon=q["lon"],
+                        species_key=q["species_key"],
+                        grid_size_m=q.get("grid_size_m", args.grid_size),
+                        model_type=q.get("model_type", args.model_type),
+                    )
+                    for q in raw_queries
+                ]
+                print(json.dumps(predict_local_batch(queries, n_mc_samples=args.mc_samples, score_cache=score_cache)))
+            else:
+                result = predict_local(
+                    lat=args.lat,
+                    lon=args.lon,
+                    species_key=args.species_key,
+                    grid_size_m=args.grid_size,
+                    model_type=args.model_type,
+                    n_mc_samples=args.mc_samples,
+                    score_cache=score_cache,
+                )
+                print(json.dumps(result))
+        except Exception as e:
+            print(json.dumps({"error": str(e)}), file=sys.stderr)
+            sys.exit(1)
+
+    if score_cache is not None:
+        score_cache.flush()
+        print(json.dumps({"score_cache": score_cache.stats()}), file=sys.stderr)
 
 
 if __name__ == "__main__":
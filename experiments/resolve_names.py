@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Resolve a list of species names against the GBIF backbone in bulk.
+
+Reads names from a text file (one per line) or a CSV column, and writes a
+table with taxon key, canonical name, rank, confidence and flags for every
+input. Rows flagged low_confidence, higherrank, not_found or unresolved
+should be excluded before training.
+
+Usage:
+    uv run python resolve_names.py names.txt -o resolved.csv
+    uv run python resolve_names.py species.csv --column scientificName -o resolved.csv
+"""
+
+import argparse
+import csv
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from finder.cache import MatchCache
+from finder.names import MIN_CONFIDENCE, resolve_names, write_matches_csv
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent
+CACHE_DIR = PROJECT_ROOT / "cache"
+MATCH_CACHE_PATH = CACHE_DIR / "gbif" / "names.sqlite"
+
+
+def read_names(path: Path, column: Optional[str] = None) -> list[str]:
+    """Read names from a CSV column, or one per line from a text file."""
+    with open(path, newline="") as f:
+        if column:
+            return [row[column] for row in csv.DictReader(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve species names against the GBIF backbone")
+    parser.add_argument("input", help="Text file with one name per line, or a CSV (with --column)")
+    parser.add_argument("--column", help="CSV column holding the names")
+    parser.add_argument("-o", "--output", default="resolved_names.csv", help="Output CSV path")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent match requests")
+    parser.add_argument("--min-confidence", type=int, default=MIN_CONFIDENCE,
+                        help=f"Flag matches below this confidence (default: {MIN_CONFIDENCE})")
+    parser.add_argument("--offline", action="store_true",
+                        help="Use only cached name matches; never contact the API")
+    args = parser.parse_args()
+
+    names = read_names(Path(args.input), args.column)
+    matches = resolve_names(
+        names,
+        match_cache=MatchCache(MATCH_CACHE_PATH, offline=args.offline),
+        max_workers=args.workers,
+        min_confidence=args.min_confidence,
+    )
+    write_matches_csv(matches, Path(args.output))
+
+    flags = Counter(flag for match in matches for flag in match.flags)
+    usable = sum(match.usable for match in matches)
+    logger.info(f"Usable: {usable}/{len(matches)}")
+    for flag, n in flags.most_common():
+        logger.info(f"  {flag}: {n}")
+    logger.info(f"Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,14 @@ import argparse
 import logging
 from pathlib import Path
 
-from finder import find_candidates
+from finder import find_candidates, FeatureStore
+from finder.cache import DEFAULT_TTL_DAYS, MatchCache, OccurrenceCache
+from finder.hierarchical import DEFAULT_BLOCK_SIZE, DEFAULT_MARGIN
+from finder.ingest import OccurrenceArchive
+from finder.instrument import TRACE_FILENAME, tracing
+from finder.profiling import DEFAULT_TOP_N, PROFILE_MODES, profiling
+from finder.outofcore import DEFAULT_MEMORY_LIMIT_MB, find_candidates_large
+from finder.shards import DEFAULT_HALO, DEFAULT_MAX_RETRIES, DEFAULT_SHARD_TILES, find_candidates_sharded
 from finder.pipeline import REGIONS
 
 logging.basicConfig(
@@ -25,6 +32,10 @@ logging.basicConfig(
 PROJECT_ROOT = Path(__file__).parent
 OUTPUT_DIR = PROJECT_ROOT / "output"
 CACHE_DIR = PROJECT_ROOT / "cache"
+FEATURES_DIR = CACHE_DIR / "features"
+OCCURRENCE_CACHE_PATH = CACHE_DIR / "gbif" / "occurrences.sqlite"
+MATCH_CACHE_PATH = CACHE_DIR / "gbif" / "names.sqlite"
+OCCURRENCE_ARCHIVE_DIR = CACHE_DIR / "gbif" / "archive"
 
 
 def main():
@@ -35,6 +46,90 @@ def main():
     parser.add_argument("--region", choices=list(REGIONS.keys()), help="Predefined region")
     parser.add_argument("--bbox", help="Bounding box: min_lon,min_lat,max_lon,max_lat")
     parser.add_argument("-o", "--output", help="Output directory")
+    parser.add_argument(
+        "--refresh-occurrences",
+        action="store_true",
+        help="Re-fetch GBIF occurrences and append new ones to the feature store",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only locally cached GBIF data; never contact the API",
+    )
+    parser.add_argument(
+        "--occurrence-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Re-fetch cached GBIF queries older than this (default: {DEFAULT_TTL_DAYS:g})",
+    )
+    parser.add_argument(
+        "--dedupe-pixels",
+        action="store_true",
+        help="Collapse occurrences in the same pixel into one count-weighted positive",
+    )
+    parser.add_argument(
+        "--hierarchical",
+        action="store_true",
+        help="Score block-pooled embeddings first and refine only promising blocks",
+    )
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f"Block edge in pixels for --hierarchical (default: {DEFAULT_BLOCK_SIZE})")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN,
+                        help=f"Refinement margin below the threshold (default: {DEFAULT_MARGIN})")
+    parser.add_argument("--check-recall", action="store_true",
+                        help="With --hierarchical, also score exhaustively and report recall")
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=0,
+        help="Work on the embedding pyramid level L (2**L-pixel blocks) for a quick preview",
+    )
+
+    parser.add_argument(
+        "--large-region",
+        action="store_true",
+        help="Stream tiles instead of loading the mosaic (for regions of many tiles)",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=float,
+        default=DEFAULT_MEMORY_LIMIT_MB,
+        help=f"Memory budget for --large-region (default: {DEFAULT_MEMORY_LIMIT_MB})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="With --large-region, score tile-aligned shards on this many processes",
+    )
+    parser.add_argument("--shard-tiles", type=int, default=DEFAULT_SHARD_TILES,
+                        help=f"Shard edge in tiles for --workers (default: {DEFAULT_SHARD_TILES})")
+    parser.add_argument("--halo", type=int, default=DEFAULT_HALO,
+                        help=f"Pixels scored around each shard (default: {DEFAULT_HALO})")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"Reruns per failed shard (default: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help=f"Record stage timings, memory and throughput in {{output}}/{TRACE_FILENAME}",
+    )
+    parser.add_argument(
+        "--trace-allocations",
+        action="store_true",
+        help="With --trace, also record allocations per stage with tracemalloc (slower)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the run with cProfile or a stack sampler; artifacts go to {output}/profile/",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Take tracemalloc snapshots around the pipeline stages (slower)",
+    )
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP_N,
+                        help=f"Functions listed in the hotspot summary (default: {DEFAULT_TOP_N})")
 
     args = parser.parse_args()
 
@@ -48,17 +143,93 @@ def main():
     slug = args.species.lower().replace(" ", "_")
     output_dir = Path(args.output) if args.output else OUTPUT_DIR / slug
 
-    result = find_candidates(
-        species_name=args.species,
-        bbox=bbox,
-        cache_dir=CACHE_DIR,
-        output_dir=output_dir,
+    occurrence_cache = OccurrenceCache(
+        OCCURRENCE_CACHE_PATH,
+        ttl_days=args.occurrence_ttl_days,
+        refresh="always" if args.refresh_occurrences else "auto",
+        offline=args.offline,
     )
+    match_cache = MatchCache(MATCH_CACHE_PATH, offline=args.offline)
+    occurrence_archive = (
+        OccurrenceArchive(OCCURRENCE_ARCHIVE_DIR) if OCCURRENCE_ARCHIVE_DIR.exists() else None
+    )
+
+    with tracing(
+        output_dir / TRACE_FILENAME,
+        name="run.py",
+        allocations=args.trace_allocations,
+        enabled=args.trace,
+        species=args.species,
+        bbox=bbox,
+        large_region=args.large_region,
+        workers=args.workers,
+    ), profiling(
+        output_dir / "profile",
+        mode=args.profile,
+        memory=args.profile_memory,
+        top_n=args.profile_top,
+        name="run.py",
+        species=args.species,
+        bbox=bbox,
+    ):
+        if args.large_region and args.workers > 1:
+            result = find_candidates_sharded(
+                species_name=args.species,
+                bbox=bbox,
+                cache_dir=CACHE_DIR,
+                output_dir=output_dir,
+                workers=args.workers,
+                shard_tiles=args.shard_tiles,
+                halo=args.halo,
+                max_retries=args.max_retries,
+                memory_limit_mb=args.memory_limit_mb,
+                occurrence_cache=occurrence_cache,
+                match_cache=match_cache,
+                occurrence_archive=occurrence_archive,
+                dedupe_pixels=args.dedupe_pixels,
+            )
+        elif args.large_region:
+            result = find_candidates_large(
+                species_name=args.species,
+                bbox=bbox,
+                cache_dir=CACHE_DIR,
+                output_dir=output_dir,
+                memory_limit_mb=args.memory_limit_mb,
+                occurrence_cache=occurrence_cache,
+                match_cache=match_cache,
+                occurrence_archive=occurrence_archive,
+                dedupe_pixels=args.dedupe_pixels,
+            )
+        if args.large_region:
+            print(f"\nOutput: {output_dir}/")
+            print(f"  - probability.tif ({result.shape[0]:,} x {result.shape[1]:,})")
+            print(f"  - candidates.geojson ({result.n_candidates:,} candidate pixels)")
+            print(f"  - occurrences.geojson ({result.n_occurrences} GBIF records)")
+            print(f"  Peak RSS: {result.peak_rss_mb:,.0f} MB (limit {result.memory_limit_mb:,.0f} MB)")
+            return
+
+        result = find_candidates(
+            species_name=args.species,
+            bbox=bbox,
+            cache_dir=CACHE_DIR,
+            output_dir=output_dir,
+            feature_store=FeatureStore(FEATURES_DIR),
+            refresh_occurrences=args.refresh_occurrences,
+            occurrence_cache=occurrence_cache,
+            match_cache=match_cache,
+            occurrence_archive=occurrence_archive,
+            dedupe_pixels=args.dedupe_pixels,
+            hierarchical=args.hierarchical,
+            block_size=args.block_size,
+            margin=args.margin,
+            check_recall=args.check_recall,
+            level=args.level,
+        )
 
-    print(f"\nOutput: {output_dir}/")
-    print(f"  - probability.tif")
-    print(f"  - candidates.geojson ({result.to_geojson()['metadata']['n_candidates']} points)")
-    print(f"  - occurrences.geojson ({result.n_occurrences} GBIF records)")
+        print(f"\nOutput: {output_dir}/")
+        print(f"  - probability.tif")
+        print(f"  - candidates.geojson ({result.to_geojson()['metadata']['n_candidates']} points)")
+        print(f"  - occurrences.geojson ({result.n_occurrences} GBIF records)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Find the pixels whose embeddings are most similar to a species' occurrences.
+
+A classifier-free alternative to run.py for species with very few records
+(down to a single occurrence): occurrence embeddings are looked up in the
+region's approximate nearest-neighbour index, built on first use and stored
+under cache/{year}/ann/, and the closest pixels are written as GeoJSON.
+
+Usage:
+    uv run python similar.py "Species name" --region cambridge -k 500
+"""
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from finder.ann import DEFAULT_N_PROBE, load_index
+from finder.cache import DEFAULT_TTL_DAYS, MatchCache, OccurrenceCache
+from finder.embeddings import EmbeddingMosaic
+from finder.gbif import fetch_occurrences, get_species_info
+from finder.ingest import OccurrenceArchive
+from finder.pipeline import REGIONS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent
+OUTPUT_DIR = PROJECT_ROOT / "output"
+CACHE_DIR = PROJECT_ROOT / "cache"
+OCCURRENCE_CACHE_PATH = CACHE_DIR / "gbif" / "occurrences.sqlite"
+MATCH_CACHE_PATH = CACHE_DIR / "gbif" / "names.sqlite"
+OCCURRENCE_ARCHIVE_DIR = CACHE_DIR / "gbif" / "archive"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find pixels with embeddings similar to a species' occurrences"
+    )
+    parser.add_argument("species", help="Scientific name of the species")
+    parser.add_argument("--region", choices=list(REGIONS.keys()), help="Predefined region")
+    parser.add_argument("--bbox", help="Bounding box: min_lon,min_lat,max_lon,max_lat")
+    parser.add_argument("-o", "--output", help="Output directory")
+    parser.add_argument("-k", type=int, default=500, help="Number of similar pixels (default: 500)")
+    parser.add_argument("--n-probe", type=int, default=DEFAULT_N_PROBE,
+                        help=f"Index lists scanned per query (default: {DEFAULT_N_PROBE})")
+    parser.add_argument("--n-lists", type=int, help="Index lists when building (default: ~sqrt(pixels))")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only locally cached GBIF data; never contact the API",
+    )
+    parser.add_argument(
+        "--occurrence-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Re-fetch cached GBIF queries older than this (default: {DEFAULT_TTL_DAYS:g})",
+    )
+    args = parser.parse_args()
+
+    if args.region:
+        bbox = REGIONS[args.region]["bbox"]
+    elif args.bbox:
+        bbox = tuple(map(float, args.bbox.split(",")))
+    else:
+        parser.error("Specify --region or --bbox")
+
+    species_info = get_species_info(args.species, MatchCache(MATCH_CACHE_PATH, offline=args.offline))
+    taxon_key = species_info["taxon_key"]
+    logger.info(f"Matched: {species_info['scientific_name']} (key: {taxon_key})")
+
+    occurrences = fetch_occurrences(
+        taxon_key,
+        bbox,
+        cache=OccurrenceCache(
+            OCCURRENCE_CACHE_PATH, ttl_days=args.occurrence_ttl_days, offline=args.offline
+        ),
+        archive=(
+            OccurrenceArchive(OCCURRENCE_ARCHIVE_DIR) if OCCURRENCE_ARCHIVE_DIR.exists() else None
+        ),
+    )
+    logger.info(f"Occurrences in region: {len(occurrences)}")
+
+    # The mosaic is only loaded if the index has to be built
+    start = time.perf_counter()
+    index = load_index(EmbeddingMosaic(CACHE_DIR, bbox), n_lists=args.n_lists)
+    logger.info(
+        f"Index: {len(index):,} pixels in {index.n_lists} lists "
+        f"({time.perf_counter() - start:.1f}s)"
+    )
+
+    occurrence_pixels, query_embeddings = index.lookup(occurrences)
+    occurrence_pixels, first = np.unique(occurrence_pixels, return_index=True)
+    query_embeddings = query_embeddings[first]
+    if len(query_embeddings) == 0:
+        raise SystemExit("No occurrences fall on non-empty pixels of the region")
+
+    start = time.perf_counter()
+    distances, pixel_ids = index.nearest_to_any(
+        query_embeddings, k=args.k, n_probe=args.n_probe, exclude=occurrence_pixels
+    )
+    logger.info(
+        f"Queried {len(query_embeddings)} occurrence embeddings in "
+        f"{(time.perf_counter() - start) * 1000:.1f}ms"
+    )
+
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"rank": rank, "distance": float(distance)},
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        }
+        for rank, (distance, (lon, lat)) in enumerate(
+            zip(distances, index.coords(pixel_ids)), start=1
+        )
+    ]
+    geojson = {
+        "type": "FeatureCollection",
+        "features": features,
+        "metadata": {
+            "species": species_info["canonical_name"],
+            "taxon_key": taxon_key,
+            "n_occurrences": len(occurrences),
+            "n_queries": len(query_embeddings),
+            "k": args.k,
+            "n_probe": args.n_probe,
+            "bbox": list(bbox),
+        },
+    }
+
+    slug = args.species.lower().replace(" ", "_")
+    output_dir = Path(args.output) if args.output else OUTPUT_DIR / slug
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / "similar.geojson"
+    with open(path, "w") as f:
+        json.dump(geojson, f)
+    print(f"\nOutput: {path} ({len(features)} points)")
+
+
+if __name__ == "__main__":
+    main()
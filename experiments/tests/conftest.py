@@ -0,0 +1,39 @@
+"""Shared fixtures: tiny embedding caches with tiles of unequal sizes."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from finder.tiles import tile_name  # noqa: E402
+
+YEAR = 2024
+N_CHANNELS = 8
+
+
+def write_tile(cache_dir: Path, tile_lon: float, tile_lat: float, h: int, w: int, seed: int) -> None:
+    """Write a quantized tile of h x w pixels with no empty pixels."""
+    rng = np.random.default_rng(seed)
+    name = tile_name(tile_lon, tile_lat)
+    tile_dir = cache_dir / str(YEAR) / name
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    quantized = rng.integers(1, 127, size=(h, w, N_CHANNELS), dtype=np.int8)
+    np.save(tile_dir / f"{name}.npy", quantized)
+    np.save(tile_dir / f"{name}_scales.npy", np.full((h, w), 0.01, dtype=np.float32))
+
+
+@pytest.fixture
+def mixed_tiles(tmp_path: Path) -> Path:
+    """
+    A 2 x 2 block of tiles around (0.15, 52.25): the south-east tile is
+    100 x 64 pixels, its northern neighbours 2 rows shorter and its western
+    neighbours 2 columns narrower.
+    """
+    write_tile(tmp_path, 0.15, 52.15, 100, 64, seed=0)
+    write_tile(tmp_path, 0.15, 52.25, 98, 64, seed=1)
+    write_tile(tmp_path, 0.05, 52.15, 100, 62, seed=2)
+    write_tile(tmp_path, 0.05, 52.25, 98, 62, seed=3)
+    return tmp_path
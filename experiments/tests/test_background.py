@@ -0,0 +1,29 @@
+"""Background requests larger than the bank."""
+
+import numpy as np
+
+from finder.background import BackgroundBank
+from finder.embeddings import EmbeddingMosaic
+
+from .conftest import YEAR, write_tile
+
+BBOX = (0.16, 52.16, 0.24, 52.24)  # inside one tile
+
+
+def test_take_tops_up_a_short_bank_from_the_mosaic(tmp_path):
+    write_tile(tmp_path, 0.15, 52.15, 40, 30, seed=0)
+    mosaic = EmbeddingMosaic(tmp_path, BBOX, year=YEAR)
+    bank = BackgroundBank.build(mosaic, n_samples=200, seed=0)
+    excluded = bank.pixels[:50]
+
+    embeddings, coords = bank.take(300, exclude_pixels=excluded, mosaic=mosaic)
+
+    assert len(embeddings) == len(coords) == 300
+    pixels = bank.coords_to_pixels(coords)
+    assert len({tuple(p) for p in pixels}) == 300
+    assert not {tuple(p) for p in pixels} & {tuple(p) for p in excluded}
+    np.testing.assert_array_equal(embeddings, mosaic.mosaic[pixels[:, 0], pixels[:, 1]])
+
+    # Without a mosaic the bank can only offer what it has
+    embeddings, coords = bank.take(300, exclude_pixels=excluded)
+    assert len(embeddings) == len(coords) == 150
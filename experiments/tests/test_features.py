@@ -0,0 +1,55 @@
+"""Feature store entries written by concurrent writers."""
+
+import threading
+
+import numpy as np
+
+from finder.features import FeatureStore, OccurrenceFeatures
+
+from .conftest import N_CHANNELS, YEAR
+
+TAXON_KEY = 12345
+BBOX = (0.0, 52.0, 0.5, 52.5)
+
+
+def features(n: int) -> OccurrenceFeatures:
+    """n occurrences, every other one inside the mosaic."""
+    pixels = np.full((n, 2), -1, dtype=np.int32)
+    pixels[::2] = n
+    return OccurrenceFeatures(
+        taxon_key=TAXON_KEY,
+        coords=np.full((n, 2), float(n)),
+        pixels=pixels,
+        embeddings=np.full((len(pixels[::2]), N_CHANNELS), n, dtype=np.float32),
+    )
+
+
+def test_concurrent_writes_leave_one_complete_entry(tmp_path):
+    store = FeatureStore(tmp_path)
+    sizes = range(10, 90, 10)
+    threads = [
+        threading.Thread(target=lambda n=n: [store._write(features(n), BBOX, YEAR) for _ in range(5)])
+        for n in sizes
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entry = store.get(TAXON_KEY, BBOX, YEAR)
+    n = entry.n_occurrences
+    assert n in sizes
+    assert (entry.coords == n).all() and (entry.embeddings == n).all()
+    # No temporary or replaced entry directories are left behind
+    entry_dir = store.entry_dir(TAXON_KEY, BBOX, YEAR)
+    assert list(entry_dir.parent.iterdir()) == [entry_dir]
+
+
+def test_get_drops_arrays_of_different_writes(tmp_path):
+    store = FeatureStore(tmp_path)
+    store._write(features(10), BBOX, YEAR)
+    entry_dir = store.entry_dir(TAXON_KEY, BBOX, YEAR)
+    np.save(entry_dir / "embeddings.npy", features(20).embeddings)
+
+    assert store.get(TAXON_KEY, BBOX, YEAR) is None
+
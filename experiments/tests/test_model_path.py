@@ -0,0 +1,28 @@
+"""Models trained on different regions, found by the query point."""
+
+import predict_local
+import train_models
+
+from .conftest import YEAR
+
+SPECIES_KEY = 12345
+
+
+def save_model(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    return path
+
+
+def test_model_path_picks_the_region_containing_the_point(tmp_path):
+    cambridge = train_models.region_models_dir((0.0, 52.0, 0.5, 52.5), YEAR, tmp_path)
+    britain = train_models.region_models_dir((-8.0, 49.8, 2.0, 61.0), YEAR, tmp_path)
+    small = save_model(cambridge / "mlp" / f"{SPECIES_KEY}.pt")
+    large = save_model(britain / "mlp" / f"{SPECIES_KEY}.pt")
+    legacy = save_model(tmp_path / "mlp" / f"{SPECIES_KEY}.pt")
+
+    # Both regions contain Cambridge; the smaller one wins
+    assert predict_local.model_path(SPECIES_KEY, "mlp", tmp_path, lon=0.12, lat=52.2) == small
+    assert predict_local.model_path(SPECIES_KEY, "mlp", tmp_path, lon=-3.2, lat=55.9) == large
+    # Outside every trained region, models saved directly in models_dir are used
+    assert predict_local.model_path(SPECIES_KEY, "mlp", tmp_path, lon=10.0, lat=45.0) == legacy
@@ -0,0 +1,59 @@
+"""Out-of-core region passes over tiles of unequal sizes."""
+
+import numpy as np
+import pytest
+import rasterio
+
+from finder.methods import ClassifierMethod
+from finder.outofcore import RegionGrid, _sample_training_data, _score_region
+from finder.tiles import get_catalog
+
+from .conftest import N_CHANNELS, YEAR, write_tile
+
+BBOX = (0.06, 52.16, 0.24, 52.24)  # two tiles side by side
+
+
+def region_grid(cache_dir, west_shape, east_shape) -> RegionGrid:
+    write_tile(cache_dir, 0.05, 52.15, *west_shape, seed=0)
+    write_tile(cache_dir, 0.15, 52.15, *east_shape, seed=1)
+    return RegionGrid.from_catalog(get_catalog(cache_dir, YEAR), BBOX)
+
+
+def classifier() -> ClassifierMethod:
+    rng = np.random.default_rng(0)
+    method = ClassifierMethod()
+    method.fit(rng.normal(1, 1, (50, N_CHANNELS)), rng.normal(-1, 1, (50, N_CHANNELS)))
+    return method
+
+
+def test_occurrence_in_padding_of_smaller_tile(tmp_path):
+    grid = region_grid(tmp_path, (100, 64), (98, 62))
+    assert grid.shape == (100, 128)
+    # In the east tile's slot, below its last row and right of its last column
+    occurrences = np.array([[99, 74], [10, 127], [10, 70]])
+
+    positives, negatives = _sample_training_data(grid, occurrences, 20, band_rows=16, seed=0)
+
+    assert not positives[0].any() and not positives[1].any()
+    east = grid.catalog.load_tile(grid.catalog.index_of_tile(0.15, 52.15))
+    np.testing.assert_allclose(positives[2], east[10, 6])
+    assert len(negatives) == 20
+
+
+@pytest.mark.parametrize("west_shape, east_shape", [((100, 64), (98, 62)), ((98, 62), (100, 64))])
+def test_score_region_keeps_tiles_in_their_slots(tmp_path, west_shape, east_shape):
+    grid = region_grid(tmp_path, west_shape, east_shape)
+    method = classifier()
+    path = tmp_path / "scores.tif"
+
+    _score_region(grid, method, path, band_rows=16, threshold=0.5, cache_mb=16, seed=0)
+
+    tile_h, tile_w, _ = grid.tile_shape
+    with rasterio.open(path) as src:
+        scores = src.read(1)
+    assert scores.shape == (tile_h, 2 * tile_w)
+    for slot, tile_lon in enumerate((0.05, 0.15)):
+        tile = grid.catalog.load_tile(grid.catalog.index_of_tile(tile_lon, 52.15))
+        h, w = min(tile.shape[0], tile_h), min(tile.shape[1], tile_w)
+        expected = method.predict(tile[:h, :w].reshape(-1, N_CHANNELS), progress=False).reshape(h, w)
+        np.testing.assert_allclose(scores[:h, slot * tile_w:slot * tile_w + w], expected, rtol=1e-5)
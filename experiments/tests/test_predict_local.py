@@ -0,0 +1,72 @@
+"""Windows that cross into neighbouring tiles of a different size."""
+
+import numpy as np
+import rasterio
+
+import predict_local
+from finder.scorecache import TileScores
+from finder.tiles import get_catalog
+
+from .conftest import YEAR
+
+CENTRE = (0.15, 52.15)
+LON, LAT = 0.152, 52.248  # near the centre tile's north-west corner
+GRID_SIZE_M = 2000
+
+
+def padded_block(cache_dir):
+    """The 2 x 2 tiles stitched on the centre tile's 100 x 64 slots, smaller ones zero-padded."""
+    catalog = get_catalog(cache_dir, YEAR, predict_local.TILE_SIZE)
+    block = np.zeros((200, 128, 8), dtype=np.float32)
+    for (tile_lon, tile_lat), (r, c) in {
+        (0.05, 52.25): (0, 0), (0.15, 52.25): (0, 64), (0.05, 52.15): (100, 0), (0.15, 52.15): (100, 64),
+    }.items():
+        tile = catalog.load_tile(catalog.index_of_tile(tile_lon, tile_lat))
+        block[r:r + tile.shape[0], c:c + tile.shape[1]] = tile
+    return block
+
+
+def expected_window(cache_dir):
+    """Window of the padded block around (LON, LAT), with its offset on the centre tile."""
+    transform = rasterio.transform.from_bounds(*CENTRE, CENTRE[0] + 0.1, CENTRE[1] + 0.1, 64, 100)
+    lon_offset, lat_offset = predict_local.meters_to_degrees(GRID_SIZE_M / 2, LAT)
+    min_row, min_col = rasterio.transform.rowcol(transform, LON - lon_offset, LAT + lat_offset)
+    max_row, max_col = rasterio.transform.rowcol(transform, LON + lon_offset, LAT - lat_offset)
+    assert min_row < 0 and min_col < 0  # the window reaches into the northern and western tiles
+    window = padded_block(cache_dir)[100 + min_row:100 + max_row + 1, 64 + min_col:64 + max_col + 1]
+    return window
+
+
+def test_extract_window_pads_smaller_neighbours(mixed_tiles, monkeypatch):
+    monkeypatch.setattr(predict_local, "CACHE_DIR", mixed_tiles)
+    reader = predict_local.TileReader(mixed_tiles)
+    index = reader.catalog.index_of_tile(*CENTRE)
+
+    embeddings, lons, lats = predict_local.extract_window(reader, index, LAT, LON, GRID_SIZE_M)
+
+    window = expected_window(mixed_tiles)
+    valid = predict_local.nonempty_mask(window)
+    assert not valid.all()  # the padding rows and columns are left out
+    np.testing.assert_array_equal(embeddings, window[valid])
+    assert len(lons) == len(lats) == valid.sum()
+
+
+def test_extract_window_scores_pads_smaller_neighbours(mixed_tiles):
+    catalog = get_catalog(mixed_tiles, YEAR, predict_local.TILE_SIZE)
+    index = catalog.index_of_tile(*CENTRE)
+
+    def tile_scores(neighbour):
+        if neighbour not in catalog:
+            return None
+        tile = catalog.load_tile(neighbour)
+        return TileScores(tile[..., 0].copy(), tile[..., 1].copy())
+
+    scores, uncertainties, lons, lats = predict_local.extract_window_scores(
+        catalog, index, LAT, LON, GRID_SIZE_M, tile_scores
+    )
+
+    window = expected_window(mixed_tiles)
+    valid = predict_local.nonempty_mask(window)
+    np.testing.assert_array_equal(scores, window[valid][:, 0])
+    np.testing.assert_array_equal(uncertainties, window[valid][:, 1])
+    assert len(lons) == len(lats) == valid.sum()
@@ -0,0 +1,53 @@
+"""Sharded scoring over tiles of unequal sizes."""
+
+import numpy as np
+import rasterio
+
+from finder.methods import ClassifierMethod
+from finder.outofcore import RegionGrid, _score_region
+from finder.shards import ShardSpec, merge_shards, plan_shards, run_shard
+from finder.tiles import get_catalog
+
+from .conftest import N_CHANNELS, YEAR
+
+BBOX = (0.06, 52.16, 0.24, 52.34)  # the 2 x 2 block of mixed_tiles
+
+
+def test_sharded_scores_match_single_process(mixed_tiles, tmp_path):
+    grid = RegionGrid.from_catalog(get_catalog(mixed_tiles, YEAR), BBOX)
+    rng = np.random.default_rng(0)
+    method = ClassifierMethod()
+    method.fit(rng.normal(1, 1, (50, N_CHANNELS)), rng.normal(-1, 1, (50, N_CHANNELS)))
+    model_path = tmp_path / "model.pkl"
+    method.save(model_path)
+
+    shard_dirs, specs = [], []
+    for shard_id, window, core, tiles in plan_shards(grid, shard_tiles=1, halo=4):
+        spec = ShardSpec(
+            shard_id=shard_id,
+            run_id="test",
+            cache_dir=str(mixed_tiles),
+            year=YEAR,
+            tile_size=grid.catalog.tile_size,
+            model_path=str(model_path),
+            threshold=0.5,
+            memory_limit_mb=64,
+            region_transform=list(grid.transform)[:6],
+            tile_shape=list(grid.tile_shape),
+            window=list(window),
+            core=list(core),
+            tiles=tiles,
+        )
+        shard_dir = tmp_path / "shards" / shard_id
+        shard_dir.mkdir(parents=True)
+        spec.save(shard_dir / "spec.json")
+        run_shard(shard_dir / "spec.json")
+        shard_dirs.append(shard_dir)
+        specs.append(spec)
+    assert len(specs) == 4
+
+    merge_shards(shard_dirs, specs, grid, tmp_path / "sharded.tif", memory_limit_mb=64)
+    _score_region(grid, method, tmp_path / "single.tif", band_rows=16, threshold=0.5, cache_mb=16, seed=0)
+
+    with rasterio.open(tmp_path / "sharded.tif") as sharded, rasterio.open(tmp_path / "single.tif") as single:
+        np.testing.assert_allclose(sharded.read(1), single.read(1), rtol=1e-5)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Train classifier models for every species in a GBIF species-count catalog.
+
+Reads species keys and occurrence counts (app/public/plant_species_counts.csv),
+keeps species within the count limits that occur in the region, and trains
+them on a bounded process pool, most expensive first. Progress, failures and
+per-job timings go to a SQLite job ledger, so an interrupted run resumes
+where it stopped (completed jobs are not rerun).
+
+Usage:
+    uv run python train_catalog.py --region cambridge --workers 4
+    uv run python train_catalog.py --bbox 0.0,52.0,1.0,53.0 --min-count 50 --memory-limit-mb 4096
+"""
+
+import argparse
+import csv
+import logging
+import resource
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+
+from finder import EmbeddingMosaic, FeatureStore
+from finder.background import BackgroundBank, load_background_bank
+from finder.cache import DEFAULT_TTL_DAYS, OccurrenceCache
+from finder.ingest import OccurrenceArchive
+from finder.features import region_key
+from finder.gbif import fetch_species_counts
+from finder.ledger import JobLedger
+from finder.pipeline import REGIONS
+from train_models import (
+    BACKGROUND_DIR,
+    CACHE_DIR,
+    FEATURES_DIR,
+    MODELS_DIR,
+    OCCURRENCE_ARCHIVE_DIR,
+    OCCURRENCE_CACHE_PATH,
+    SEED,
+    ModelType,
+    train_species,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent
+CATALOG_PATH = PROJECT_ROOT.parent / "app" / "public" / "plant_species_counts.csv"
+YEAR = 2024
+
+# train_species needs at least this many occurrences in the region
+MIN_REGION_OCCURRENCES = 5
+
+# Worker-process state, set up once per worker by _init_worker
+_worker_mosaic: Optional[EmbeddingMosaic] = None
+_worker_store: Optional[FeatureStore] = None
+_worker_bank: Optional[BackgroundBank] = None
+_worker_occurrence_cache: Optional[OccurrenceCache] = None
+_worker_occurrence_archive: Optional[OccurrenceArchive] = None
+
+
+def read_catalog(
+    path: Path,
+    min_count: int = 0,
+    max_count: Optional[int] = None,
+) -> dict[int, int]:
+    """
+    Read a species_key,occurrence_count catalog, filtered by count.
+
+    Returns:
+        Mapping of species key to global occurrence count
+    """
+    catalog = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            count = int(row["occurrence_count"])
+            if count < min_count or (max_count is not None and count > max_count):
+                continue
+            catalog[int(row["species_key"])] = count
+    return catalog
+
+
+def _init_worker(
+    bbox: tuple[float, float, float, float],
+    memory_limit_mb: Optional[int],
+    refresh_occurrences: bool,
+    offline: bool,
+    occurrence_ttl_days: Optional[float],
+) -> None:
+    """Apply the memory limit and load the region mosaic once per worker."""
+    global _worker_mosaic, _worker_store, _worker_bank
+    global _worker_occurrence_cache, _worker_occurrence_archive
+
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    # One BLAS/torch thread per worker; the pool provides the parallelism
+    import torch
+    torch.set_num_threads(1)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_mosaic = EmbeddingMosaic(CACHE_DIR, bbox, year=YEAR)
+    _worker_mosaic.load()
+    _worker_store = FeatureStore(FEATURES_DIR)
+    _worker_bank = load_background_bank(_worker_mosaic, BACKGROUND_DIR, seed=SEED)
+    _worker_occurrence_cache = OccurrenceCache(
+        OCCURRENCE_CACHE_PATH,
+        ttl_days=occurrence_ttl_days,
+        refresh="always" if refresh_occurrences else "auto",
+        offline=offline,
+    )
+    if OCCURRENCE_ARCHIVE_DIR.exists():
+        _worker_occurrence_archive = OccurrenceArchive(OCCURRENCE_ARCHIVE_DIR)
+
+
+def _run_job(
+    taxon_key: int,
+    model_type: ModelType,
+    refresh_occurrences: bool,
+    force: bool,
+    dedupe_pixels: bool = False,
+) -> tuple[str, float]:
+    """Train one species in a worker. Returns (status, duration in seconds)."""
+    start = time.perf_counter()
+    status = train_species(
+        taxon_key,
+        _worker_mosaic,
+        model_type=model_type,
+        feature_store=_worker_store,
+        refresh_occurrences=refresh_occurrences,
+        occurrence_cache=_worker_occurrence_cache,
+        occurrence_archive=_worker_occurrence_archive,
+        force=force,
+        verbose=False,
+        background_bank=_worker_bank,
+        dedupe_pixels=dedupe_pixels,
+    )
+    return status, time.perf_counter() - start
+
+
+def run_catalog(
+    ledger: JobLedger,
+    bbox: tuple[float, float, float, float],
+    model_type: ModelType,
+    workers: int,
+    memory_limit_mb: Optional[int] = None,
+    refresh_occurrences: bool = False,
+    offline: bool = False,
+    occurrence_ttl_days: Optional[float] = DEFAULT_TTL_DAYS,
+    force: bool = False,
+    descending: bool = True,
+    limit: Optional[int] = None,
+    dedupe_pixels: bool = False,
+) -> None:
+    """
+    Run pending ledger jobs on a process pool, recording every outcome.
+
+    At most 2 x workers jobs are in flight at once. If a worker dies (for
+    example by exceeding the memory limit) the pool is restarted and the
+    jobs that were in flight go back to the front of the queue, since any
+    one of them may have been the cause. A job caught in a second crash is
+    rerun alone, and a job that kills the pool while running alone is
+    marked failed, so only the culprit needs --retry-failed.
+    """
+    jobs = ledger.pending(descending=descending, limit=limit)
+    total = len(jobs)
+    logger.info(f"Pending jobs: {total}")
+    if not jobs:
+        return
+
+    queue: deque[str] = deque(job_id for job_id, _ in jobs)
+    # Jobs caught in two pool crashes, to be run one at a time
+    isolated: deque[str] = deque()
+    crashes: dict[str, int] = {}
+    in_flight: dict[Future, tuple[str, float]] = {}
+    completed = 0
+    run_start = time.perf_counter()
+
+    def make_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(bbox, memory_limit_mb, refresh_occurrences, offline, occurrence_ttl_days),
+        )
+
+    def submit(job_id: str) -> None:
+        taxon_key = int(job_id.split("/")[1])
+        ledger.mark_running(job_id)
+        future = pool.submit(
+            _run_job, taxon_key, model_type, refresh_occurrences, force, dedupe_pixels
+        )
+        in_flight[future] = (job_id, time.perf_counter())
+
+    pool = make_pool()
+    try:
+        while True:
+            if isolated:
+                # Wait for the pool to drain, then run the next one alone
+                if not in_flight:
+                    submit(isolated.popleft())
+            else:
+                while queue and len(in_flight) < workers * 2:
+                    submit(queue.popleft())
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken: list[tuple[str, float]] = []
+            for future in done:
+                job_id, submitted = in_flight.pop(future)
+                try:
+                    status, duration = future.result()
+                except BrokenProcessPool:
+                    broken.append((job_id, submitted))
+                    continue
+                except Exception as e:
+                    completed += 1
+                    error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                    ledger.mark_failed(job_id, error, time.perf_counter() - submitted)
+                    logger.error(f"[{completed}/{total}] {job_id}: failed: {error}")
+                    continue
+                completed += 1
+                ledger.mark_done(job_id, status, duration)
+                logger.info(f"[{completed}/{total}] {job_id}: {status} ({duration:.1f}s)")
+
+            if broken:
+                broken.extend(in_flight.values())
+                in_flight.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                if len(broken) == 1:
+                    # Alone in the pool, so this job killed the worker
+                    job_id, submitted = broken[0]
+                    completed += 1
+                    ledger.mark_failed(
+                        job_id,
+                        "worker process died (memory limit or crash)",
+                        time.perf_counter() - submitted,
+                    )
+                    logger.error(f"[{completed}/{total}] {job_id}: worker died")
+                else:
+                    retry = []
+                    for job_id, _ in broken:
+                        crashes[job_id] = crashes.get(job_id, 0) + 1
+                        if crashes[job_id] >= 2:
+                            isolated.append(job_id)
+                        else:
+                            retry.append(job_id)
+                    queue.extendleft(reversed(retry))
+                    logger.warning(
+                        f"Worker died with {len(broken)} jobs in flight; "
+                        f"requeued {len(retry)}, {len(isolated)} to run alone"
+                    )
+                pool = make_pool()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - run_start
+    logger.info(f"Processed {completed} jobs in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train classifier models for every species in a catalog"
+    )
+    parser.add_argument("--region", choices=list(REGIONS.keys()), help="Predefined region")
+    parser.add_argument("--bbox", help="Bounding box: min_lon,min_lat,max_lon,max_lat")
+    parser.add_argument("--catalog", default=str(CATALOG_PATH), help="species_key,occurrence_count CSV")
+    parser.add_argument("--min-count", type=int, default=MIN_REGION_OCCURRENCES,
+                        help="Minimum global occurrence count")
+    parser.add_argument("--max-count", type=int, help="Maximum global occurrence count")
+    parser.add_argument(
+        "--model-type",
+        type=str,
+        choices=["logistic", "mlp", "both"],
+        default="both",
+        help="Type of model to train: logistic, mlp, or both (default: both)",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes (default: 4)")
+    parser.add_argument("--memory-limit-mb", type=int, help="Address-space limit per worker")
+    parser.add_argument("--ledger", help="Job ledger path (default: models/ledger_{region}.sqlite)")
+    parser.add_argument("--limit", type=int, help="Run at most this many jobs")
+    parser.add_argument("--cheapest-first", action="store_true",
+                        help="Run cheapest jobs first (default: most expensive first)")
+    parser.add_argument("--retry-failed", action="store_true", help="Rerun jobs that failed previously")
+    parser.add_argument(
+        "--refresh-occurrences",
+        action="store_true",
+        help="Re-fetch GBIF occurrences and append new ones to the feature store",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only locally cached GBIF occurrences and the jobs already in the ledger",
+    )
+    parser.add_argument(
+        "--occurrence-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Re-fetch cached GBIF queries older than this (default: {DEFAULT_TTL_DAYS:g})",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Retrain every model even if its fingerprint is unchanged",
+    )
+    parser.add_argument(
+        "--dedupe-pixels",
+        action="store_true",
+        help="Collapse occurrences in the same pixel into one count-weighted positive",
+    )
+    args = parser.parse_args()
+
+    if args.region:
+        bbox = REGIONS[args.region]["bbox"]
+    elif args.bbox:
+        bbox = tuple(map(float, args.bbox.split(",")))
+    else:
+        parser.error("Specify --region or --bbox")
+
+    ledger_path = Path(args.ledger) if args.ledger else MODELS_DIR / f"ledger_{region_key(bbox, YEAR)}.sqlite"
+    ledger = JobLedger(ledger_path)
+
+    logger.info("=" * 60)
+    logger.info(f"Catalog training (type: {args.model_type}, workers: {args.workers})")
+    logger.info("=" * 60)
+
+    if args.offline:
+        # Job discovery needs the GBIF facet API; run what the ledger already has
+        logger.info("Offline: skipping job discovery, using jobs already in the ledger")
+        added = 0
+    else:
+        catalog = read_catalog(Path(args.catalog), args.min_count, args.max_count)
+        logger.info(f"Catalog species within count limits: {len(catalog):,}")
+
+        # Expected cost is the number of occurrences in the region
+        region_counts = fetch_species_counts(bbox)
+        jobs = [
+            (f"{args.model_type}/{key}", float(count))
+            for key, count in region_counts.items()
+            if key in catalog and count >= MIN_REGION_OCCURRENCES
+        ]
+        logger.info(f"Species with >= {MIN_REGION_OCCURRENCES} occurrences in region: {len(jobs):,}")
+
+        added = ledger.add_jobs(jobs)
+    reset = ledger.recover(retry_failed=args.retry_failed)
+    logger.info(f"Ledger: {ledger_path} ({added} new jobs, {reset} reset to pending)")
+
+    run_catalog(
+        ledger,
+        bbox,
+        model_type=args.model_type,
+        workers=args.workers,
+        memory_limit_mb=args.memory_limit_mb,
+        refresh_occurrences=args.refresh_occurrences,
+        offline=args.offline,
+        occurrence_ttl_days=args.occurrence_ttl_days,
+        force=args.force,
+        descending=not args.cheapest_first,
+        limit=args.limit,
+        dedupe_pixels=args.dedupe_pixels,
+    )
+
+    counts = ledger.counts()
+    ledger.close()
+    logger.info(f"\n{'='*60}")
+    logger.info("COMPLETE: " + ", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
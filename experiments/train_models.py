@@ -6,21 +6,35 @@ Supports two model types:
 1. LogisticRegression (logistic) - Simple, fast, interpretable
 2. MLP with MC Dropout (mlp) - Provides uncertainty estimates
 
-Models are saved to separate directories for comparison:
-- models/logistic/{taxon_key}.pkl
-- models/mlp/{taxon_key}.pt
+Models are saved per region (bbox and year, see finder.features.region_key),
+in separate directories for comparison:
+- models/{region}/logistic/{taxon_key}.pkl
+- models/{region}/mlp/{taxon_key}.pt
+
+Each model has a `{taxon_key}.fingerprint.json` sidecar; species whose
+training inputs have not changed since the last run are skipped.
 """
 
 import argparse
 import logging
+from collections import Counter
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
 import numpy as np
 
-from finder import get_species_info, fetch_occurrences, EmbeddingMosaic
+from finder import get_species_info, EmbeddingMosaic, FeatureStore, load_occurrence_features
+from finder.features import region_key
+from finder.background import BackgroundBank, load_background_bank, sample_background
+from finder.cache import DEFAULT_TTL_DAYS, MatchCache, OccurrenceCache
+from finder.ingest import OccurrenceArchive
+from finder.instrument import traced
+from finder.fingerprint import compute_fingerprint, read_fingerprint, write_fingerprint
 from finder.methods import ClassifierMethod, MLPClassifierMethod
-from finder.pipeline import REGIONS, sample_background
+from finder.names import resolve_names
+from finder.projection import EmbeddingProjection, load_projection, parse_projection_spec
+from finder.pipeline import REGIONS
+from finder.profiling import DEFAULT_TOP_N, PROFILE_MODES, profile_dir, profiling
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 logger = logging.getLogger(__name__)
@@ -28,6 +42,12 @@ logger = logging.getLogger(__name__)
 PROJECT_ROOT = Path(__file__).parent
 CACHE_DIR = PROJECT_ROOT / "cache"
 MODELS_DIR = PROJECT_ROOT / "models"
+PROFILES_DIR = PROJECT_ROOT / "output" / "profiles"
+FEATURES_DIR = CACHE_DIR / "features"
+BACKGROUND_DIR = CACHE_DIR / "background"
+OCCURRENCE_CACHE_PATH = CACHE_DIR / "gbif" / "occurrences.sqlite"
+OCCURRENCE_ARCHIVE_DIR = CACHE_DIR / "gbif" / "archive"
+MATCH_CACHE_PATH = CACHE_DIR / "gbif" / "names.sqlite"
 
 # Same species list as experiment.py
 SPECIES_LIST = [
@@ -44,85 +64,253 @@ NEGATIVE_RATIO = 5
 SEED = 42
 
 ModelType = Literal["logistic", "mlp", "both"]
-
-
+TrainStatus = Literal["retrained", "unchanged", "insufficient", "failed"]
+
+# Hyperparameters recorded in each model's fingerprint
+LOGISTIC_PARAMS = {
+    "max_iter": 1000,
+    "solver": "lbfgs",
+}
+MLP_PARAMS = {
+    "hidden_dim": 256,
+    "dropout_rate": 0.3,
+    "learning_rate": 1e-3,
+    "n_epochs": 100,
+    "batch_size": 64,
+}
+
+
+def region_models_dir(
+    bbox: tuple[float, float, float, float],
+    year: int,
+    models_dir: Path = MODELS_DIR,
+) -> Path:
+    """
+    Directory of the models trained on one region.
+
+    Keyed like the job ledger, so runs over different regions neither
+    overwrite each other's models nor retrain them back and forth;
+    predict_local.model_path picks the region containing the query point.
+    """
+    return Path(models_dir) / region_key(bbox, year)
+
+
+@traced("train_and_save_model")
 def train_and_save_model(
     species_name: str,
     mosaic: EmbeddingMosaic,
     model_type: ModelType = "both",
-) -> bool:
-    """Train classifier(s) for a species and save them."""
+    feature_store: Optional[FeatureStore] = None,
+    refresh_occurrences: bool = False,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    force: bool = False,
+    background_bank: Optional[BackgroundBank] = None,
+    bank_scaler: bool = False,
+    projection: Optional[EmbeddingProjection] = None,
+    match_cache: Optional[MatchCache] = None,
+    dedupe_pixels: bool = False,
+) -> TrainStatus:
+    """Resolve a species name, then train and save its classifier(s)."""
     logger.info(f"\n{'='*60}")
     logger.info(f"Training: {species_name}")
     logger.info("=" * 60)
 
     try:
-        # Get species info
-        species_info = get_species_info(species_name)
-        taxon_key = species_info["taxon_key"]
-        logger.info(f"  Taxon key: {taxon_key}")
-
-        # Fetch occurrences
-        bbox = REGIONS[REGION]["bbox"]
-        occurrences = fetch_occurrences(taxon_key, bbox)
-        logger.info(f"  Occurrences: {len(occurrences)}")
-
-        if len(occurrences) < 5:
-            logger.info("  Not enough occurrences, skipping")
-            return False
-
-        # Sample embeddings
-        positive_embeddings, valid_coords = mosaic.sample_at_coords(occurrences)
-        logger.info(f"  Valid embeddings: {len(positive_embeddings)}")
+        species_info = get_species_info(species_name, match_cache)
+        return train_species(
+            species_info["taxon_key"],
+            mosaic,
+            model_type=model_type,
+            feature_store=feature_store,
+            refresh_occurrences=refresh_occurrences,
+            occurrence_cache=occurrence_cache,
+            occurrence_archive=occurrence_archive,
+            force=force,
+            background_bank=background_bank,
+            bank_scaler=bank_scaler,
+            projection=projection,
+            dedupe_pixels=dedupe_pixels,
+        )
+    except Exception as e:
+        logger.error(f"  Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return "failed"
 
-        if len(positive_embeddings) < 5:
-            logger.info("  Not enough valid embeddings, skipping")
-            return False
 
-        # Sample background
-        n_background = len(positive_embeddings) * NEGATIVE_RATIO
+def train_species(
+    taxon_key: int,
+    mosaic: EmbeddingMosaic,
+    model_type: ModelType = "both",
+    feature_store: Optional[FeatureStore] = None,
+    refresh_occurrences: bool = False,
+    occurrence_cache: Optional[OccurrenceCache] = None,
+    occurrence_archive: Optional[OccurrenceArchive] = None,
+    force: bool = False,
+    verbose: bool = True,
+    background_bank: Optional[BackgroundBank] = None,
+    bank_scaler: bool = False,
+    projection: Optional[EmbeddingProjection] = None,
+    dedupe_pixels: bool = False,
+) -> TrainStatus:
+    """
+    Train classifier(s) for a taxon key and save them.
+
+    A model is only retrained when the fingerprint of its inputs (occurrence
+    set, background seed, embedding year and hyperparameters) differs from
+    the one saved alongside it, unless `force` is set. Errors propagate to
+    the caller.
+
+    Background samples come from `background_bank` when given (optionally
+    standardizing with the bank's statistics), otherwise they are drawn from
+    the mosaic directly. With a `projection`, classifiers train and score in
+    the projected space and carry the projection in the saved model. With
+    `dedupe_pixels`, occurrences sharing a pixel become one positive weighted
+    by their count.
+
+    Returns:
+        "retrained" if any model was trained, "unchanged" if every requested
+        model was already up to date, "insufficient" if there is too little
+        occurrence data to train
+    """
+    logger.info(f"  Taxon key: {taxon_key}")
+
+    # Fetch occurrences and sample embeddings (or read them from the store)
+    features = load_occurrence_features(
+        taxon_key,
+        mosaic,
+        store=feature_store,
+        refresh=refresh_occurrences,
+        occurrence_cache=occurrence_cache,
+        occurrence_archive=occurrence_archive,
+    )
+    logger.info(f"  Occurrences: {features.n_occurrences}")
+
+    if features.n_occurrences < 5:
+        logger.info("  Not enough occurrences, skipping")
+        return "insufficient"
+
+    positive_embeddings = np.asarray(features.embeddings)
+    valid_coords = features.valid_coords
+    n_valid = len(positive_embeddings)
+    logger.info(f"  Valid embeddings: {n_valid}")
+
+    if n_valid < 5:
+        logger.info("  Not enough valid embeddings, skipping")
+        return "insufficient"
+
+    positive_weights = None
+    if dedupe_pixels:
+        positive_embeddings, positive_weights, _ = features.unique_pixels()
+        logger.info(
+            f"  Unique pixels: {len(positive_embeddings)} "
+            f"({len(positive_embeddings) / n_valid:.1%} of valid occurrences)"
+        )
+        if len(positive_embeddings) < 2:
+            logger.info("  Not enough distinct pixels, skipping")
+            return "insufficient"
+
+    # Work out which models are stale
+    region_params = {"bbox": list(mosaic.bbox), "negative_ratio": NEGATIVE_RATIO}
+    if background_bank is not None:
+        region_params["background"] = {
+            "bank_size": len(background_bank),
+            "bank_seed": background_bank.seed,
+            "bank_scaler": bank_scaler,
+        }
+    if projection is not None:
+        region_params["projection"] = projection.name
+    if dedupe_pixels:
+        region_params["dedupe_pixels"] = True
+    models_dir = region_models_dir(mosaic.bbox, mosaic.year)
+    logistic_path = models_dir / "logistic" / f"{taxon_key}.pkl"
+    mlp_path = models_dir / "mlp" / f"{taxon_key}.pt"
+    fingerprints = {
+        "logistic": compute_fingerprint(
+            features.coords, SEED, mosaic.year, {**region_params, **LOGISTIC_PARAMS}
+        ),
+        "mlp": compute_fingerprint(
+            features.coords, SEED, mosaic.year, {**region_params, **MLP_PARAMS}
+        ),
+    }
+    requested = ["logistic", "mlp"] if model_type == "both" else [model_type]
+    paths = {"logistic": logistic_path, "mlp": mlp_path}
+    stale = [
+        name for name in requested
+        if force or read_fingerprint(paths[name]) != fingerprints[name]
+    ]
+
+    if not stale:
+        logger.info("  Models up to date, skipping")
+        return "unchanged"
+
+    # Sample background (sized by occurrence count, so deduplication keeps
+    # the class balance)
+    n_background = n_valid * NEGATIVE_RATIO
+    scaler = None
+    if background_bank is not None:
+        negative_embeddings, _ = background_bank.take(
+            n_background, exclude_pixels=features.valid_pixels, mosaic=mosaic, seed=SEED
+        )
+        if bank_scaler:
+            scaler = background_bank.scaler(projection)
+    else:
         negative_embeddings, _ = sample_background(
             mosaic, n_background, valid_coords, seed=SEED
         )
-        logger.info(f"  Background samples: {len(negative_embeddings)}")
-
-        # Train and save Logistic Regression
-        if model_type in ("logistic", "both"):
-            logger.info("  Training Logistic Regression...")
-            logistic_classifier = ClassifierMethod()
-            logistic_classifier.fit(positive_embeddings, negative_embeddings)
-
-            logistic_dir = MODELS_DIR / "logistic"
-            logistic_dir.mkdir(parents=True, exist_ok=True)
-            logistic_path = logistic_dir / f"{taxon_key}.pkl"
-            logistic_classifier.save(logistic_path)
-            logger.info(f"  Saved: {logistic_path}")
-
-        # Train and save MLP with MC Dropout
-        if model_type in ("mlp", "both"):
-            logger.info("  Training MLP with MC Dropout...")
-            mlp_classifier = MLPClassifierMethod(
-                hidden_dim=256,
-                dropout_rate=0.3,
-                learning_rate=1e-3,
-                n_epochs=100,
-                batch_size=64,
-            )
-            mlp_classifier.fit(positive_embeddings, negative_embeddings, verbose=True)
+    logger.info(f"  Background samples: {len(negative_embeddings)}")
+
+    # Train and save Logistic Regression
+    if "logistic" in stale:
+        logger.info("  Training Logistic Regression...")
+        logistic_classifier = ClassifierMethod(projection=projection)
+        logistic_classifier.fit(
+            positive_embeddings,
+            negative_embeddings,
+            scaler=scaler,
+            positive_weights=positive_weights,
+        )
 
-            mlp_dir = MODELS_DIR / "mlp"
-            mlp_dir.mkdir(parents=True, exist_ok=True)
-            mlp_path = mlp_dir / f"{taxon_key}.pt"
-            mlp_classifier.save(mlp_path)
-            logger.info(f"  Saved: {mlp_path}")
+        logistic_path.parent.mkdir(parents=True, exist_ok=True)
+        logistic_classifier.save(logistic_path)
+        write_fingerprint(
+            logistic_path,
+            fingerprints["logistic"],
+            n_occurrences=features.n_occurrences,
+            n_positives=len(positive_embeddings),
+            seed=SEED,
+            year=mosaic.year,
+            params={**region_params, **LOGISTIC_PARAMS},
+        )
+        logger.info(f"  Saved: {logistic_path}")
+
+    # Train and save MLP with MC Dropout
+    if "mlp" in stale:
+        logger.info("  Training MLP with MC Dropout...")
+        mlp_classifier = MLPClassifierMethod(**MLP_PARAMS, projection=projection)
+        mlp_classifier.fit(
+            positive_embeddings,
+            negative_embeddings,
+            verbose=verbose,
+            scaler=scaler,
+            positive_weights=positive_weights,
+        )
 
-        return True
+        mlp_path.parent.mkdir(parents=True, exist_ok=True)
+        mlp_classifier.save(mlp_path)
+        write_fingerprint(
+            mlp_path,
+            fingerprints["mlp"],
+            n_occurrences=features.n_occurrences,
+            n_positives=len(positive_embeddings),
+            seed=SEED,
+            year=mosaic.year,
+            params={**region_params, **MLP_PARAMS},
+        )
+        logger.info(f"  Saved: {mlp_path}")
 
-    except Exception as e:
-        logger.error(f"  Error: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    return "retrained"
 
 
 def main():
@@ -136,30 +324,134 @@ def main():
         default="both",
         help="Type of model to train: logistic, mlp, or both (default: both)",
     )
+    parser.add_argument(
+        "--refresh-occurrences",
+        action="store_true",
+        help="Re-fetch GBIF occurrences and append new ones to the feature store",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only locally cached GBIF data; never contact the API",
+    )
+    parser.add_argument(
+        "--occurrence-ttl-days",
+        type=float,
+        default=DEFAULT_TTL_DAYS,
+        help=f"Re-fetch cached GBIF queries older than this (default: {DEFAULT_TTL_DAYS:g})",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Retrain every model even if its fingerprint is unchanged",
+    )
+    parser.add_argument(
+        "--bank-scaler",
+        action="store_true",
+        help="Standardize with the background bank's statistics instead of refitting per species",
+    )
+    parser.add_argument(
+        "--projection",
+        help="Train and score in a reduced embedding space, e.g. pca:64 or random:64",
+    )
+    parser.add_argument(
+        "--dedupe-pixels",
+        action="store_true",
+        help="Collapse occurrences in the same pixel into one count-weighted positive",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the run with cProfile or a stack sampler; artifacts go to output/profiles/",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Take tracemalloc snapshots around the heavy stages (slower)",
+    )
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP_N,
+                        help=f"Functions listed in the hotspot summary (default: {DEFAULT_TOP_N})")
     args = parser.parse_args()
 
-    model_type: ModelType = args.model_type
-
-    logger.info("=" * 60)
-    logger.info(f"Training Classifier Models (type: {model_type})")
-    logger.info("=" * 60)
-
-    # Load mosaic once
-    bbox = REGIONS[REGION]["bbox"]
-    logger.info(f"\nLoading embedding mosaic for {REGION}...")
-    mosaic = EmbeddingMosaic(CACHE_DIR, bbox)
-    mosaic.load()
-    logger.info(f"Mosaic shape: {mosaic.shape}")
+    with profiling(
+        profile_dir(PROFILES_DIR, "train_models"),
+        mode=args.profile,
+        memory=args.profile_memory,
+        top_n=args.profile_top,
+        name="train_models.py",
+        model_type=args.model_type,
+        projection=args.projection,
+    ):
+        model_type: ModelType = args.model_type
+
+        logger.info("=" * 60)
+        logger.info(f"Training Classifier Models (type: {model_type})")
+        logger.info("=" * 60)
+
+        # Load mosaic once
+        bbox = REGIONS[REGION]["bbox"]
+        logger.info(f"\nLoading embedding mosaic for {REGION}...")
+        mosaic = EmbeddingMosaic(CACHE_DIR, bbox)
+        mosaic.load()
+        logger.info(f"Mosaic shape: {mosaic.shape}")
+
+        # Train models for each species
+        feature_store = FeatureStore(FEATURES_DIR)
+        background_bank = load_background_bank(mosaic, BACKGROUND_DIR, seed=SEED)
+        logger.info(f"Background bank: {len(background_bank):,} pixels")
+
+        projection = None
+        if args.projection:
+            method, k = parse_projection_spec(args.projection)
+            projection = load_projection(CACHE_DIR, bbox, k, method=method, year=mosaic.year, seed=SEED)
+            logger.info(f"Projection: {projection.name} ({projection.input_dim} -> {k} dims)")
+
+        occurrence_cache = OccurrenceCache(
+            OCCURRENCE_CACHE_PATH,
+            ttl_days=args.occurrence_ttl_days,
+            refresh="always" if args.refresh_occurrences else "auto",
+            offline=args.offline,
+        )
+        match_cache = MatchCache(MATCH_CACHE_PATH, offline=args.offline)
+        occurrence_archive = (
+            OccurrenceArchive(OCCURRENCE_ARCHIVE_DIR) if OCCURRENCE_ARCHIVE_DIR.exists() else None
+        )
 
-    # Train models for each species
-    success_count = 0
-    for species in SPECIES_LIST:
-        if train_and_save_model(species, mosaic, model_type=model_type):
-            success_count += 1
+        # Resolve all names up front and drop doubtful matches
+        species_list = []
+        for match in resolve_names(SPECIES_LIST, match_cache=match_cache):
+            if match.usable:
+                species_list.append(match.name)
+            else:
+                logger.warning(f"Skipping {match.name}: {', '.join(match.flags)}")
+
+        counts = Counter()
+        counts["flagged"] = len(SPECIES_LIST) - len(species_list)
+        for species in species_list:
+            status = train_and_save_model(
+                species,
+                mosaic,
+                model_type=model_type,
+                feature_store=feature_store,
+                refresh_occurrences=args.refresh_occurrences,
+                occurrence_cache=occurrence_cache,
+                occurrence_archive=occurrence_archive,
+                force=args.force,
+                background_bank=background_bank,
+                bank_scaler=args.bank_scaler,
+                projection=projection,
+                match_cache=match_cache,
+                dedupe_pixels=args.dedupe_pixels,
+            )
+            counts[status] += 1
 
-    logger.info(f"\n{'='*60}")
-    logger.info(f"COMPLETE: {success_count}/{len(SPECIES_LIST)} models saved")
-    logger.info("=" * 60)
+        logger.info(f"\n{'='*60}")
+        logger.info(
+            f"COMPLETE: {counts['retrained']} retrained, {counts['unchanged']} unchanged, "
+            f"{counts['insufficient']} insufficient, {counts['failed']} failed, "
+            f"{counts['flagged']} flagged ({len(SPECIES_LIST)} species)"
+        )
+        logger.info("=" * 60)
 
 
 if __name__ == "__main__":